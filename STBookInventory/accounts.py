@@ -0,0 +1,62 @@
+#Account creation shared by signup/ and the import_users command. The password is hashed before the transaction starts (a hash
+#is the slow part, hundreds of milliseconds of CPU, and nothing should hold the database while it runs), then the user row and its
+#API token are inserted in one transaction: one INSERT each for a signup, one bulk INSERT per batch for an import.
+#The plain text password is never written anywhere.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+
+def new_user(email, password, **fields):
+    #An unsaved User with the password already hashed. An empty password gives an unusable one (the user has to reset it first)
+    user = User(email=User.objects.normalize_email(email), **fields)
+    user.set_password(password or None)
+    return user
+
+
+def _setup_worker(): #Runs in each hashing process. Needed when processes are spawned rather than forked (macOS, Windows)
+    if not settings.configured:
+        django.setup()
+
+
+def hash_passwords(passwords, processes=None):
+    #make_password for every password, spread over `processes` processes (settings.PASSWORD_HASH_PROCESSES, 0 = one per CPU).
+    #Hashing is pure CPU in python, so threads would take turns on one core, processes use them all
+    processes = processes or settings.PASSWORD_HASH_PROCESSES or os.cpu_count() or 1
+    usable = [password for password in passwords if password]
+    if processes == 1 or len(usable) < 2:
+        hashed = [make_password(password) for password in usable]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(usable)), initializer=_setup_worker) as pool:
+            hashed = list(pool.map(make_password, usable, chunksize=max(1, len(usable) // (processes * 4))))
+    hashed = iter(hashed)
+    return [next(hashed) if password else make_password(None) for password in passwords]
+
+
+def create_accounts(users, tokens=True, groups=None):
+    #Inserts the (unsaved, already hashed) users, an API token for each when tokens is True, and their group memberships
+    #(groups[i] is the list of group ids of users[i]). All in one transaction, returns the tokens in the order of users
+    with transaction.atomic():
+        if len(users) == 1:
+            users[0].save(force_insert=True) #INSERT straight away, and the new id comes back on every database
+        else:
+            User.objects.bulk_create(users)
+            if not connection.features.can_return_rows_from_bulk_insert: #Postgres hands the new ids back from bulk_create. SQLite does not, so look them up by their unique email
+                ids = dict(User.objects.filter(email__in=[user.email for user in users]).values_list('email', 'id'))
+                for user in users:
+                    user.pk = ids[user.email]
+        created = []
+        if tokens:
+            created = Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users]) #Token.save() would first try an UPDATE, its key is the primary key
+        if groups:
+            membership = User.groups.through
+            membership.objects.bulk_create([membership(user_id=user.pk, group_id=group) for user, ids in zip(users, groups) for group in ids])
+    return created
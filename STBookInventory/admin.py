@@ -7,8 +7,18 @@ from .models import User
 from .models import Book
 from .models import BookCheckout
 
-admin.site.register(Book) #Register my book model
-admin.site.register(BookCheckout) #Register my BookCheckout model
+@admin.register(Book) #Register my book model
+class BookAdmin(admin.ModelAdmin):
+    list_display = ('title', 'author', 'isbn', 'available_copies', 'user')
+    list_select_related = ('user',) #The changelist shows the user who added each book, fetch them with a JOIN instead of one query per row
+    raw_id_fields = ('user',) #Avoids loading every user into a dropdown on the change form
+
+
+@admin.register(BookCheckout) #Register my BookCheckout model
+class BookCheckoutAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'checkout_date_time', 'returned_at')
+    list_select_related = ('user', 'book') #BookCheckout.__str__ reads both the user's name and the book's title
+    raw_id_fields = ('user', 'book')
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -1,20 +1,34 @@
-from .serializers import BookSerializer #This line imports the BookSerializer class from a module located in the same directory as the current module. The . in the import statement indicates the current package or directory. In this context, it means that the BookSerializer class is defined in a module within the same app.
+from .serializers import BookSerializer, book_fields, book_rows #This line imports the BookSerializer class from a module located in the same directory as the current module. The . in the import statement indicates the current package or directory. In this context, it means that the BookSerializer class is defined in a module within the same app.
+from django.conf import settings
 from rest_framework.response import Response
-from rest_framework.authentication import TokenAuthentication, SessionAuthentication
+from rest_framework.authentication import SessionAuthentication
+from .authentication import CachedTokenAuthentication #Token authentication that caches the token -> user id mapping (see authentication.py)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import authentication_classes, permission_classes
 
-from rest_framework.decorators import api_view, parser_classes
+from rest_framework.decorators import api_view, parser_classes, renderer_classes, throttle_classes
+from .throttling import throttles_for #Token buckets per IP and per account for login, signup, forgot_password and password_reset
+from rest_framework.renderers import BrowsableAPIRenderer
+from .renderers import FastJSONRenderer
 from rest_framework.parsers import JSONParser
+from .parsers import NDJSONParser
 from .models import User
 from .serializers import UserSerializer
+from .serializers import BookCheckoutSerializer
 from rest_framework import status
 
 from .models import Book #Similar to the previous line, this imports the Book model from a module located in the same directory. It's common to organize your Django app with models, views, and serializers in the same package or directory.
 from .models import User
 from .models import BookCheckout
+from . import services #Shared inventory logic (atomic checkout etc.)
+from . import inventory, search
+from . import versioning #ETag / Last-Modified for the book read endpoints
+from . import response_cache
+from . import export #Streaming NDJSON/CSV export of the books and the checkout history
+from . import accounts #Account creation (signup and the import_users command)
 
 from rest_framework.pagination import PageNumberPagination #Implementing pagination for REST API JSON view
+from .pagination import BookKeysetPagination
 from rest_framework.response import Response #This line imports the Response class from the response module of the Django REST framework. The Response class is used to create HTTP responses for API views. You can return Response objects from your API views to send data back to clients in a structured format, typically as JSON.
 from rest_framework.decorators import api_view #This line imports the api_view decorator from the decorators module of the Django REST framework. The api_view decorator is used to define view functions that can handle different HTTP methods (GET, POST, PUT, DELETE, etc.)  for specific API endpoints. By applying the api_view decorator to a function, you can ensure that the view function only responds to the specified HTTP methods and follows RESTful conventions.
 
@@ -31,14 +45,16 @@ from django.contrib.auth import update_session_auth_hash
 from django.shortcuts import get_object_or_404
 
 import secrets
-from django.core.mail import send_mail
+from . import mail
 from django.urls import reverse
 
 from .serializers import ForgotPasswordSerializer
 from django.core.cache import cache  # Import cache module
 
 import json
-from django.http import JsonResponse
+import types
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError
 from django.contrib.auth.hashers import make_password
 from django.views.decorators.csrf import csrf_exempt
 
@@ -50,48 +66,76 @@ from drf_spectacular.utils import extend_schema #To make the schema help details
 #CRUD Operations GET POST PUT/PATCH DELETE
 
 @api_view(["POST"]) ##This is a decorator provided by Django REST framework (DRF). It specifies that the add_book_view function should only respond to HTTP POST requests. This means that the view will handle requests where clients want to create new book records. It enforces the RESTful convention of using specific HTTP methods for specific actions. #This is the view function that handles the incoming HTTP POST request for adding a new book. It takes a request object as a parameter, which contains information about the client's request, including the data sent in the request.
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, NDJSONParser]) #Accepts application/json (an object or a list of objects) and application/x-ndjson (one object per line, for very large uploads)
 def add_book_view(request):
     if not request.auth: # Your custom authentication logic to check for the presence of the token
         return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
         
     if request.method == "POST": #This conditional checks if the HTTP method used for the request is indeed a POST request. This is a safety measure to ensure that the view only processes POST requests.
-        request.data['user'] = request.user.id # Ensure the 'user' field in the posted JSON data is equal to the id of the logged-in user
         if isinstance(request.data, dict):  #Check if the data is a single JSON object
             data = [request.data]  # Convert the single object to a list
-        elif isinstance(request.data, list): #Check if the data is a multiple JSON objects
+        elif isinstance(request.data, (list, types.GeneratorType)): #Check if the data is a multiple JSON objects (a JSON list, or an NDJSON upload that is parsed lazily line by line)
             data = request.data #No convertion needed if input data is a list
         else:
             return Response({"error": "Invalid data format"}, status=status.HTTP_400_BAD_REQUEST)
 
-        responses = []   #create an empty list array
+        #The books are validated and inserted in chunks (settings.BOOK_BULK_CREATE_BATCH_SIZE): one isbn__in query and one bulk INSERT per chunk instead of a SELECT and an INSERT per book.
+        #The 'user' field of every book is always the logged in user, whatever the posted JSON says.
+        #If any single book_data is not valid, that particular book's validation errors are returned in its place in the list, all the other books are still created
+        responses = services.bulk_add_books(data, request.user)
 
-        for book_data in data: #this iterates over each element in the data list the user provided
-            serializer = BookSerializer(data=book_data) #Here, a BookSerializer instance is created for each book_data, and it's initialized with the data extracted from the request. The purpose of the serializer is to validate the incoming data and convert it into a format suitable for creating a new book record in the database
-            if serializer.is_valid(): #This conditional checks if the data provided in the request is valid according to the rules specified in the BookSerializer class. The is_valid() method is a validation step provided by DRF to ensure the data complies with the defined model and serializer rules
-                serializer.save()
-                responses.append(serializer.data) # Append the serialized data to the empty responses list
-            else:
-                responses.append(serializer.errors) # If any single book_data is not valid, append that particular book's validation errors to the responses list. So if in your json list provided to create multiple books, some few books had error with their syntax, all the other books will still be created and the ones that had errors will show error in their particular json response
-                
         return Response(responses, status=status.HTTP_201_CREATED) # Return the combined responses for all books
     else:
         return Response({"error": "Invalid HTTP method"}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         
 
+#The main queryset of the read endpoints below. query_audit.py runs EXPLAIN on these same functions, so the plan audit checks the queries the views really run
+
+def book_queryset(book_id): #read/api/<id>/
+    return Book.objects.filter(id=book_id)
+
+
+def book_list_queryset(): #read/api/. An explicit order so the same page always holds the same books
+    return Book.objects.order_by('id')
+
+
+def loans_queryset(borrower_id, overdue=False): #loans/api/
+    if overdue:
+        return BookCheckout.objects.overdue().order_by('checkout_date_time', 'id')
+    return BookCheckout.objects.held_by(borrower_id).order_by('checkout_date_time', 'id')
+
+
 @api_view(["GET"]) #This is the view function that handles the incoming HTTP GET request. It takes two parameters: request and book_id. The request parameter contains information about the client's request, and book_id is a parameter extracted from the URL, typically used to identify the specific book to retrieve.
-@authentication_classes([TokenAuthentication,SessionAuthentication])
+@authentication_classes([CachedTokenAuthentication,SessionAuthentication])
 @permission_classes([IsAuthenticated])
 def get_book_view(request, book_id):
     if not request.auth: # Your custom authentication logic to check for the presence of the token
         return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
     
+    fields = book_fields(request) #?fields=id,title: only these fields are selected and returned
+    current = versioning.book_version(book_id) #Only the version and updated_at columns: enough for the ETag check and the response cache key
+    if current is None:
+        return Response({'error': 'Book does not exist'}, status=status.HTTP_404_NOT_FOUND)
+    etag = versioning.book_etag(book_id, current[0], request)
+    unchanged = versioning.not_modified(request, etag, current[1]) #The client already has this version: 304 without loading or serializing the book
+    if unchanged is not None:
+        return unchanged
+
+    key, data = response_cache.get('read_book_api', current, request, book_id)
+    if data is not None:
+        return versioning.set_validators(Response(data), etag, current[1])
     try:
-        book = Book.objects.filter(id=book_id).first() #In this line, the view retrieves a book record from the database using the book_id provided in the URL. It uses the Django Object-Relational Mapping (ORM) to filter the Book model by the id field, which should match the book_id provided in the URL. The first() method is used to get the first matching book if it exists. We removed .first() so that the try except function is able to read the error, otherwise it returns the first occurence of the book which in this case are empty fields
+        books = book_queryset(book_id)
+        if fields is not None:
+            books = books.only(*fields, 'version', 'updated_at') #The ETag and Last-Modified need these two
+        book = books.first() #In this line, the view retrieves a book record from the database using the book_id provided in the URL. It uses the Django Object-Relational Mapping (ORM) to filter the Book model by the id field, which should match the book_id provided in the URL. The first() method is used to get the first matching book if it exists. We removed .first() so that the try except function is able to read the error, otherwise it returns the first occurence of the book which in this case are empty fields
         if book:
-            serializer = BookSerializer(book)
-            return Response(serializer.data)
+            serializer = BookSerializer(book, fields=fields)
+            if book.version == current[0]: #Not changed since the version was read, so the data belongs under that key
+                response_cache.set(key, serializer.data)
+            return versioning.set_validators(Response(serializer.data), versioning.book_etag(book.id, book.version, request), book.updated_at)
         else:
             return Response({'error': 'Book does not exist'}, status=status.HTTP_404_NOT_FOUND)
     except: #This conditional checks if a book with the specified book_id was found in the database. If a book exists, the condition evaluates to True.
@@ -99,25 +143,78 @@ def get_book_view(request, book_id):
     
 
 @api_view(["GET"]) #This is the view function that handles the incoming HTTP GET request. It takes two parameters: request and book_id. The request parameter contains information about the client's request, and book_id is a parameter extracted from the URL, typically used to identify the specific book to retrieve.
-@authentication_classes([TokenAuthentication,SessionAuthentication]) #Session Auth makes it possible for user login in browsable api
+@authentication_classes([CachedTokenAuthentication,SessionAuthentication]) #Session Auth makes it possible for user login in browsable api
 @permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer]) #orjson for the JSON, when it is installed
 def get_all_books_view(request):
     if not request.auth: # Your custom authentication logic to check for the presence of the token
         return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
-        
-    paginator = PageNumberPagination()
-    paginator.page_size = 10
-    books = Book.objects.all()
-    if books: #This conditional checks if a book with the specified book_id was found in the database. If a book exists, the condition evaluates to True.
-        result_page = paginator.paginate_queryset(books,request)
-        serializer = BookSerializer(result_page, many=True) #Here, a BookSerializer instance is created, and it's initialized with the book object that was retrieved from the database. The purpose of the serializer is to convert the book object into a serialized format that can be easily rendered as JSON or another content type for the response.
-        return paginator.get_paginated_response(serializer.data) #If a book was found and successfully serialized, this line returns a DRF Response object. The response contains the serialized data of the book, which is typically returned to the client as a JSON response. This allows the client to receive detailed information about the book. The HTTP status code of the response will be 200 (OK) by default, indicating a successful GET request.
+
+    fields = book_fields(request) #?fields=id,title: only these columns are selected and returned (mobile clients). Checked first, so a bad value is a 400 and never a 304
+    version, updated_at = versioning.catalogue_version() #Read before the books, so a write in between can only make the ETag older than the page, never newer
+    etag = versioning.catalogue_etag(version, request)
+    unchanged = versioning.not_modified(request, etag, updated_at) #Nothing was written since the client's copy: 304 without loading a single book
+    if unchanged is not None:
+        return unchanged
+
+    key, data = response_cache.get('read_all_books_api', (version, updated_at), request) #Keyed by the query string (page, cursor, ordering) and the catalogue version
+    if data is not None:
+        return versioning.set_validators(Response(data), etag, updated_at)
+
+    if request.query_params.get('pagination') == 'cursor': #?pagination=cursor switches to keyset pagination (ordered by id, or by title with ?ordering=title). There is no COUNT(*) and no OFFSET, so every page costs the same no matter how deep a client crawls
+        paginator = BookKeysetPagination()
+    else:
+        paginator = PageNumberPagination()
+        paginator.page_size = 10
+    paginator.page_size_query_param = 'page_size' #?page_size=... for clients that want bigger pages, up to max_page_size
+    paginator.max_page_size = settings.BOOK_MAX_PAGE_SIZE
+    columns = fields
+    if fields is not None and isinstance(paginator, BookKeysetPagination): #The next cursor is made from the last row's id (and title)
+        columns = fields + [column for column in ('id', 'title') if column not in fields]
+    books = book_rows(book_list_queryset(), columns) #book_rows reads plain dicts with the BookSerializer fields instead of model instances (see serializers.py)
+    result_page = paginator.paginate_queryset(books,request)
+    if result_page: #This conditional checks if any books were found for this page. If the catalogue is empty, we fall through to the 404 below
+        response = paginator.get_paginated_response(result_page) #The rows already have BookSerializer's output format, so there is nothing left to serialize
+        if columns != fields: #Drop the columns only the cursor needed
+            response.data['results'] = [{field: row[field] for field in fields} for row in result_page]
+        response_cache.set(key, response.data)
+        return versioning.set_validators(response, etag, updated_at) #This line returns a DRF Response object containing the serialized page of books together with the links to the neighbouring pages. The HTTP status code of the response will be 200 (OK) by default, indicating a successful GET request.
 
     return Response({"detail": "No books found."}, status=status.HTTP_404_NOT_FOUND) # If no books were found, return a 404 response
 
 
+@api_view(["GET"])
+@authentication_classes([CachedTokenAuthentication,SessionAuthentication])
+@permission_classes([IsAuthenticated])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
+def search_books_view(request): #GET search/api/?query=...&limit=... searches title, author and ISBN through the search index and returns the best matches first
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    query = request.query_params.get('query', '')
+    try:
+        limit = min(int(request.query_params.get('limit', search.DEFAULT_LIMIT)), search.DEFAULT_LIMIT) #Clients can ask for fewer results, never more than the default
+    except ValueError:
+        return Response({"error": "limit must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = book_fields(request)
+    books = search.search_books(query, limit=max(limit, 1), columns=fields)
+    serializer = BookSerializer(books, many=True, fields=fields)
+    return Response({"query": query, "results": serializer.data})
+
+
+@api_view(["GET"])
+@authentication_classes([CachedTokenAuthentication,SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def inventory_summary_view(request): #GET inventory/api/ returns the number of titles, available copies and checked out copies, in total and per author. The numbers come from counters kept up to date on every write (see inventory.py), not from adding up every book on each call
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    return Response(inventory.summary())
+
+
 @api_view(["PATCH"])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def update_book_view(request, book_id):
     if not request.auth: # Your custom authentication logic to check for the presence of the token
@@ -140,38 +237,209 @@ def update_book_view(request, book_id):
 
 
 
+BULK_MODES = ('all_or_nothing', 'best_effort')
+
+
+def _bulk_operations(request):
+    #Reads the body of the bulk endpoints: {"mode": "all_or_nothing" (the default) or "best_effort", "operations": [{"book_id": 1, ...}, ...]}
+    #or just the list of operations. Returns (mode, operations, None), or (None, None, an error Response)
+    data = request.data if isinstance(request.data, dict) else {'operations': request.data}
+    mode, operations = data.get('mode', 'all_or_nothing'), data.get('operations')
+    if mode not in BULK_MODES:
+        return None, None, Response({"error": f"mode must be one of {', '.join(BULK_MODES)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(operations, list) or not operations:
+        return None, None, Response({"error": "operations must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    if len(operations) > settings.BULK_OPERATIONS_MAX:
+        return None, None, Response({"error": f"At most {settings.BULK_OPERATIONS_MAX} operations per request"}, status=status.HTTP_400_BAD_REQUEST)
+    for operation in operations:
+        if not isinstance(operation, dict) or type(operation.get('book_id')) is not int:
+            return None, None, Response({"error": "Every operation must be an object with an integer book_id"}, status=status.HTTP_400_BAD_REQUEST)
+    return mode, operations, None
+
+
+def _bulk_response(mode, operations, results, applied):
+    #One entry per operation, with the status code and body the single book endpoint would have answered. When an all_or_nothing
+    #request fails, the operations that were fine are reported with 424 (Failed Dependency): nothing was written.
+    #The response is 200 when everything was applied, 207 (Multi-Status) when best_effort applied only some of it, 400 otherwise
+    failed = False
+    for operation, result in zip(operations, results):
+        result['book_id'] = operation['book_id']
+        if result['status'] == status.HTTP_200_OK and not applied:
+            result.update(status=status.HTTP_424_FAILED_DEPENDENCY, detail="Not applied: another operation of this request failed.")
+        failed = failed or result['status'] != status.HTTP_200_OK
+    code = status.HTTP_200_OK if not failed else status.HTTP_207_MULTI_STATUS if applied else status.HTTP_400_BAD_REQUEST
+    return Response({"mode": mode, "applied": applied, "results": results}, status=code)
+
+
+@api_view(["PATCH"])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bulk_checkout_view(request): #PATCH checkout/api/bulk/ checks out a stack of books in one request and one transaction: {"operations": [{"book_id": 1}, {"book_id": 2}], "mode": "best_effort"}. The same book_id twice takes two copies. {"user": <id>} checks them out for another user
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    user = request.user
+    if user.account_type not in ['Admin', 'Staff Member']: #The same people who can use checkout/api/<book_id>/
+        return Response({"detail": "Permission Denied: User does not have the required account_type"}, status=status.HTTP_403_FORBIDDEN)
+
+    mode, operations, error = _bulk_operations(request)
+    if error is not None:
+        return error
+    borrower = user
+    if isinstance(request.data, dict) and request.data.get('user') is not None:
+        try:
+            borrower = User.objects.filter(pk=int(request.data['user'])).first()
+        except (TypeError, ValueError):
+            return Response({"error": "user must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+        if borrower is None:
+            return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    results, applied = services.bulk_checkout([operation['book_id'] for operation in operations], borrower, all_or_nothing=mode == 'all_or_nothing')
+    answers = {
+        services.CHECKOUT_OK: (status.HTTP_200_OK, "Book checked out successfully."),
+        services.CHECKOUT_NOT_FOUND: (status.HTTP_404_NOT_FOUND, "Book not found."),
+        services.CHECKOUT_NO_COPIES: (status.HTTP_400_BAD_REQUEST, "No available copies of the book."),
+    }
+    return _bulk_response(mode, operations, [{'status': answers[result][0], 'detail': answers[result][1]} for result in results], applied)
+
+
+@api_view(["PATCH"])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def bulk_update_view(request): #PATCH update/api/bulk/ applies partial updates to many books in one request and one transaction: {"operations": [{"book_id": 1, "available_copies": 3}, {"book_id": 2, "title": "..."}], "mode": "all_or_nothing"}
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    if request.user.account_type not in ['Admin', 'Staff Member']: #The same people who can use update/api/<book_id>/
+        return Response({"detail": "Permission Denied: User does not have the required account_type"}, status=status.HTTP_403_FORBIDDEN)
+
+    mode, operations, error = _bulk_operations(request)
+    if error is not None:
+        return error
+    try:
+        results, applied = services.bulk_update_books(
+            [(operation['book_id'], {field: value for field, value in operation.items() if field != 'book_id'}) for operation in operations],
+            all_or_nothing=mode == 'all_or_nothing',
+        )
+    except IntegrityError: #Another request took one of the new ISBNs between our check and our write. Nothing was written
+        return Response({"error": "The books changed while they were being updated, nothing was written. Please try again."}, status=status.HTTP_409_CONFLICT)
+    answers = []
+    for result, payload in results:
+        if result == services.UPDATE_OK:
+            answers.append({'status': status.HTTP_200_OK, 'book': payload})
+        elif result == services.UPDATE_NOT_FOUND:
+            answers.append({'status': status.HTTP_404_NOT_FOUND, 'detail': "Book not found."})
+        else:
+            answers.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': payload})
+    return _bulk_response(mode, operations, answers, applied)
+
+
 @api_view(["PATCH"]) #This (@api_view) is a decorator provided by Django Rest Framework. It specifies that the decorated function is intended to handle HTTP PATCH requests. In your case, the function checkout_book_view is designed to handle partial updates to a book resource.
-@authentication_classes([TokenAuthentication]) #This decorator specifies the authentication classes that will be used to authenticate the user making the request. Here, TokenAuthentication is used, which means that the user must provide a valid token in the request header for authentication.
+@authentication_classes([CachedTokenAuthentication]) #This decorator specifies the authentication classes that will be used to authenticate the user making the request. Here, TokenAuthentication is used, which means that the user must provide a valid token in the request header for authentication.
 @permission_classes([IsAuthenticated]) #This decorator specifies the permission classes that control access to the view. IsAuthenticated ensures that only authenticated users can access the view. If a user is not authenticated, a 401 Unauthorized response will be returned.
 def checkout_book_view(request, book_id):  #This is the function definition. It declares a view function named checkout_book_view that takes two parameters: request (representing the HTTP request) and book_id (representing the identifier of the book to be checked out).
-    try: #try-except block: This is used to handle the case where the specified book with the given book_id is not found in the database. If the book is not found, a 404 Not Found response is returned with a message indicating that the book was not found
-        book = Book.objects.get(id=book_id) # It attempts to retrieve a Book object from the database using the provided book_id. If the book is not found, a Book.DoesNotExist exception is caught, and a response is returned with a message indicating that the book was not found, along with a 404 Not Found status code.
-    except Book.DoesNotExist:
-        return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
-
     if not request.auth: #This checks if there is an authentication token in the request (request.auth) database #if not request.auth:: Checks if there is an authentication token in the request. If not, it returns a 401 Unauthorized response, indicating that an authentication token is required.
         return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
 
     user = request.user #user = request.user: Retrieves the user making the request from the request object.
 
-    if user.account_type in ['Admin', 'Staff Member']: #if user.account_type in ['Admin', 'Staff Member']:: Checks if the user has an account type of 'Admin' or 'Staff Member'. If yes, it proceeds to the next level of checks.
-        if book.available_copies > 0: #if book.available_copies > 0:: Checks if there are available copies of the book. If yes, it creates a new BookCheckout instance, saves it to the database, updates theavailable_copies field of the book, and saves the changes to the book model.
-            checkout = BookCheckout(book=book, user=request.user)
-            checkout.save()
-
-            book.available_copies -= 1  # Update available_copies field directly
-            book.save()  # Save the changes to the book model
+    if user.account_type in ['Admin', 'Staff Member']: #if user.account_type in ['Admin', 'Staff Member']:: Checks if the user has an account type of 'Admin' or 'Staff Member'. If yes, it proceeds to the checkout.
+        result, checkout = services.checkout_book(book_id, user) #The service decrements available_copies in the database and records the BookCheckout in one transaction, so concurrent checkouts can not oversell the last copy
 
+        if result == services.CHECKOUT_OK:
             return Response({"detail": "Book checked out successfully."}, status=status.HTTP_200_OK) #If everything is successful, it returns a 200 OK response with a message indicating that the book was checked out successfully
+        elif result == services.CHECKOUT_NOT_FOUND:
+            return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
         else:
-            return Response({"detail": "No available copies of the book."}, status=status.HTTP_400_BAD_REQUEST) #else:: If there are no available copies, it returns a 400 Bad Request response indicating that there are no available copies of the book.
+            return Response({"detail": "No available copies of the book."}, status=status.HTTP_400_BAD_REQUEST) #If there are no available copies, it returns a 400 Bad Request response indicating that there are no available copies of the book.
     else:
         return Response({"detail": "Permission Denied: User does not have the required account_type"}, status=status.HTTP_403_FORBIDDEN) #If the user does not have the required account type ('Admin' or 'Staff Member'), it returns a 403 Forbidden response with a message indicating that the user does not have the required account type
 
 
 
+@api_view(["PATCH"])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def return_book_view(request, book_id): #PATCH return/api/<book_id>/ closes an open checkout of the book and puts the copy back in stock. By default it closes the requesting user's loan, {"user": <id>} closes another user's loan
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    user = request.user
+
+    if user.account_type in ['Admin', 'Staff Member']: #Returns are processed by the same people who check books out
+        borrower = user
+        if isinstance(request.data, dict) and request.data.get('user') is not None:
+            try:
+                borrower = User.objects.filter(pk=int(request.data['user'])).first()
+            except (TypeError, ValueError):
+                return Response({"error": "user must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+            if borrower is None:
+                return Response({"detail": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        result, checkout = services.return_book(book_id, borrower) #Closes the open BookCheckout and increments available_copies in one transaction
+
+        if result == services.RETURN_OK:
+            return Response(BookCheckoutSerializer(checkout).data, status=status.HTTP_200_OK)
+        elif result == services.RETURN_NOT_FOUND:
+            return Response({"detail": "Book not found."}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            return Response({"detail": "This book is not checked out by this user."}, status=status.HTTP_400_BAD_REQUEST)
+    else:
+        return Response({"detail": "Permission Denied: User does not have the required account_type"}, status=status.HTTP_403_FORBIDDEN)
+
+
+@api_view(["GET"])
+@authentication_classes([CachedTokenAuthentication,SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def loans_view(request): #GET loans/api/ lists open loans: the requesting user's own, another user's with ?user=<id>, or every overdue loan with ?overdue=true. These read the open-loan partial indexes only, not the whole checkout history
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    user = request.user
+    if user.account_type not in ['Admin', 'Staff Member']:
+        return Response({"detail": "Permission Denied: User does not have the required account_type"}, status=status.HTTP_403_FORBIDDEN)
+
+    if request.query_params.get('overdue') in ('1', 'true'):
+        loans = loans_queryset(None, overdue=True)
+    else:
+        try:
+            borrower_id = int(request.query_params.get('user', user.pk))
+        except ValueError:
+            return Response({"error": "user must be a user id"}, status=status.HTTP_400_BAD_REQUEST)
+        loans = loans_queryset(borrower_id)
+
+    paginator = PageNumberPagination()
+    paginator.page_size = 10
+    result_page = paginator.paginate_queryset(loans, request)
+    serializer = BookCheckoutSerializer(result_page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(["GET"])
+@authentication_classes([CachedTokenAuthentication,SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def export_view(request): #GET export/api/ streams the whole catalogue (?dataset=books, the default) or the checkout history (?dataset=checkouts) as NDJSON (?output=ndjson, the default) or CSV (?output=csv). Filters: ?author=, ?user=<id> (who added the book / who borrowed it), ?since= and ?until= (dates or ISO datetimes, on updated_at / checkout_date_time)
+    if not request.auth: # Your custom authentication logic to check for the presence of the token
+        return Response({"detail": "Authentication token is required."}, status=status.HTTP_401_UNAUTHORIZED)
+
+    dataset = request.query_params.get('dataset', 'books')
+    output = request.query_params.get('output', 'ndjson') #Not ?format=, DRF already uses that one to pick a renderer
+    if dataset not in export.DATASETS or output not in export.FORMATS:
+        return Response({"error": f"dataset must be one of {', '.join(export.DATASETS)} and output one of {', '.join(export.FORMATS)}"}, status=status.HTTP_400_BAD_REQUEST)
+    if dataset == 'checkouts' and request.user.account_type not in ['Admin', 'Staff Member']: #Everyone can read the catalogue, the checkout history is for the same people as loans/api/
+        return Response({"detail": "Permission Denied: User does not have the required account_type"}, status=status.HTTP_403_FORBIDDEN)
+
+    try:
+        rows = export.rows(dataset, **{name: request.query_params.get(name) for name in ('author', 'user', 'since', 'until')})
+    except export.ExportError as error:
+        return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+    response = StreamingHttpResponse(export.stream(dataset, output, rows), content_type=export.FORMATS[output]) #A plain Django response: the lines are sent as they are produced, DRF never sees (or buffers) the body
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{output}"'
+    return response
+
+
 @api_view(["DELETE"])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def delete_book_view(request, book_id): 
     if not request.auth: # Your custom authentication logic to check for the presence of the token
@@ -189,6 +457,7 @@ def delete_book_view(request, book_id):
 
 @api_view(['POST']) #This decorator specifies that the view function should only respond to HTTP POST requests
 @parser_classes([JSONParser])
+@throttle_classes(throttles_for('login')) #Checked before the view runs: a throttled attempt gets a 429 without a user lookup or a password hash
 def login(request):
     user = get_object_or_404(User, email=request.data['email']) #This line retrieves a user from the database based on the provided username in the request data (meaning your json POST request for postman should have a username key). get_object_or_404 is a helper function provided by Django that retrieves an object from the database and raises a 404 Not Found exception if the object doesn't exist. In this case, it's used to retrieve the user based on the username provided in the request data.
     if not user.check_password(request.data['password']): #This condition checks whether the provided password in the request data matches the user's password stored in the database if no error shows up. check_password is a method provided by Django's user model to compare a plaintext password with the hashed password stored in the database.
@@ -207,20 +476,21 @@ def logout(request):
 
 
 @api_view(['POST'])
+@throttle_classes(throttles_for('signup'))
 def signup(request):
     serializer = UserSerializer(data=request.data) #This line creates an instance of the UserSerializer to serialize and validate the data received in the request. The UserSerializer is assumed to be a serializer that you've defined for your User model
     if serializer.is_valid(): #This condition checks if the serializer's data is valid. If the data is valid, it proceeds to create a new user
-        serializer.save()
-        user = User.objects.get(email=request.data['email']) #This line retrieves the newly created user from the database based on the username provided in the request data. However, this step seems unnecessary because you've already created the user with serializer.save()
-        user.set_password(request.data['password']) #This line sets the user's password. It's essential to hash the password using Django's built-in password hashing mechanisms.
-        user.save() #This line saves the user object with the updated password
-        token = Token.objects.create(user=user) #This code generates an authentication token for the newly created user using DRF's Token model.
-        return Response({"token":token.key}) #If the data is valid, the code returns a JSON response with the user's token and serialized user data
+        user = accounts.new_user(**serializer.validated_data) #The password is hashed here, before any database write, so the plain text password is never stored (not even for a moment)
+        try:
+            token, = accounts.create_accounts([user]) #One transaction: one INSERT of the user (with the hashed password) and one INSERT of its token
+        except IntegrityError: #Someone signed up with the same email between the serializer's check and our INSERT
+            return Response({'email': ['user with this email already exists.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"token":token.key}) #If the data is valid, the code returns a JSON response with the user's token
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def change_password(request):
     if request.method == 'POST':
@@ -253,10 +523,11 @@ def send_reset_email(email, token):
     from_email = 'marvinalamu@gmail.com'
     recipient_list = [email]
 
-    send_mail(subject, message, from_email, recipient_list, fail_silently=False)
+    mail.queue_email(subject, message, from_email, recipient_list) #Stored in the outbox table and sent by the send_queued_emails worker, so the request does not wait for the mail server
 
 
 @api_view(['POST'])
+@throttle_classes(throttles_for('forgot_password'))
 def forgot_password(request):
     serializer = ForgotPasswordSerializer(data=request.data)
     if serializer.is_valid():
@@ -279,6 +550,7 @@ def forgot_password(request):
 
 @csrf_exempt
 @api_view(['POST'])
+@throttle_classes(throttles_for('password_reset'))
 def password_reset(request, token):
     cache_key = f'password_reset_token_{token}' # Retrieve the email associated with the token from the cache
     email = cache.get(cache_key)
@@ -296,7 +568,7 @@ def password_reset(request, token):
 
 
 @api_view(['GET']) #this function will be responsible for handling GET requests to a specific URL endpoint.
-@authentication_classes([SessionAuthentication, TokenAuthentication]) #This class is used for session-based authentication, which is common for web applications. This class is used for token-based authentication, often used for RESTful APIs
+@authentication_classes([SessionAuthentication, CachedTokenAuthentication]) #This class is used for session-based authentication, which is common for web applications. This class is used for token-based authentication, often used for RESTful APIs
 @permission_classes([IsAuthenticated]) #This permission class ensures that only authenticated users (users who have provided valid authentication credentials) are allowed to access the view.
 def test_token(request): #This is the definition of the view function named test_token. It takes a single argument, request, which represents the HTTP request made to this view.
     return Response("passed for {}".format(request.user.email)) #The {} part is a placeholder for the user's email, which is retrieved from request.user.email. The request.user object represents the currently authenticated user, and request.user.email retrieves the user's email address.
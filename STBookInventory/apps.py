@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class StbookinventoryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'STBookInventory'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (connects the Book signal handlers)
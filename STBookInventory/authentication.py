@@ -0,0 +1,49 @@
+#Authentication classes for the REST API views
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+
+def _cache_key(key): #The token itself is a credential, so only a hash of it is used as the cache key
+    return 'auth_token_' + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    #Drop-in replacement for DRF's TokenAuthentication. Only the token -> user id mapping is cached, for AUTH_TOKEN_CACHE_TIMEOUT seconds,
+    #so every request after the first reads the user by primary key instead of running the Token JOIN User lookup.
+    #The user itself (and its password hash) is never put in the cache. Reading it on every request means a deactivation or a
+    #deleted user is seen straight away, even when it was done with a queryset update() that sends no signal.
+    #A token deleted through the ORM is dropped from the cache by the post_delete signal (logout). One deleted with raw SQL keeps
+    #working for at most AUTH_TOKEN_CACHE_TIMEOUT seconds, which is why that timeout is kept short
+    def authenticate_credentials(self, key):
+        user_id = cache.get(_cache_key(key))
+        if user_id is None:
+            user, token = super().authenticate_credentials(key) #Raises AuthenticationFailed for unknown tokens and inactive users, those are never cached
+            cache.set(_cache_key(key), user.pk, timeout=settings.AUTH_TOKEN_CACHE_TIMEOUT)
+            return (user, token)
+        user = user_queryset(user_id).first()
+        if user is None or not user.is_active:
+            invalidate_token(key)
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.')) #The same message DRF gives
+        return (user, Token(key=key, user=user)) #request.auth, built without reading the token row again
+
+
+def user_queryset(user_id): #The per request user lookup once the token is cached (also EXPLAINed by query_audit.py)
+    return User.objects.filter(pk=user_id)
+
+
+def invalidate_token(key): #Drops a cached token so the next request goes back to the database
+    cache.delete(_cache_key(key))
+
+
+def invalidate_user_tokens(user): #Called whenever a user is saved (password change or reset, deactivation, account_type change) or logs out
+    for key in Token.objects.filter(user_id=user.pk).values_list('key', flat=True):
+        invalidate_token(key)
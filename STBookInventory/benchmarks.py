@@ -0,0 +1,274 @@
+#Benchmark suite for the REST endpoints. `python manage.py seed_benchmark_data` fills the database with users, books and
+#checkouts, then `python manage.py benchmark_api` sends requests to each endpoint through the whole stack (URL routing,
+#middleware, authentication, views) with django's test Client and reports p50/p95/p99 latency, requests/sec and queries
+#per request as JSON, so the output of two runs (before/after a change) can be compared.
+#`python manage.py benchmark_concurrency` instead sends the reads over real HTTP connections, many at once, to a running server
+#(load() below), to compare deployments such as the WSGI and the ASGI profiles (see STLibrary/asgi.py).
+
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .models import Book, BookCheckout, User
+from . import inventory, search, versioning
+
+
+EMAIL_DOMAIN = 'benchmark.invalid' #Every seeded user has an address @benchmark.invalid, which is how clear() finds the seeded data
+STAFF_EMAIL = f'staff@{EMAIL_DOMAIN}'
+PASSWORD = 'benchmark-password'
+ISBN_PREFIX = 'BM'
+WORDS = ['river', 'garden', 'shadow', 'winter', 'silver', 'empire', 'ocean', 'forest', 'letters', 'night', 'machine', 'history', 'light', 'stone', 'journey', 'island']
+
+CONCURRENCY_SCENARIOS = ['read_one', 'read_all', 'search_api']
+SCENARIOS = ['read_all', 'read_all_cursor', 'read_one', 'create_single', 'create_bulk', 'checkout', 'search', 'search_api', 'login']
+WRITE_SCENARIOS = {'create_single', 'create_bulk', 'checkout'} #Rolled back after the run so every run starts from the same data
+
+
+def clear():
+    #Deletes the seeded users, and with them their books and checkouts
+    User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').delete()
+
+
+def seed(users=100, books=10000, checkouts=5000, batch_size=1000, random_seed=0):
+    #Adds users, books and checkouts with bulk_create, then rebuilds the search index and the inventory counters once and bumps
+    #the catalogue version (bulk_create sends no signals, so without it the cached pages and ETags would still show the old catalogue).
+    #The first user is a staff member, the benchmark authenticates as them. Returns the numbers created
+    rng = random.Random(random_seed) #The same arguments always produce the same data
+    password = make_password(PASSWORD) #Hashing is slow on purpose, so every seeded user shares one hash
+    with transaction.atomic():
+        User.objects.bulk_create(
+            [User(email=STAFF_EMAIL, name='Benchmark staff', account_type=User.AccountType.STAFF_MEMBER, password=password)]
+            + [User(email=f'user{n}@{EMAIL_DOMAIN}', name=f'Benchmark user {n}', password=password) for n in range(1, users)],
+            batch_size=batch_size,
+            ignore_conflicts=True, #Seeding again reuses the users
+        )
+        user_ids = list(User.objects.filter(email__endswith=f'@{EMAIL_DOMAIN}').values_list('id', flat=True))
+        start = Book.objects.filter(isbn__startswith=ISBN_PREFIX).count() #Seeding twice adds more books instead of clashing on isbn
+        Book.objects.bulk_create(
+            (Book(
+                isbn=f'{ISBN_PREFIX}{n:011d}',
+                title=' '.join(rng.sample(WORDS, 3)).title(),
+                author=f'Author {n % 500}',
+                available_copies=rng.randint(1, 20),
+                user_id=rng.choice(user_ids),
+            ) for n in range(start, start + books)),
+            batch_size=batch_size,
+        )
+        book_ids = list(Book.objects.filter(isbn__startswith=ISBN_PREFIX).values_list('id', flat=True))
+        returned_at = timezone.now()
+        BookCheckout.objects.bulk_create(
+            (BookCheckout(
+                book_id=rng.choice(book_ids),
+                user_id=rng.choice(user_ids),
+                returned_at=returned_at if rng.random() < 0.7 else None, #Most of the history is returned loans
+            ) for _ in range(checkouts)),
+            batch_size=batch_size,
+        )
+    search.rebuild_index()
+    inventory.recompute()
+    versioning.bump_catalogue()
+    return {'users': len(user_ids), 'books': books, 'checkouts': checkouts}
+
+
+def percentile(samples, fraction):
+    #Nearest-rank percentile of a sorted list
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+@contextmanager
+def _count_queries(counter):
+    #Counts every query sent to the database. Unlike CaptureQueriesContext it keeps no SQL, so long runs use no extra memory
+    def wrapper(execute, sql, params, many, context):
+        counter['queries'] += 1
+        return execute(sql, params, many, context)
+    with connection.execute_wrapper(wrapper):
+        yield
+
+
+def _requests(scenario, api, browser, book_ids, bulk_size):
+    #Returns a function that sends the n-th request of a scenario
+    def create_payload(n, index=0):
+        return {'isbn': f'BW{n:06d}{index:05d}', 'title': f'Benchmark write {n}', 'author': 'Benchmark', 'available_copies': 3}
+
+    def book_id(n):
+        return book_ids[n % len(book_ids)]
+
+    return {
+        'read_all': lambda n: api.get('/stbookinventory/read/api/', {'page': n % 10 + 1}),
+        'read_all_cursor': lambda n: api.get('/stbookinventory/read/api/', {'pagination': 'cursor'}),
+        'read_one': lambda n: api.get(f'/stbookinventory/read/api/{book_id(n)}/'),
+        'create_single': lambda n: api.post('/stbookinventory/create/api/', create_payload(n), content_type='application/json'),
+        'create_bulk': lambda n: api.post('/stbookinventory/create/api/', [create_payload(n, i) for i in range(bulk_size)], content_type='application/json'),
+        'checkout': lambda n: api.patch(f'/stbookinventory/checkout/api/{book_id(n)}/'),
+        'search': lambda n: browser.get('/stbookinventory/search/', {'query': WORDS[n % len(WORDS)]}),
+        'search_api': lambda n: api.get('/stbookinventory/search/api/', {'query': WORDS[n % len(WORDS)]}),
+        'login': lambda n: api.post('/stbookinventory/login', {'email': STAFF_EMAIL, 'password': PASSWORD}, content_type='application/json'),
+    }[scenario]
+
+
+def _measure(send, requests, warmup):
+    for n in range(warmup):
+        send(requests + n) #Different request numbers than the measured ones, so writes do not clash
+    counter = Counter()
+    statuses = Counter()
+    latencies = []
+    with _count_queries(counter):
+        started = time.perf_counter()
+        for n in range(requests):
+            request_started = time.perf_counter()
+            response = send(n)
+            latencies.append((time.perf_counter() - request_started) * 1000)
+            statuses[response.status_code] += 1
+        elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'requests_per_sec': round(requests / elapsed, 1),
+        'queries_per_request': round(counter['queries'] / requests, 2),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'failures': sum(count for code, count in statuses.items() if not 200 <= code < 300), #Non-2xx responses, see run()
+    }
+
+
+def run(requests=200, scenarios=None, warmup=5, bulk_size=100):
+    #Runs each scenario against the seeded data and returns the results as a dict (see benchmark_api). Raises ValueError when a
+    #scenario got responses other than 2xx: a 429 or a 400 is answered without doing the work, so its latency says nothing
+    staff = User.objects.filter(email=STAFF_EMAIL).first()
+    book_ids = list(Book.objects.filter(isbn__startswith=ISBN_PREFIX).order_by('id').values_list('id', flat=True)[:1000])
+    if staff is None or not book_ids:
+        raise ValueError('No benchmark data, run `python manage.py seed_benchmark_data` first')
+    token, created = Token.objects.get_or_create(user=staff)
+
+    results = {
+        'database': connection.vendor,
+        'books': Book.objects.count(),
+        'requests_per_scenario': requests,
+        'scenarios': {},
+    }
+    with override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], #The test Client sends Host: testserver
+        REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={}), #The login scenario logs the same account in hundreds of times, the throttles would answer 429 after a few
+    ):
+        api = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        browser = Client()
+        browser.force_login(staff)
+        for scenario in scenarios or SCENARIOS:
+            send = _requests(scenario, api, browser, book_ids, bulk_size)
+            if scenario in WRITE_SCENARIOS:
+                with transaction.atomic():
+                    results['scenarios'][scenario] = _measure(send, requests, warmup)
+                    transaction.set_rollback(True)
+            else:
+                results['scenarios'][scenario] = _measure(send, requests, warmup)
+    failed = {scenario: numbers['statuses'] for scenario, numbers in results['scenarios'].items() if numbers['failures']}
+    if failed:
+        raise ValueError(f'Responses other than 2xx, the numbers would not measure the endpoints: {json.dumps(failed, sort_keys=True)}')
+    return results
+
+
+def dumps(results):
+    return json.dumps(results, indent=2, sort_keys=True)
+
+
+def concurrency_paths(scenario, book_ids):
+    #The URLs a benchmark_concurrency scenario cycles through
+    base = '/stbookinventory/'
+    return {
+        'read_one': [f'{base}read/api/{book_id}/' for book_id in book_ids],
+        'read_all': [f'{base}read/api/?page={page}' for page in range(1, 11)],
+        'search_api': [f'{base}search/api/?query={word}' for word in WORDS],
+    }[scenario]
+
+
+async def _read_response(reader):
+    #Reads one HTTP/1.1 response and returns (status code, whether the server keeps the connection open)
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('The server closed the connection')
+    length, chunked, keep_alive = 0, False, True
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'transfer-encoding':
+            chunked = value == b'chunked'
+        elif name == b'connection':
+            keep_alive = value != b'close'
+    if chunked:
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            await reader.readexactly(size + 2) #The chunk and its CRLF
+            if not size:
+                break
+    else:
+        await reader.readexactly(length)
+    return int(status_line.split()[1]), keep_alive
+
+
+async def _load(url, paths, connections, requests, headers):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    queue = iter(range(requests)) #Shared by all the connections, each takes the next request number until none are left
+    latencies, statuses, errors = [], Counter(), Counter()
+
+    async def client():
+        reader = writer = None
+        for n in queue:
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                started = time.perf_counter()
+                writer.write(f'GET {paths[n % len(paths)]} HTTP/1.1\r\nHost: {parts.netloc}\r\n{headers}\r\n'.encode())
+                await writer.drain()
+                code, keep_alive = await _read_response(reader)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses[code] += 1
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError) as error:
+                errors[type(error).__name__] += 1
+                keep_alive = False
+            if not keep_alive and writer is not None:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'connections': connections,
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 0.50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 3) if latencies else None,
+        'requests_per_sec': round(len(latencies) / elapsed, 1),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'errors': dict(errors),
+    }
+
+
+def load(url, paths, connections, requests, token=None):
+    #Sends `requests` GETs for paths (in turn) to the server at url over `connections` keep-alive connections at once, and returns the
+    #latency percentiles, requests/sec and status codes. Plain asyncio streams, so thousands of connections cost the client little
+    headers = f'Authorization: Token {token}\r\n' if token else ''
+    return asyncio.run(_load(url, paths, connections, requests, headers))
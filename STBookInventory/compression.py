@@ -0,0 +1,113 @@
+#Response compression (brotli or gzip), negotiated from the client's Accept-Encoding header. A read/api/ page of
+#1000 books is about 100 KB of JSON and shrinks to a fraction of that, which is most of its transfer time on a mobile connection.
+#Brotli (the optional brotli package) is preferred when the client takes it, gzip otherwise. Bodies smaller than
+#COMPRESSION_MIN_SIZE bytes are left alone: a few hundred bytes fit in one packet either way and compressing them only costs CPU.
+#Streaming responses (export/api/) are compressed on the fly, chunk by chunk.
+#Replaces django's GZipMiddleware, which only knows gzip and has a fixed 200 byte threshold.
+
+import asyncio
+import gzip
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli #Optional: without it only gzip is offered
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/x-ndjson', 'application/vnd.oai.openapi', 'application/javascript', 'application/xml')
+
+
+def accepted_encodings(header):
+    #'br;q=1.0, gzip;q=0.8, *;q=0.1' -> {'br': 1.0, 'gzip': 0.8, '*': 0.1}
+    accepted = {}
+    for part in header.split(','):
+        coding, _, parameters = part.strip().partition(';')
+        quality = 1.0
+        parameter, _, value = parameters.strip().partition('=')
+        if parameter.strip() == 'q':
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(header):
+    #The encoding to use for this Accept-Encoding header, or None to send the body as it is
+    accepted = accepted_encodings(header)
+    best, best_quality = None, 0.0
+    for coding in (('br', 'gzip') if brotli is not None else ('gzip',)): #On a tie the first one wins, brotli makes smaller JSON than gzip
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=settings.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=settings.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+        compress_chunk, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31) #31: gzip header and trailer
+        compress_chunk, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = compress_chunk(chunk)
+        if data: #The compressor keeps small chunks (one NDJSON line) until it has enough to send
+            yield data
+    yield finish()
+
+
+class CompressionMiddleware: #Right after PerformanceMiddleware, so every other middleware sees the uncompressed body
+    sync_capable = True
+    async_capable = True #Like PerformanceMiddleware, so an ASGI worker does not switch threads for it on every request
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        return self.process_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        content_type = response.get('Content-Type', '')
+        if response.has_header('Content-Encoding') or not content_type.startswith(COMPRESSIBLE_TYPES):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',)) #Shared caches must keep the compressed and the plain copies apart
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = compress_stream(response.streaming_content, encoding)
+            del response['Content-Length']
+        else:
+            compressed = compress(response.content, encoding)
+            if len(compressed) >= len(response.content): #Already compressed data, or too random to shrink
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'): #The bytes differ from the uncompressed ones, so the ETag can only be a weak one (as GZipMiddleware does). If-None-Match compares weakly, 304s keep working
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
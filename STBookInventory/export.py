@@ -0,0 +1,95 @@
+#Full catalogue export (export/api/). The rows are read with .iterator(chunk_size=...) and written out one line at a time through a
+#StreamingHttpResponse, so memory stays the same whether the table holds a thousand books or ten million: no queryset cache, no list
+#of serialized books, no response body built in memory. On PostgreSQL .iterator() uses a server-side cursor (unless
+#DATABASE_POOLER=pgbouncer turned those off, then it fetches chunk by chunk from the client side cursor), on SQLite it fetches chunk by chunk.
+
+import csv
+
+from django.conf import settings
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import Book, BookCheckout
+from .renderers import FastJSONRenderer
+from .serializers import BookCheckoutSerializer, BookSerializer
+
+
+DATASETS = { #name: (model, columns in the output, date column the since/until filters apply to, author column)
+    'books': (Book, BookSerializer.Meta.fields, 'updated_at', 'author'),
+    'checkouts': (BookCheckout, BookCheckoutSerializer.Meta.fields, 'checkout_date_time', 'book__author'),
+}
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+class ExportError(ValueError): #A bad filter value, the view answers it with 400
+    pass
+
+
+def _moment(value, name, end_of_day=False):
+    #Returns (lookup, value) for a date (2026-01-31) or a full ISO datetime. A date as until includes that whole day
+    lookup = 'lte' if end_of_day else 'gte'
+    try:
+        moment = parse_datetime(value)
+        if moment is not None:
+            return lookup, moment
+        day = parse_date(value) if len(value) == 10 else None
+    except ValueError: #Well formed but not a real date, e.g. 2026-02-30
+        day = None
+    if day is None:
+        raise ExportError(f'{name} must be a date (YYYY-MM-DD) or an ISO 8601 datetime')
+    return 'date__' + lookup, day
+
+
+def rows(dataset, author=None, user=None, since=None, until=None):
+    #A lazy stream of dicts with the same keys and values as the dataset's serializer. user is the id of the user who added the book
+    #(books) or who borrowed it (checkouts). Ordered by id, which is the primary key index, so the database never sorts the whole table
+    return rows_queryset(dataset, author, user, since, until).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def rows_queryset(dataset, author=None, user=None, since=None, until=None): #The query behind rows() (also EXPLAINed by query_audit.py)
+    model, fields, date_column, author_column = DATASETS[dataset]
+    queryset = model.objects.order_by('id')
+    if author is not None:
+        queryset = queryset.filter(**{author_column: author})
+    if user is not None:
+        try:
+            queryset = queryset.filter(user_id=int(user))
+        except ValueError:
+            raise ExportError('user must be a user id')
+    for value, name, end in ((since, 'since', False), (until, 'until', True)):
+        if value is not None:
+            lookup, moment = _moment(value, name, end)
+            queryset = queryset.filter(**{f'{date_column}__{lookup}': moment})
+    return queryset.values(*fields)
+
+
+def ndjson_lines(rows):
+    renderer = FastJSONRenderer() #Same JSON (and datetime format) as the API responses
+    for row in rows:
+        yield renderer.render(row) + b'\n'
+
+
+class _Line: #csv.writer wants a file, this one just hands back what was written
+    def write(self, value):
+        return value
+
+
+def _csv_value(value, encoder=JSONEncoder()):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'): #Datetimes written like in the JSON (2026-01-31T10:00:00.123456Z)
+        return encoder.default(value)
+    return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.writer(_Line())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([_csv_value(row[field]) for field in fields])
+
+
+def stream(dataset, output, rows):
+    if output == 'csv':
+        return csv_lines(rows, DATASETS[dataset][1])
+    return ndjson_lines(rows)
@@ -0,0 +1,15 @@
+#Password hasher with a configurable cost. Same algorithm and stored format as Django's default PBKDF2 hasher (pbkdf2_sha256$<iterations>$...),
+#only the number of iterations comes from settings.PASSWORD_HASH_ITERATIONS instead of being fixed by the Django version.
+#Every login (and every new account) pays for one hash, so this number is the trade between login CPU and how slow an offline
+#attack on a leaked hash is. `python manage.py benchmark_password_hashing` shows what a value costs on the server.
+#Hashes made with another iteration count keep working: they are checked with their own count, and Django stores a new hash with
+#the current count at the user's next successful login.
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS
@@ -0,0 +1,211 @@
+#Bulk import of catalogue files, used by `python manage.py import_books`. The file (CSV with a header row, or NDJSON with one book
+#object per line) is read one row at a time, so its size does not matter. Every row is validated with the same field rules as
+#BookSerializer and the valid rows are upserted by isbn: new ISBNs are inserted with bulk_create, known ones updated with
+#services.update_book_columns, one transaction per batch. Rows that fail validation are written to a rejects file (NDJSON) with their line number
+#and errors, the import goes on.
+#After every committed batch the byte offset reached in the file is saved to a checkpoint file. After a crash the same command
+#seeks straight to that offset and carries on. A crash between a commit and the checkpoint write repeats at most one batch,
+#which is harmless because an upsert of the same rows changes nothing the second time.
+
+import csv
+import json
+import os
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Book
+from .serializers import BookBulkSerializer
+from . import inventory, search, services, versioning
+
+
+FIELDS = ('isbn', 'title', 'author', 'available_copies') #What a file can set. Other columns (id, user, ... from an export/api/ CSV) are ignored
+FORMATS = ('csv', 'ndjson')
+
+
+def file_format(path): #From the file extension: .csv is CSV, anything else (.ndjson, .jsonl, .json) is NDJSON
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def _lines(handle, position):
+    #Yields the decoded lines of a binary file and keeps position = [byte offset after the last line read, line number] up to date
+    for raw in handle:
+        position[0] += len(raw)
+        position[1] += 1
+        yield raw.decode('utf-8')
+
+
+def read_rows(handle, fmt, position, header=None):
+    #Yields (line number, row) with the file positioned at position[0]. A CSV row is a dict of the header columns, empty cells are None
+    #(export/api/ writes a missing title or author as an empty cell). An NDJSON line that is not JSON is yielded as the raw text,
+    #validation then rejects it like any other bad row
+    lines = _lines(handle, position)
+    if fmt == 'csv':
+        for cells in csv.reader(lines): #csv.reader only takes the lines it needs, so position is right after every row (quoted cells can span lines)
+            yield position[1], {column: cell if cell != '' else None for column, cell in zip(header, cells)}
+    else:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield position[1], json.loads(line)
+            except ValueError:
+                yield position[1], line.rstrip('\r\n')
+
+
+def read_header(path):
+    with open(path, 'rb') as handle:
+        position = [0, 0]
+        header = next(csv.reader(_lines(handle, position)), None)
+    if not header:
+        raise ValueError(f'{path} is empty, a CSV file needs a header row')
+    header[0] = header[0].lstrip('\ufeff') #Byte order mark written by spreadsheet programs
+    if 'isbn' not in header:
+        raise ValueError(f'{path} has no isbn column')
+    return header, position
+
+
+class Checkpoint: #How far the import of a file got. Saved as JSON next to the file (or where --checkpoint says) after every batch
+    def __init__(self, path, source):
+        self.path = path
+        self.state = {'source': os.path.abspath(source), 'offset': 0, 'line': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0}
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as handle:
+            state = json.load(handle)
+        if state.get('source') != self.state['source']:
+            raise ValueError(f"{self.path} is the checkpoint of {state.get('source')}, not of {self.state['source']}")
+        self.state.update(state)
+        return True
+
+    def save(self):
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(self.state, handle)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self.path) #Atomic: after a crash the checkpoint is either the old one or the new one, never half written
+
+    def delete(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _validate(validator, row):
+    #Returns (data, None) or (None, errors). data only has the FIELDS the row actually contains
+    if isinstance(row, dict):
+        row = {field: row[field] for field in FIELDS if field in row}
+    try:
+        data = validator.run_validation(row)
+    except ValidationError as error:
+        return None, error.detail
+    if not data.get('isbn'):
+        return None, {'isbn': ['An isbn is required to import a book.']}
+    return data, None
+
+
+def _reject(line, row, errors):
+    return line, json.dumps({'line': line, 'row': row, 'errors': errors}) + '\n'
+
+
+def upsert(batch, owner):
+    #batch is a list of validated data dicts with different ISBNs. Returns (created, updated, unchanged) counts.
+    #The same bookkeeping as the other bulk write paths: bulk_create and services.update_book_columns send no signals, so the search index, the inventory
+    #counters and the catalogue version are updated here, once per batch
+    with transaction.atomic():
+        existing = {book.isbn: book for book in Book.objects.filter(isbn__in=[data['isbn'] for data in batch]).only('id', *FIELDS)}
+        created, updated, now = [], [], timezone.now()
+        for data in batch:
+            book = existing.get(data['isbn'])
+            if book is None:
+                created.append(Book(user=owner, **data))
+            elif any(getattr(book, field) != value for field, value in data.items()):
+                for field, value in data.items():
+                    setattr(book, field, value)
+                updated.append((book, data))
+
+        if created:
+            Book.objects.bulk_create(created)
+            if not connection.features.can_return_rows_from_bulk_insert: #Postgres hands the new ids back from bulk_create. SQLite does not, so look them up by their unique isbn
+                ids = dict(Book.objects.filter(isbn__in=[book.isbn for book in created]).values_list('isbn', 'id'))
+                for book in created:
+                    book.pk = ids[book.isbn]
+            search.index_books(created, replace=False)
+            inventory.record_books_added(created)
+        if updated:
+            services.update_book_columns(updated, now)
+            updated = [book for book, _ in updated]
+            search.index_books(updated)
+            inventory.record_books_updated(updated)
+        if created or updated:
+            versioning.bump_catalogue()
+    return len(created), len(updated), len(batch) - len(created) - len(updated)
+
+
+def import_file(path, owner, fmt=None, batch_size=None, checkpoint_path=None, rejects_path=None, restart=False, progress=None):
+    #Imports the file and returns the totals (created, updated, unchanged, rejected, rows, seconds, resumed). progress(totals) is called after every batch
+    fmt = fmt or file_format(path)
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    checkpoint = Checkpoint(checkpoint_path or path + '.checkpoint.json', path)
+    if restart:
+        checkpoint.delete()
+    resumed = checkpoint.load()
+    state = checkpoint.state
+    header = None
+    if fmt == 'csv':
+        header, position = read_header(path)
+        state['offset'], state['line'] = max(state['offset'], position[0]), max(state['line'], position[1])
+
+    validator = BookBulkSerializer() #One serializer for all rows, like a ListSerializer does with its child
+    started, rows = time.perf_counter(), 0
+    with open(path, 'rb') as handle, open(rejects_path or path + '.rejects.ndjson', 'a' if resumed else 'w') as rejects:
+        handle.seek(state['offset'])
+        position = [state['offset'], state['line']] #Byte offset and line number right after the last row read
+        batch, isbns, rejected = [], set(), []
+
+        def flush(reached):
+            #Commits the batch, writes its rejected rows, then records reached (the position after the batch's last row) as the checkpoint
+            if batch:
+                try:
+                    counts = upsert([data for _, _, data in batch], owner)
+                except IntegrityError: #A row breaks a database constraint, or another writer inserted one of these ISBNs after our lookup
+                    counts = [0, 0, 0]
+                    for line, row, data in batch: #Row by row, so only the offending rows are rejected (like create/api/ does)
+                        try:
+                            counts = [total + count for total, count in zip(counts, upsert([data], owner))]
+                        except IntegrityError as error:
+                            rejected.append(_reject(line, row, {'non_field_errors': [str(error)]}))
+                for name, count in zip(('created', 'updated', 'unchanged'), counts):
+                    state[name] += count
+            rejects.writelines(text for _, text in sorted(rejected)) #In file order, rows rejected by the database are only known at the end of the batch
+            rejects.flush()
+            state['rejected'] += len(rejected)
+            state['offset'], state['line'] = reached
+            checkpoint.save()
+            batch.clear(), isbns.clear(), rejected.clear()
+            if progress:
+                progress(dict(state, rows=rows, seconds=time.perf_counter() - started))
+
+        before = position[:]
+        for line, row in read_rows(handle, fmt, position, header):
+            rows += 1
+            data, errors = _validate(validator, row)
+            if errors is not None:
+                rejected.append(_reject(line, row, errors))
+            else:
+                if data['isbn'] in isbns: #The same ISBN twice in one batch: commit what came before this row first, so the last row in the file wins
+                    flush(before)
+                batch.append((line, row, data))
+                isbns.add(data['isbn'])
+            before = position[:]
+            if len(batch) + len(rejected) >= batch_size:
+                flush(before)
+        flush(position)
+
+    checkpoint.delete() #Finished, a new run of the same file starts from the top again
+    return dict(state, rows=rows, seconds=time.perf_counter() - started, resumed=resumed)
@@ -0,0 +1,320 @@
+#Per-request performance numbers. PerformanceMiddleware times a sample of the requests (PERFORMANCE_SAMPLE_RATE) and splits
+#each one into SQL time, serializer time (DRF serializers turning books into dicts and validating input, see TimedSerializerMixin),
+#rendering time (templates and DRF's JSON renderer) and app time (everything else: the view's python code, authentication,
+#middleware). A sampled response gets a Server-Timing header, which browser dev tools show under Network > Timing.
+#Per view totals are served in the Prometheus text format at /stbookinventory/metrics/ (only with PERFORMANCE_METRICS_TOKEN set).
+#
+#Every gunicorn worker keeps its own totals in memory and copies them to the shared default cache every
+#PERFORMANCE_METRICS_FLUSH_INTERVAL seconds, so whichever worker answers the metrics request can add up all of them.
+
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.template.backends.django import DjangoTemplates, Template
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) #Upper bounds (seconds) of the request duration histogram
+WORKERS_KEY = 'perf_metrics_workers'
+_current_timer = ContextVar('performance_timer', default=None) #The timer of the request being handled, for code that has no request at hand (serializers)
+
+
+class RequestTimer: #Attached to a sampled request as request._performance_timer
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.serialize_time = 0.0
+        self._rendering = 0
+        self._serializing = 0
+
+    def record_query(self, execute, sql, params, many, context): #A connection.execute_wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.db_queries += 1
+
+    def start_rendering(self):
+        self._rendering += 1
+        if self._rendering == 1: #A template included while rendering (e.g. by the browsable API) is already being timed
+            self._render_started, self._render_db_before = time.perf_counter(), self.db_time
+
+    def stop_rendering(self):
+        self._rendering -= 1
+        if self._rendering == 0:
+            self.render_time += (time.perf_counter() - self._render_started) - (self.db_time - self._render_db_before) #Queries run by a template count as SQL time, not rendering
+
+    @contextmanager
+    def rendering(self):
+        self.start_rendering()
+        try:
+            yield
+        finally:
+            self.stop_rendering()
+
+    @contextmanager
+    def serializing(self):
+        if self._rendering: #The browsable API builds its forms with serializers while rendering, that already counts as rendering
+            yield
+            return
+        self._serializing += 1
+        if self._serializing == 1: #A nested serializer (or each item of a many=True one) inside the outer one is already being timed
+            started, db_before = time.perf_counter(), self.db_time
+        try:
+            yield
+        finally:
+            self._serializing -= 1
+            if self._serializing == 0:
+                self.serialize_time += (time.perf_counter() - started) - (self.db_time - db_before) #Queries run by a serializer (a uniqueness check, a related object) count as SQL time
+
+    def server_timing(self, total):
+        app = max(total - self.db_time - self.serialize_time - self.render_time, 0.0)
+        return ', '.join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.db_queries} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.2f}',
+            f'render;dur={self.render_time * 1000:.2f}',
+            f'app;dur={app * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+class Metrics: #Totals of this process
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = defaultdict(int) #(view, method, status) -> requests, counted for every request
+        self.views = {} #view -> totals of the sampled requests
+        self.cache = defaultdict(int) #(endpoint, 'hit' or 'miss') -> lookups in the response cache (see response_cache.py)
+        self.flushed_at = 0.0
+
+    def count(self, view, method, status):
+        with self.lock:
+            self.requests[(view, method, status)] += 1
+
+    def count_cache(self, endpoint, result):
+        with self.lock:
+            self.cache[(endpoint, result)] += 1
+
+    def observe(self, view, timer, total):
+        with self.lock:
+            totals = self.views.setdefault(view, _empty_totals())
+            totals['sampled'] += 1
+            totals['seconds'] += total
+            totals['db_queries'] += timer.db_queries
+            totals['db_seconds'] += timer.db_time
+            totals['serialize_seconds'] += timer.serialize_time
+            totals['render_seconds'] += timer.render_time
+            for index, bound in enumerate(BUCKETS):
+                if total <= bound:
+                    totals['buckets'][index] += 1 #Prometheus buckets are cumulative
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'cache': dict(self.cache),
+                'views': {view: dict(totals, buckets=list(totals['buckets'])) for view, totals in self.views.items()},
+            }
+
+
+def _empty_totals():
+    return {'sampled': 0, 'seconds': 0.0, 'db_queries': 0, 'db_seconds': 0.0, 'serialize_seconds': 0.0, 'render_seconds': 0.0, 'buckets': [0] * len(BUCKETS)}
+
+
+metrics = Metrics()
+_worker_key = f'perf_metrics_{socket.gethostname()}_{os.getpid()}'
+
+
+def _flush(now):
+    #Copies this worker's totals to the shared cache, where metrics_text() picks them up
+    interval = settings.PERFORMANCE_METRICS_FLUSH_INTERVAL
+    metrics.flushed_at = now
+    cache.set(_worker_key, metrics.snapshot(), timeout=interval * 10) #A worker that stopped drops out after a while
+    workers = cache.get(WORKERS_KEY) or []
+    if _worker_key not in workers:
+        cache.set(WORKERS_KEY, [key for key in workers if cache.get(key) is not None] + [_worker_key], timeout=None)
+
+
+def _merge(snapshots):
+    requests = defaultdict(int)
+    cache_lookups = defaultdict(int)
+    views = {}
+    for snapshot in snapshots:
+        for labels, count in snapshot['requests'].items():
+            requests[labels] += count
+        for labels, count in snapshot.get('cache', {}).items(): #.get: a worker still running the previous release has no cache counts
+            cache_lookups[labels] += count
+        for view, totals in snapshot['views'].items():
+            merged = views.setdefault(view, _empty_totals())
+            for name in ('sampled', 'seconds', 'db_queries', 'db_seconds', 'serialize_seconds', 'render_seconds'):
+                merged[name] += totals.get(name, 0) #.get: a worker still running the previous release has no serializer time
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], totals['buckets'])]
+    return requests, cache_lookups, views
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def metrics_text():
+    #All workers' totals in the Prometheus text exposition format
+    snapshots = [metrics.snapshot()]
+    for key, snapshot in cache.get_many(cache.get(WORKERS_KEY) or []).items():
+        if key != _worker_key: #This worker's own numbers are taken live
+            snapshots.append(snapshot)
+    requests, cache_lookups, views = _merge(snapshots)
+
+    lines = [
+        '# HELP stlibrary_requests_total Requests handled, by view, method and status code.',
+        '# TYPE stlibrary_requests_total counter',
+    ]
+    for (view, method, status), count in sorted(requests.items()):
+        lines.append(f'stlibrary_requests_total{{view="{_label(view)}",method="{method}",status="{status}"}} {count}')
+
+    lines += [
+        '# HELP stlibrary_response_cache_requests_total Response cache lookups, by endpoint and result (hit or miss).',
+        '# TYPE stlibrary_response_cache_requests_total counter',
+    ]
+    for (endpoint, result), count in sorted(cache_lookups.items()):
+        lines.append(f'stlibrary_response_cache_requests_total{{endpoint="{_label(endpoint)}",result="{result}"}} {count}')
+
+    lines += [
+        '# HELP stlibrary_request_duration_seconds Wall time of the sampled requests.',
+        '# TYPE stlibrary_request_duration_seconds histogram',
+    ]
+    for view, totals in sorted(views.items()):
+        for bound, count in zip(BUCKETS, totals['buckets']):
+            lines.append(f'stlibrary_request_duration_seconds_bucket{{view="{_label(view)}",le="{bound}"}} {count}')
+        lines.append(f'stlibrary_request_duration_seconds_bucket{{view="{_label(view)}",le="+Inf"}} {totals["sampled"]}')
+        lines.append(f'stlibrary_request_duration_seconds_sum{{view="{_label(view)}"}} {totals["seconds"]:.6f}')
+        lines.append(f'stlibrary_request_duration_seconds_count{{view="{_label(view)}"}} {totals["sampled"]}')
+
+    for name, key, help_text in (
+        ('stlibrary_request_db_queries_total', 'db_queries', 'SQL queries run by the sampled requests.'),
+        ('stlibrary_request_db_seconds_total', 'db_seconds', 'Time the sampled requests spent in SQL.'),
+        ('stlibrary_request_serialize_seconds_total', 'serialize_seconds', 'Time the sampled requests spent in DRF serializers.'),
+        ('stlibrary_request_render_seconds_total', 'render_seconds', 'Time the sampled requests spent rendering templates and API responses.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for view, totals in sorted(views.items()):
+            value = totals[key]
+            lines.append(f'{name}{{view="{_label(view)}"}} {value if isinstance(value, int) else f"{value:.6f}"}')
+    return '\n'.join(lines) + '\n'
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched' #404s that matched no URL, kept under one label so random URLs cannot add new series
+    return f'{match.func.__module__}.{match.func.__name__}'
+
+
+class PerformanceMiddleware: #First in MIDDLEWARE, so the time of the other middleware is included
+    #Sync and async capable, so under ASGI (see STLibrary/asgi.py) django does not wrap it in an extra switch between the event loop
+    #and its thread for sync code on every request
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine #How django 3.2 tells that __call__ returns a coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timer = self._start(request)
+        if timer is not None:
+            with connection.execute_wrapper(timer.record_query):
+                response = self.get_response(request)
+        else:
+            response = self.get_response(request)
+        return self._finish(request, response, timer)
+
+    async def __acall__(self, request):
+        #The sync views still run on django's sync thread, where the query wrapper above can not be installed from here.
+        #Their SQL time is counted as app time under ASGI
+        timer = self._start(request)
+        response = await self.get_response(request)
+        return self._finish(request, response, timer)
+
+    def _start(self, request):
+        if request.path == settings.PERFORMANCE_METRICS_PATH: #Scrapes would otherwise make up most of the samples
+            request._performance_skip = True
+            return None
+        timer = None
+        if settings.PERFORMANCE_SAMPLE_RATE and random.random() < settings.PERFORMANCE_SAMPLE_RATE:
+            timer = request._performance_timer = RequestTimer()
+        _current_timer.set(timer) #Also None, so an unsampled request never reports into the previous request's timer on this thread
+        return timer
+
+    def _finish(self, request, response, timer):
+        if getattr(request, '_performance_skip', False):
+            return response
+        if timer is not None:
+            total = time.perf_counter() - timer.started
+            if settings.PERFORMANCE_SERVER_TIMING:
+                response['Server-Timing'] = timer.server_timing(total)
+
+        view = _view_name(request)
+        metrics.count(view, request.method, response.status_code)
+        if timer is not None:
+            metrics.observe(view, timer, total)
+        now = time.monotonic()
+        if now - metrics.flushed_at >= settings.PERFORMANCE_METRICS_FLUSH_INTERVAL:
+            _flush(now)
+        return response
+
+    def process_template_response(self, request, response): #Called just before a TemplateResponse or DRF Response is rendered
+        timer = getattr(request, '_performance_timer', None)
+        if timer is not None:
+            timer.start_rendering()
+            response.add_post_render_callback(lambda rendered: timer.stop_rendering()) #stop_rendering returns None, so the response is kept
+        return response
+
+
+class TimedSerializerMixin: #Put first in the bases of a DRF serializer to time its to_representation (output) and run_validation (input)
+    def to_representation(self, instance):
+        timer = _current_timer.get()
+        if timer is None:
+            return super().to_representation(instance)
+        with timer.serializing():
+            return super().to_representation(instance)
+
+    def run_validation(self, *args, **kwargs):
+        timer = _current_timer.get()
+        if timer is None:
+            return super().run_validation(*args, **kwargs)
+        with timer.serializing():
+            return super().run_validation(*args, **kwargs)
+
+
+class TimedTemplate(Template): #Times render() calls from views that use django's render() shortcut (the HTML pages)
+    def render(self, context=None, request=None):
+        timer = getattr(request, '_performance_timer', None)
+        if timer is None:
+            return super().render(context, request)
+        with timer.rendering():
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates): #The normal django template backend, returning TimedTemplate (TEMPLATES['BACKEND'] in settings.py)
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
@@ -0,0 +1,205 @@
+#Inventory counters behind the inventory/api/ endpoint. Rather than running SUM/COUNT over the Book and BookCheckout tables on
+#every call, InventorySummary (one row) and AuthorInventory (one row per author) are adjusted with F() increments by each
+#write: the Book save/delete signals (forms, API, admin), the bulk add path and the checkout and return services.
+#The increments are applied once the write's transaction has committed (transaction.on_commit), in a short transaction of
+#their own. Inside the checkout transaction they would lock the one InventorySummary row until commit, so every checkout of
+#every book would wait for the one before it. A write that rolls back never changes the counters.
+#The counters can drift (a worker dying between the commit and the increments, raw SQL edits to the catalogue).
+#`python manage.py recompute_inventory` rebuilds both tables from scratch, run it with --loop to do that periodically.
+
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import AuthorInventory, Book, BookCheckout, InventorySummary
+
+
+SUMMARY_ID = 1
+
+
+def _author_key(author):
+    return author or ''
+
+
+def snapshot(book): #Called after a book is saved, so the next save of the same instance only applies its own change
+    book._inventory_snapshot = (book.author, book.available_copies)
+
+
+class _Batch: #The deltas queued by one transaction, kept on its connection
+    def __init__(self):
+        self.open = True #Later deltas of the transaction join it. Closed by the first of its deltas to run after the commit
+        self.recomputed = False #recompute() ran after this commit, so it already counted every delta of the batch
+
+
+def _apply(titles=0, copies=0, checked_out=0, authors=None):
+    #authors maps author -> (titles, copies, checked_out) deltas. Applied after the current transaction commits (straight away outside one)
+    if not (titles or copies or checked_out or authors):
+        return
+    authors = {author: tuple(totals) for author, totals in (authors or {}).items()} #A copy: the callers' dicts may change before the commit
+    connection = transaction.get_connection()
+    batch = getattr(connection, '_inventory_batch', None)
+    if batch is None or not batch.open: #A batch left open by a rolled back transaction is reused, none of its deltas ever ran
+        batch = connection._inventory_batch = _Batch()
+    transaction.on_commit(lambda: _write(batch, titles, copies, checked_out, authors))
+
+
+def _write(batch, titles, copies, checked_out, authors):
+    batch.open = False
+    if batch.recomputed: #An earlier delta of the same commit found no summary row and rebuilt the counters, this change included
+        return
+    with transaction.atomic():
+        updated = InventorySummary.objects.filter(pk=SUMMARY_ID).update(
+            total_titles=F('total_titles') + titles,
+            total_available_copies=F('total_available_copies') + copies,
+            copies_checked_out=F('copies_checked_out') + checked_out,
+        )
+        if not updated: #The summary row is missing (flushed tables): rebuild everything, which already includes this change and the rest of the commit's
+            recompute()
+            batch.recomputed = True
+            return
+        changes = [(titles, copies, checked_out, author) for author, (titles, copies, checked_out) in authors.items() if titles or copies or checked_out]
+        if changes:
+            _apply_authors(changes)
+
+
+def _apply_authors(changes):
+    #changes is a list of (titles, copies, checked_out, author) deltas. All the authors are updated by one executemany (a bulk import
+    #touches hundreds of authors per batch, an ORM update() each cost far more than the UPDATE itself)
+    sql = (f'UPDATE "{AuthorInventory._meta.db_table}" SET titles = titles + %s, available_copies = available_copies + %s, '
+           f'checked_out = checked_out + %s WHERE author = %s')
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, changes)
+        if cursor.rowcount == len(changes):
+            return
+        #Some of these authors have no row yet (their first book). The others were updated above
+        known = set(AuthorInventory.objects.filter(author__in=[change[3] for change in changes]).values_list('author', flat=True))
+        missing = [change for change in changes if change[3] not in known]
+        AuthorInventory.objects.bulk_create([AuthorInventory(author=change[3]) for change in missing], ignore_conflicts=True) #ignore_conflicts: another write may have just created one
+        cursor.executemany(sql, missing)
+
+
+def record_books_added(books):
+    authors = defaultdict(lambda: [0, 0, 0])
+    for book in books:
+        totals = authors[_author_key(book.author)]
+        totals[0] += 1
+        totals[1] += book.available_copies
+        snapshot(book)
+    _apply(titles=len(books), copies=sum(book.available_copies for book in books), authors=authors)
+
+
+def record_book_saved(book, created):
+    if created:
+        record_books_added([book])
+        return
+    old_author, old_copies = getattr(book, '_inventory_snapshot', (None, None))
+    if old_copies is None: #A book instance that was not loaded from the database (e.g. built by hand with a pk). Nothing to diff against
+        snapshot(book)
+        return
+    new_author, new_copies = _author_key(book.author), book.available_copies
+    old_author = _author_key(old_author)
+    if old_author == new_author:
+        authors = {new_author: (0, new_copies - old_copies, 0)}
+    else: #The book moves to another author, together with its open checkouts
+        checked_out = BookCheckout.objects.open().filter(book=book).count()
+        authors = {old_author: (-1, -old_copies, -checked_out), new_author: (1, new_copies, checked_out)}
+    _apply(copies=new_copies - old_copies, authors=authors)
+    snapshot(book)
+
+
+def record_books_updated(books):
+    #record_book_saved for many books at once (the import_books command updates them without save(), so no signals are sent).
+    #One counter update per author, and one query for the open loans of the books that moved to another author
+    moved = [book.pk for book in books if _author_key(book._inventory_snapshot[0]) != _author_key(book.author)]
+    loans = dict(BookCheckout.objects.open().filter(book_id__in=moved).values_list('book').annotate(Count('id')).order_by()) if moved else {}
+    authors = defaultdict(lambda: [0, 0, 0])
+    copies = 0
+    for book in books:
+        old_author, old_copies = book._inventory_snapshot
+        old_author, new_author = _author_key(old_author), _author_key(book.author)
+        copies += book.available_copies - old_copies
+        if old_author == new_author:
+            authors[new_author][1] += book.available_copies - old_copies
+        else:
+            checked_out = loans.get(book.pk, 0)
+            for author, sign, author_copies in ((old_author, -1, old_copies), (new_author, 1, book.available_copies)):
+                authors[author][0] += sign
+                authors[author][1] += sign * author_copies
+                authors[author][2] += sign * checked_out
+        snapshot(book)
+    _apply(copies=copies, authors=authors)
+
+
+def record_book_deleted(book): #Its checkouts are deleted with it and counted off one by one by record_checkout_deleted
+    _apply(titles=-1, copies=-book.available_copies, authors={_author_key(book.author): (-1, -book.available_copies, 0)})
+
+
+def record_copies_changed(author, increment):
+    _apply(copies=increment, authors={_author_key(author): (0, increment, 0)})
+
+
+def record_checkout(book_id): #One copy went from available to checked out
+    author = Book.objects.filter(pk=book_id).values_list('author', flat=True).first()
+    _apply(copies=-1, checked_out=1, authors={_author_key(author): (0, -1, 1)})
+
+
+def record_checkouts(authors): #Many copies checked out at once (services.bulk_checkout). authors maps author -> copies
+    changes = defaultdict(lambda: [0, 0, 0])
+    for author, count in authors.items():
+        changes[_author_key(author)][1] -= count
+        changes[_author_key(author)][2] += count
+    total = sum(authors.values())
+    _apply(copies=-total, checked_out=total, authors=changes)
+
+
+def record_return(book_id): #One copy came back: the reverse of record_checkout
+    author = Book.objects.filter(pk=book_id).values_list('author', flat=True).first()
+    _apply(copies=1, checked_out=-1, authors={_author_key(author): (0, 1, -1)})
+
+
+def record_checkout_deleted(checkout):
+    if checkout.returned_at is not None: #Already counted back in when it was returned
+        return
+    author = Book.objects.filter(pk=checkout.book_id).values_list('author', flat=True).first()
+    _apply(checked_out=-1, authors={_author_key(author): (0, 0, -1)})
+
+
+def recompute():
+    #Rebuilds both counter tables from the Book and BookCheckout tables. Two GROUP BY queries, however big the catalogue
+    with transaction.atomic():
+        authors = defaultdict(lambda: [0, 0, 0])
+        rows = Book.objects.annotate(key=Coalesce('author', Value(''))).values('key').annotate(titles=Count('id'), copies=Sum('available_copies')).order_by()
+        for row in rows:
+            authors[row['key']][0] = row['titles']
+            authors[row['key']][1] = row['copies'] or 0
+        loans = BookCheckout.objects.open().annotate(key=Coalesce('book__author', Value(''))).values('key').annotate(loans=Count('id')).order_by()
+        for row in loans:
+            authors[row['key']][2] = row['loans']
+
+        AuthorInventory.objects.all().delete()
+        AuthorInventory.objects.bulk_create([AuthorInventory(author=author, titles=t, available_copies=c, checked_out=o) for author, (t, c, o) in authors.items()])
+        InventorySummary.objects.update_or_create(pk=SUMMARY_ID, defaults={
+            'total_titles': sum(totals[0] for totals in authors.values()),
+            'total_available_copies': sum(totals[1] for totals in authors.values()),
+            'copies_checked_out': sum(totals[2] for totals in authors.values()),
+        })
+
+
+def summary():
+    #The numbers served by inventory/api/: two small reads, no aggregation over books
+    row = InventorySummary.objects.filter(pk=SUMMARY_ID).first()
+    if row is None:
+        recompute()
+        row = InventorySummary.objects.get(pk=SUMMARY_ID)
+    return {
+        'total_titles': row.total_titles,
+        'total_available_copies': row.total_available_copies,
+        'copies_checked_out': row.copies_checked_out,
+        'authors': list(author_rows()),
+    }
+
+
+def author_rows(): #Also EXPLAINed by query_audit.py
+    return AuthorInventory.objects.filter(titles__gt=0).values('author', 'titles', 'available_copies', 'checked_out')
@@ -0,0 +1,81 @@
+#Background email delivery. queue_email() stores a message in the OutgoingEmail outbox table and returns at once, so a slow
+#mail server never holds up a request. `python manage.py send_queued_emails --loop` sends what is due in batches over one
+#SMTP connection, and retries failures with exponential backoff until EMAIL_QUEUE_MAX_ATTEMPTS is reached.
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+
+def queue_email(subject, message, from_email, recipient_list): #Same arguments as django.core.mail.send_mail
+    return OutgoingEmail.objects.create(subject=subject, body=message, from_email=from_email, to=','.join(recipient_list))
+
+
+def retry_delay(attempts): #30s, 60s, 120s, ... capped at EMAIL_QUEUE_MAX_BACKOFF seconds (with the default settings)
+    return timedelta(seconds=min(settings.EMAIL_QUEUE_RETRY_BACKOFF * 2 ** (attempts - 1), settings.EMAIL_QUEUE_MAX_BACKOFF))
+
+
+def claim_due_emails(batch_size):
+    #Picks up to batch_size due messages and leases them to this worker by moving next_attempt_at forward, so other workers
+    #skip them. If this worker dies mid-send the lease runs out and another worker retries them.
+    #The attempt is counted by the same UPDATE that takes the lease, before anything is sent: a message that makes its worker
+    #crash every time still reaches EMAIL_QUEUE_MAX_ATTEMPTS, and is then marked failed here instead of being leased again
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutgoingEmail.objects.filter(status=OutgoingEmail.Status.PENDING, next_attempt_at__lte=now).order_by('next_attempt_at')
+        if connection.features.has_select_for_update_skip_locked: #Postgres: workers never block on rows another worker is claiming. SQLite serialises writers anyway
+            due = due.select_for_update(skip_locked=True)
+        emails = list(due[:batch_size])
+        exhausted = [email.pk for email in emails if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS] #Every attempt so far ended without a result (a crashed worker)
+        if exhausted:
+            OutgoingEmail.objects.filter(pk__in=exhausted).update(status=OutgoingEmail.Status.FAILED, last_error='Lease expired: the worker sending it stopped before it finished.')
+        emails = [email for email in emails if email.pk not in exhausted]
+        OutgoingEmail.objects.filter(pk__in=[email.pk for email in emails]).update(attempts=F('attempts') + 1, next_attempt_at=now + timedelta(seconds=settings.EMAIL_QUEUE_LEASE))
+    for email in emails:
+        email.attempts += 1
+    return emails
+
+
+def send_queued_emails(batch_size=50):
+    #Sends one batch of due messages over a single mail server connection. Returns (sent, failed) counts for this batch
+    emails = claim_due_emails(batch_size)
+    if not emails:
+        return 0, 0
+
+    sent = failed = 0
+    mail_connection = get_connection(fail_silently=False)
+    try:
+        mail_connection.open() #One SMTP conversation (connect, TLS, login) for the whole batch
+    except Exception as error:
+        for email in emails:
+            _record_failure(email, error)
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            message = EmailMessage(email.subject, email.body, email.from_email, email.to.split(','), connection=mail_connection)
+            try:
+                message.send()
+            except Exception as error: #Whatever the mail backend raised, the message stays queued for a retry
+                _record_failure(email, error)
+                failed += 1
+            else:
+                OutgoingEmail.objects.filter(pk=email.pk).update(status=OutgoingEmail.Status.SENT, sent_at=timezone.now(), body='', last_error='')
+                sent += 1
+    finally:
+        mail_connection.close()
+    return sent, failed
+
+
+def _record_failure(email, error): #email.attempts already counts this attempt (claim_due_emails)
+    if email.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+        changes = {'status': OutgoingEmail.Status.FAILED}
+    else:
+        changes = {'next_attempt_at': timezone.now() + retry_delay(email.attempts)}
+    OutgoingEmail.objects.filter(pk=email.pk).update(last_error=f'{type(error).__name__}: {error}', **changes)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from STBookInventory import query_audit
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the main query of each endpoint and flags full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print the whole plan of every query')
+
+    def handle(self, *args, **options):
+        unexpected = []
+        for endpoint, plan, scans, allowed in query_audit.audit():
+            if not scans:
+                self.stdout.write(self.style.SUCCESS(f'ok      {endpoint}'))
+            elif allowed:
+                self.stdout.write(self.style.WARNING(f'scan    {endpoint} (expected: {allowed})'))
+            else:
+                self.stdout.write(self.style.ERROR(f'SCAN    {endpoint}'))
+                unexpected.append(endpoint)
+            if options['verbose_plans'] or (scans and not allowed):
+                for line in plan.splitlines():
+                    self.stdout.write(f'          {line}')
+
+        if unexpected:
+            raise CommandError(f"Full table scans in: {', '.join(unexpected)}")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from STBookInventory import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Sends requests to the REST endpoints and prints p50/p95/p99 latency, requests/sec and queries per request as JSON. '
+            'Needs the data from seed_benchmark_data. Writes (create, checkout) are rolled back after each scenario. '
+            'Fails when a scenario gets a response other than 2xx')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=5, help='Requests sent before measuring each scenario')
+        parser.add_argument('--bulk-size', type=int, default=100, help='Books per request in the create_bulk scenario')
+        parser.add_argument('--scenario', action='append', choices=benchmarks.SCENARIOS, help='Only run this scenario (can be repeated)')
+        parser.add_argument('--output', help='Also write the JSON to this file')
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.run(requests=options['requests'], scenarios=options['scenario'], warmup=options['warmup'], bulk_size=options['bulk_size'])
+        except ValueError as error:
+            raise CommandError(error)
+        output = benchmarks.dumps(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
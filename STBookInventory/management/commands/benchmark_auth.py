@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from STBookInventory.authentication import CachedTokenAuthentication, invalidate_token
+from STBookInventory.models import User
+
+
+def _view_with(authentication_class): #The same trivial authenticated endpoint, once per authentication class, so only the auth step differs
+    @api_view(['GET'])
+    @authentication_classes([authentication_class])
+    @permission_classes([IsAuthenticated])
+    def view(request):
+        return Response({'user': request.user.pk})
+    return view
+
+
+class Command(BaseCommand):
+    help = 'Compares requests/sec of an authenticated API call with DRF TokenAuthentication and with CachedTokenAuthentication. The benchmark user and token are rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per authentication class')
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        factory = APIRequestFactory()
+
+        with transaction.atomic():
+            user = User.objects.create_user(email='benchmark-auth@example.invalid', password='benchmark')
+            token = Token.objects.create(user=user)
+
+            for name, authentication_class in (('TokenAuthentication', TokenAuthentication), ('CachedTokenAuthentication', CachedTokenAuthentication)):
+                view = _view_with(authentication_class)
+                started = time.perf_counter()
+                for _ in range(total):
+                    response = view(factory.get('/', HTTP_AUTHORIZATION='Token ' + token.key))
+                    assert response.status_code == 200, response.data
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{name:<28} {total / elapsed:10.1f} requests/sec')
+
+            invalidate_token(token.key)
+            transaction.set_rollback(True)
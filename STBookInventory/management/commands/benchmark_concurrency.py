@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from STBookInventory import benchmarks
+from STBookInventory.models import Book, User
+
+
+class Command(BaseCommand):
+    help = ('Sends reads to a running server (e.g. the WSGI and then the ASGI profile, see STLibrary/asgi.py) over many HTTP '
+            'connections at once and prints latency percentiles and requests/sec per connection count as JSON. Needs the data from seed_benchmark_data')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='The server to load')
+        parser.add_argument('--connections', type=int, nargs='+', default=[10, 100, 500], help='Open connections, one run per value')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per run')
+        parser.add_argument('--scenario', choices=benchmarks.CONCURRENCY_SCENARIOS, default='read_one')
+        parser.add_argument('--output', help='Also write the JSON to this file')
+
+    def handle(self, *args, **options):
+        staff = User.objects.filter(email=benchmarks.STAFF_EMAIL).first()
+        book_ids = list(Book.objects.filter(isbn__startswith=benchmarks.ISBN_PREFIX).order_by('id').values_list('id', flat=True)[:1000])
+        if staff is None or not book_ids:
+            raise CommandError('No benchmark data, run `python manage.py seed_benchmark_data` first')
+        token = Token.objects.get_or_create(user=staff)[0].key
+        paths = benchmarks.concurrency_paths(options['scenario'], book_ids)
+
+        results = {'url': options['url'], 'scenario': options['scenario'], 'runs': []}
+        for connections in options['connections']:
+            benchmarks.load(options['url'], paths, min(connections, 20), 100, token) #Warm up caches and connections
+            results['runs'].append(benchmarks.load(options['url'], paths, connections, options['requests'], token))
+        output = benchmarks.dumps(results)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        self.stdout.write(output)
@@ -0,0 +1,41 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from STBookInventory import accounts
+from STBookInventory.hashers import ConfigurablePBKDF2PasswordHasher
+
+
+class Command(BaseCommand):
+    help = ('Times one password hash (what every login and signup pays) for a few PASSWORD_HASH_ITERATIONS values, and the '
+            'parallel hashing import_users uses. Pick the largest cost the login traffic can afford')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, nargs='+', help='Default: half, the current setting, and double')
+        parser.add_argument('--rounds', type=int, default=5, help='Hashes timed per value, the best one is reported')
+        parser.add_argument('--users', type=int, default=0, help='Also time hashing this many passwords with accounts.hash_passwords')
+
+    def handle(self, *args, **options):
+        current = settings.PASSWORD_HASH_ITERATIONS
+        hasher = ConfigurablePBKDF2PasswordHasher()
+        salt = hasher.salt()
+        self.stdout.write(f'{os.cpu_count()} CPU(s), current PASSWORD_HASH_ITERATIONS={current}')
+        for iterations in options['iterations'] or [current // 2, current, current * 2]:
+            best = None
+            for _ in range(options['rounds']):
+                started = time.perf_counter()
+                hasher.encode('correct horse battery staple', salt, iterations)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            marker = '  <- current' if iterations == current else ''
+            self.stdout.write(f'{iterations:>10} iterations   {best * 1000:8.1f} ms per hash   {1 / best:8.1f} logins/sec per core{marker}')
+
+        if options['users']:
+            passwords = [f'password-{n}' for n in range(options['users'])]
+            for processes in sorted({1, os.cpu_count() or 1}):
+                started = time.perf_counter()
+                accounts.hash_passwords(passwords, processes)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{options['users']} passwords, {processes} process(es): {elapsed:.2f}s ({options['users'] / elapsed:.1f} hashes/sec)")
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from STBookInventory.models import Book, User
+from STBookInventory.renderers import FastJSONRenderer, orjson
+from STBookInventory.serializers import BookSerializer, book_rows
+
+
+def _timed(function, repeat):
+    best = None
+    for _ in range(repeat): #The best of a few runs, the others are noise from the rest of the machine
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+class Command(BaseCommand):
+    help = ('Compares rows/sec of BookSerializer + JSONRenderer with the book_rows() + FastJSONRenderer fast path used by read/api/, '
+            'and checks both give the same bytes. The benchmark books are rolled back afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        with transaction.atomic():
+            user = User.objects.create_user(email='benchmark-serializers@example.invalid', password=None)
+            Book.objects.bulk_create([
+                Book(isbn=f'BS{n:011d}', title=f'Benchmark title {n}', author=f'Author {n % 100}' if n % 7 else None, available_copies=n % 20, user=user)
+                for n in range(rows)
+            ], batch_size=1000)
+            books = Book.objects.filter(user=user).order_by('id')
+
+            data, serializer_time = _timed(lambda: BookSerializer(books, many=True).data, repeat)
+            body, render_time = _timed(lambda: JSONRenderer().render(data), repeat)
+            fast_data, fast_serializer_time = _timed(lambda: list(book_rows(books)), repeat)
+            fast_body, fast_render_time = _timed(lambda: FastJSONRenderer().render(fast_data), repeat)
+            transaction.set_rollback(True)
+
+        if fast_body != body:
+            raise CommandError('The fast path gave different JSON than BookSerializer')
+
+        self.stdout.write(f"{rows} books, JSON encoder of the fast path: {'orjson' if orjson else 'json (orjson is not installed)'}")
+        for name, serialize, render in (
+            ('BookSerializer + JSONRenderer', serializer_time, render_time),
+            ('book_rows + FastJSONRenderer', fast_serializer_time, fast_render_time),
+        ):
+            self.stdout.write(f'{name:<30} query+serialize {rows / serialize:12.0f} rows/sec   render {rows / render:12.0f} rows/sec   total {rows / (serialize + render):12.0f} rows/sec')
+        self.stdout.write(self.style.SUCCESS('Identical JSON output'))
@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework.authtoken.models import Token
+
+from STBookInventory import compression
+from STBookInventory.models import Book, User
+from STBookInventory.pagination import BookKeysetPagination
+
+
+class Command(BaseCommand):
+    help = ('Measures the bytes and the server latency of one large read/api/ page with all fields and with ?fields=id,title, '
+            'uncompressed, gzip and brotli. The benchmark books are rolled back afterwards, the response cache is off while it runs')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Books on the page (the page_size)')
+        parser.add_argument('--repeat', type=int, default=20, help='Requests per variant, the median latency is reported')
+        parser.add_argument('--fields', default='id,title', help='The sparse fieldset compared with the full one')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        encodings = ['identity', 'gzip'] + (['br'] if compression.brotli is not None else [])
+        results = []
+        with transaction.atomic(), override_settings(RESPONSE_CACHE_TIMEOUT=0, PERFORMANCE_SAMPLE_RATE=0, ALLOWED_HOSTS=['testserver'], BOOK_MAX_PAGE_SIZE=max(rows, 1)):
+            user = User.objects.create_user(email='benchmark-sparse-fields@example.invalid', password=None)
+            Book.objects.bulk_create([
+                Book(isbn=f'SF{n:011d}', title=f'Benchmark title {n}', author=f'Author {n % 100}', available_copies=n % 20, user=user)
+                for n in range(rows)
+            ], batch_size=1000)
+            client = Client(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+            first = Book.objects.filter(user=user).order_by('id').first().id
+            base = f'/stbookinventory/read/api/?pagination=cursor&page_size={rows}&cursor=' #A cursor just before the benchmark books, so the page holds exactly them
+            base += BookKeysetPagination().encode_cursor({'o': 'id', 'id': first - 1})
+
+            for label, url in (('all fields', base), (f"fields={options['fields']}", f"{base}&fields={options['fields']}")):
+                for encoding in encodings:
+                    timings, size = [], None
+                    for _ in range(options['repeat'] + 1):
+                        started = time.perf_counter()
+                        response = client.get(url, HTTP_ACCEPT_ENCODING=encoding)
+                        timings.append(time.perf_counter() - started)
+                        if response.status_code != 200:
+                            raise CommandError(f'{url} answered {response.status_code}')
+                        size = len(response.content)
+                    results.append((label, encoding, size, statistics.median(timings[1:]))) #The first request warms up
+            transaction.set_rollback(True)
+
+        baseline_size, baseline_time = results[0][2], results[0][3]
+        self.stdout.write(f'{rows} books per page, median of {options["repeat"]} requests, server side (no network)')
+        for label, encoding, size, seconds in results:
+            self.stdout.write(f'{label:<22} {encoding:<9} {size:>10} bytes ({size / baseline_size:6.1%})   {seconds * 1000:7.2f} ms ({seconds / baseline_time:6.1%})')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from STBookInventory import openapi
+
+
+class Command(BaseCommand):
+    help = ('Generates the OpenAPI schema served at api/schema/ and writes it to OPENAPI_SCHEMA_DIR (schema.yaml, schema.json, schema.meta.json). '
+            'Run it at build/deploy time, a worker that finds no schema or a stale one generates it on its first schema request instead')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help='Directory to write to. Default: settings.OPENAPI_SCHEMA_DIR')
+        parser.add_argument('--check', action='store_true', help='Write nothing, fail when the schema on disk is missing or stale (for CI)')
+
+    def handle(self, *args, **options):
+        if options['check']:
+            schema = openapi.read(options['output'])
+            if not openapi.is_current(schema):
+                raise CommandError('The OpenAPI schema is ' + ('missing' if schema is None else 'stale (the URLconf or the API code changed)') + ', run generate_openapi_schema')
+            self.stdout.write(self.style.SUCCESS(f"The OpenAPI schema is current (version {schema.version}, generated {schema.meta['generated_at']})"))
+            return
+
+        schema = openapi.generate()
+        openapi.write(schema, options['output'])
+        openapi.reset()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote the OpenAPI schema version {schema.version} in {schema.meta['generation_seconds'] * 1000:.0f}ms "
+            f"({', '.join(f'{name} {len(body)} bytes' for name, body in schema.bodies.items())})"
+        ))
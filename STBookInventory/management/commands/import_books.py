@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from STBookInventory import importer
+from STBookInventory.models import User
+
+
+class Command(BaseCommand):
+    help = ('Imports books from a CSV (with a header row) or NDJSON file of any size. Rows are validated like BookSerializer and upserted by isbn '
+            'in batched transactions. Rejected rows go to <file>.rejects.ndjson. An interrupted import resumes from <file>.checkpoint.json '
+            'when the same command is run again')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='Email of the account new books are added by')
+        parser.add_argument('--format', choices=importer.FORMATS, help='Default: csv for a .csv file, ndjson otherwise')
+        parser.add_argument('--batch-size', type=int, help='Rows per transaction. Default: settings.IMPORT_BATCH_SIZE')
+        parser.add_argument('--checkpoint', help='Checkpoint file. Default: <path>.checkpoint.json')
+        parser.add_argument('--rejects', help='Rejected rows file. Default: <path>.rejects.ndjson')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and import the whole file again')
+
+    def handle(self, *args, **options):
+        owner = User.objects.filter(email=options['user']).first()
+        if owner is None:
+            raise CommandError(f"No user with the email {options['user']}")
+
+        def progress(totals):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"line {totals['line']}: {totals['rows'] / max(totals['seconds'], 1e-9):.0f} rows/sec")
+
+        try:
+            totals = importer.import_file(
+                options['path'], owner, fmt=options['format'], batch_size=options['batch_size'], checkpoint_path=options['checkpoint'],
+                rejects_path=options['rejects'], restart=options['restart'], progress=progress,
+            )
+        except (OSError, ValueError) as error:
+            raise CommandError(str(error))
+
+        if totals['resumed']:
+            self.stdout.write('Resumed from the checkpoint, the totals include the earlier run(s)')
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['created']} created, {totals['updated']} updated, {totals['unchanged']} unchanged, {totals['rejected']} rejected. "
+            f"{totals['rows']} rows in {totals['seconds']:.1f}s ({totals['rows'] / max(totals['seconds'], 1e-9):.0f} rows/sec)"
+        ))
+        if totals['rejected']:
+            self.stdout.write(self.style.WARNING(f"Rejected rows: {options['rejects'] or options['path'] + '.rejects.ndjson'}"))
@@ -0,0 +1,77 @@
+import csv
+import time
+
+from django.contrib.auth.models import Group
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+
+from STBookInventory import accounts
+from STBookInventory.models import User
+
+
+class Command(BaseCommand):
+    help = ('Creates user accounts from a CSV file with a header row: email (required), password, name, account_type, groups (names separated by ;). '
+            'Passwords are hashed in parallel processes, then every batch is inserted with bulk_create in one transaction (the same path as signup/). '
+            'A row without a password gets an unusable one, the user sets it through forgot_password. Existing emails are skipped')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500, help='Users per transaction')
+        parser.add_argument('--processes', type=int, help='Processes that hash passwords. Default: settings.PASSWORD_HASH_PROCESSES (0 = one per CPU)')
+        parser.add_argument('--create-groups', action='store_true', help='Create groups that do not exist yet instead of rejecting their rows')
+        parser.add_argument('--no-tokens', action='store_true', help='Do not create API tokens for the new users')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as handle: #utf-8-sig drops the byte order mark spreadsheet programs write
+                rows = list(enumerate(csv.DictReader(handle), start=2)) #Line 1 is the header
+        except OSError as error:
+            raise CommandError(str(error))
+        if rows and 'email' not in rows[0][1]:
+            raise CommandError(f"{options['path']} has no email column")
+
+        groups = dict(Group.objects.values_list('name', 'id'))
+        seen, valid, rejected = set(User.objects.values_list('email', flat=True)), [], []
+        for line, row in rows:
+            email = User.objects.normalize_email((row.get('email') or '').strip())
+            account_type = (row.get('account_type') or '').strip() or User.AccountType.GENERAL_USER
+            names = [name.strip() for name in (row.get('groups') or '').split(';') if name.strip()]
+            try:
+                validate_email(email)
+            except ValidationError:
+                rejected.append((line, f'invalid email {email!r}'))
+                continue
+            if email in seen:
+                rejected.append((line, f'{email} already exists'))
+                continue
+            if account_type not in User.AccountType.values:
+                rejected.append((line, f'unknown account_type {account_type!r}'))
+                continue
+            missing = [name for name in names if name not in groups]
+            if missing and not options['create_groups']:
+                rejected.append((line, f"unknown group(s) {', '.join(missing)}"))
+                continue
+            for name in missing:
+                groups[name] = Group.objects.create(name=name).id
+            seen.add(email)
+            valid.append((email, row.get('password') or '', {'name': (row.get('name') or '').strip(), 'account_type': account_type}, [groups[name] for name in names]))
+
+        started, created = time.perf_counter(), 0
+        for start in range(0, len(valid), options['batch_size']):
+            batch = valid[start:start + options['batch_size']]
+            hashed = accounts.hash_passwords([password for _, password, _, _ in batch], options['processes'])
+            users = []
+            for (email, _, fields, _), password in zip(batch, hashed):
+                user = User(email=email, **fields)
+                user.password = password
+                users.append(user)
+            accounts.create_accounts(users, tokens=not options['no_tokens'], groups=[ids for _, _, _, ids in batch])
+            created += len(users)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{created}/{len(valid)} users created')
+
+        for line, reason in rejected:
+            self.stdout.write(self.style.WARNING(f'line {line}: {reason}'))
+        seconds = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{created} users created, {len(rejected)} rows rejected in {seconds:.1f}s ({created / max(seconds, 1e-9):.1f} users/sec)'))
@@ -0,0 +1,68 @@
+import threading
+import time
+from itertools import count
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+
+from STBookInventory import services
+from STBookInventory.models import Book, User
+
+LOAD_TEST_EMAIL = 'load-test-writes@example.invalid'
+
+
+class Command(BaseCommand):
+    help = ('Measures write throughput of the configured database (see DATABASE_ENGINE in settings.py): several threads, each with '
+            'its own connection like separate gunicorn workers, check out books and insert new ones at the same time. '
+            'Everything it creates is deleted afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent writers')
+        parser.add_argument('--seconds', type=float, default=10.0, help='How long to keep writing')
+        parser.add_argument('--books', type=int, default=50, help='Books the checkout writers pick from')
+
+    def handle(self, *args, **options):
+        User.objects.filter(email=LOAD_TEST_EMAIL).delete() #Left over from an interrupted run
+        user = User.objects.create_user(email=LOAD_TEST_EMAIL, password=None, name='Load test')
+        book_ids = [Book.objects.create(isbn=f'LT{n:011d}', title=f'Load test {n}', available_copies=1000000, user=user).id for n in range(options['books'])]
+        isbns = count(options['books'])
+        results = {'checkout': [0, 0], 'insert': [0, 0]} #operation -> [done, failed]
+        lock = threading.Lock()
+        deadline = time.perf_counter() + options['seconds']
+
+        def writer(number):
+            operation = 'checkout' if number % 2 == 0 else 'insert' #Half the threads check out, half add books
+            done = failed = 0
+            try:
+                while time.perf_counter() < deadline:
+                    try:
+                        if operation == 'checkout':
+                            services.checkout_book(book_ids[done % len(book_ids)], user)
+                        else:
+                            with lock:
+                                isbn = f'LT{next(isbns):011d}'
+                            Book.objects.create(isbn=isbn, title='Load test', available_copies=1, user=user)
+                        done += 1
+                    except DatabaseError: #"database is locked" once SQLite's busy timeout runs out, or a dropped connection
+                        failed += 1
+            finally:
+                connections.close_all() #This thread's connection
+            with lock:
+                results[operation][0] += done
+                results[operation][1] += failed
+
+        threads = [threading.Thread(target=writer, args=(number,)) for number in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        User.objects.filter(pk=user.pk).delete() #Also deletes the books and checkouts
+
+        self.stdout.write(f"{connection.vendor}, {options['threads']} threads, {elapsed:.1f}s")
+        for operation, (done, failed) in results.items():
+            self.stdout.write(f'{operation:<10} {done / elapsed:10.1f} writes/sec  ({done} done, {failed} failed)')
+        total = sum(done for done, failed in results.values())
+        self.stdout.write(f"{'total':<10} {total / elapsed:10.1f} writes/sec")
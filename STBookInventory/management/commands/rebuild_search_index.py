@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from STBookInventory import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the catalogue search index (the FTS5 table on SQLite, the GIN index on Postgres) from the Book table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Number of books read and indexed at a time')
+
+    def handle(self, *args, **options):
+        if not (search.fts_available() or connection.vendor == 'postgresql'):
+            self.stdout.write(self.style.WARNING('This database has no search index, searches use the icontains fallback.'))
+            return
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} books.'))
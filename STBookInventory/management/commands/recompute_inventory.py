@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from STBookInventory import inventory
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the inventory counters (InventorySummary and AuthorInventory) from the Book and BookCheckout tables. Run it with --loop to correct any drift periodically'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running and recompute every --interval seconds')
+        parser.add_argument('--interval', type=float, default=3600.0, help='Seconds between two recomputes (with --loop)')
+
+    def handle(self, *args, **options):
+        while True:
+            inventory.recompute()
+            totals = inventory.summary()
+            self.stdout.write(self.style.SUCCESS(
+                f"{totals['total_titles']} titles, {totals['total_available_copies']} copies available, "
+                f"{totals['copies_checked_out']} checked out, {len(totals['authors'])} authors"
+            ))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from STBookInventory import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with users, books and checkouts for benchmark_api. All seeded users have an @benchmark.invalid address'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--checkouts', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed gives the same data')
+        parser.add_argument('--clear', action='store_true', help='Delete the previously seeded data first')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            benchmarks.clear()
+        created = benchmarks.seed(users=options['users'], books=options['books'], checkouts=options['checkouts'], random_seed=options['seed'])
+        self.stdout.write(self.style.SUCCESS(f"Seeded {created['users']} users, {created['books']} books and {created['checkouts']} checkouts."))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from STBookInventory import mail
+
+
+class Command(BaseCommand):
+    help = 'Sends the emails queued in the OutgoingEmail outbox. Run it with --loop as a background worker next to gunicorn'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Messages sent per mail server connection')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new messages')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to wait between polls when the queue is empty (with --loop)')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = mail.send_queued_emails(batch_size=options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+            if sent + failed < options['batch_size']: #Nothing more is due right now (a full batch means more may be waiting)
+                if not options['loop']:
+                    return
+                time.sleep(options['interval'])
@@ -0,0 +1,61 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+#Runs in a fresh interpreter, so the imports are really cold like in a newly started worker
+SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import django
+django.setup()
+timings = {'app_import': time.perf_counter() - started}
+mark = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+timings['urlconf_import'] = time.perf_counter() - mark
+from STBookInventory import openapi
+mark = time.perf_counter()
+schema = openapi.read()
+timings['schema_read'] = time.perf_counter() - mark
+mark = time.perf_counter()
+current = openapi.is_current(schema)
+timings['schema_fingerprint'] = time.perf_counter() - mark
+mark = time.perf_counter()
+openapi.generate()
+timings['schema_generation'] = time.perf_counter() - mark
+print(json.dumps({'timings': timings, 'schema_on_disk': 'current' if current else ('stale' if schema else 'missing')}))
+'''
+
+
+class Command(BaseCommand):
+    help = ('Reports how long a fresh worker takes to import the apps (django.setup) and the URLconf, and how long the OpenAPI schema takes '
+            'to generate compared with reading the precomputed file. Fails when a limit given with --max-* is exceeded')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-import-seconds', type=float, help='Limit for app import + URLconf import')
+        parser.add_argument('--max-schema-seconds', type=float, help='Limit for generating the schema')
+
+    def handle(self, *args, **options):
+        result = subprocess.run([sys.executable, '-c', SCRIPT], capture_output=True, text=True, cwd=settings.BASE_DIR) #The child inherits DJANGO_SETTINGS_MODULE
+        if result.returncode:
+            raise CommandError(f'The startup check failed:\n{result.stderr}')
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        timings = report['timings']
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name.replace('_', ' '):<22} {seconds * 1000:8.1f} ms")
+        self.stdout.write(f"precomputed schema     {report['schema_on_disk']}")
+
+        failures = []
+        if options['max_import_seconds'] is not None and timings['app_import'] + timings['urlconf_import'] > options['max_import_seconds']:
+            failures.append(f"app + URLconf import took {timings['app_import'] + timings['urlconf_import']:.2f}s (limit {options['max_import_seconds']}s)")
+        if options['max_schema_seconds'] is not None and timings['schema_generation'] > options['max_schema_seconds']:
+            failures.append(f"schema generation took {timings['schema_generation']:.2f}s (limit {options['max_schema_seconds']}s)")
+        if report['schema_on_disk'] != 'current':
+            self.stdout.write(self.style.WARNING(f"The precomputed schema is {report['schema_on_disk']}, run generate_openapi_schema before deploying"))
+        if failures:
+            raise CommandError('; '.join(failures))
+        self.stdout.write(self.style.SUCCESS('Startup within limits'))
@@ -0,0 +1,43 @@
+from django.db import OperationalError, migrations
+
+
+#The DDL is written out here rather than imported from search.py, so later changes to search.py never change what this migration does.
+#The names must stay equal to search.BOOK_FTS_TABLE and search.BOOK_SEARCH_INDEX, and the expression to search.POSTGRES_SEARCH_VECTOR
+BOOK_FTS_TABLE = 'STBookInventory_book_fts'
+BOOK_SEARCH_INDEX = 'stbookinventory_book_search_gin'
+POSTGRES_SEARCH_VECTOR = (
+    "(setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B'))"
+)
+
+
+def create_search_index(apps, schema_editor):
+    db_table = apps.get_model('STBookInventory', 'Book')._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(f'CREATE VIRTUAL TABLE "{BOOK_FTS_TABLE}" USING fts5(title, author, isbn, tokenize = "unicode61 remove_diacritics 2")')
+        except OperationalError: #This SQLite was compiled without FTS5, search_books will use the icontains fallback
+            return
+        schema_editor.execute(f'INSERT INTO "{BOOK_FTS_TABLE}" (rowid, title, author, isbn) SELECT id, title, author, isbn FROM "{db_table}"')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX "{BOOK_SEARCH_INDEX}" ON "{db_table}" USING GIN ({POSTGRES_SEARCH_VECTOR})')
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{BOOK_FTS_TABLE}"')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{BOOK_SEARCH_INDEX}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('STBookInventory', '0002_user_account_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index), #FTS5 table on SQLite, GIN expression index on Postgres (see search.py)
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 3.2.23 on 2026-10-18 13:06
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    #The counters of the books already in the database. Without them the first delta after the migration would find no summary row and
+    #rebuild it. Written out here like inventory.recompute(), with the models as they are at this migration: BookCheckout has no
+    #returned_at yet, so every checkout is still out
+    Book = apps.get_model('STBookInventory', 'Book')
+    BookCheckout = apps.get_model('STBookInventory', 'BookCheckout')
+    AuthorInventory = apps.get_model('STBookInventory', 'AuthorInventory')
+    InventorySummary = apps.get_model('STBookInventory', 'InventorySummary')
+    authors = defaultdict(lambda: [0, 0, 0])
+    for row in Book.objects.annotate(key=Coalesce('author', Value(''))).values('key').annotate(titles=Count('id'), copies=Sum('available_copies')).order_by():
+        authors[row['key']][0] = row['titles']
+        authors[row['key']][1] = row['copies'] or 0
+    for row in BookCheckout.objects.annotate(key=Coalesce('book__author', Value(''))).values('key').annotate(loans=Count('id')).order_by():
+        authors[row['key']][2] = row['loans']
+    AuthorInventory.objects.bulk_create([AuthorInventory(author=author, titles=t, available_copies=c, checked_out=o) for author, (t, c, o) in authors.items()])
+    InventorySummary.objects.create(
+        pk=1, #inventory.SUMMARY_ID
+        total_titles=sum(totals[0] for totals in authors.values()),
+        total_available_copies=sum(totals[1] for totals in authors.values()),
+        copies_checked_out=sum(totals[2] for totals in authors.values()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('STBookInventory', '0004_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('author', models.CharField(max_length=100, unique=True)),
+                ('titles', models.IntegerField(default=0)),
+                ('available_copies', models.IntegerField(default=0)),
+                ('checked_out', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['author'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_titles', models.IntegerField(default=0)),
+                ('total_available_copies', models.IntegerField(default=0)),
+                ('copies_checked_out', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop), #Going back drops the tables anyway
+    ]
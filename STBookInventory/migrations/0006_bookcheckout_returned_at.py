@@ -0,0 +1,30 @@
+# Generated by Django 3.2.23 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('STBookInventory', '0005_inventory_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookcheckout',
+            name='returned_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bookcheckout',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['user', 'book'], name='open_checkout_user_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcheckout',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['book'], name='open_checkout_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcheckout',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['checkout_date_time'], name='open_checkout_date_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.23 on 2026-10-18 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('STBookInventory', '0006_bookcheckout_returned_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='bookcheckout',
+            name='open_checkout_user_book_idx',
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'id'], name='book_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'title'], name='book_author_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcheckout',
+            index=models.Index(fields=['book', '-checkout_date_time'], name='checkout_book_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcheckout',
+            index=models.Index(fields=['user', '-checkout_date_time'], name='checkout_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookcheckout',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['user', 'book', 'checkout_date_time'], name='open_checkout_user_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['account_type'], name='user_account_type_idx'),
+        ),
+    ]
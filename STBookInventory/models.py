@@ -1,34 +1,129 @@
+from datetime import timedelta
+
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, UserManager #Lets reference our custom user model other than django's built-in authentication
+from django.conf import settings
 from django.db import models
+from django.db.models import F
 from django.utils.translation import gettext as _
 from django.utils import timezone
 
+class BookQuerySet(models.QuerySet):
+    def update_with_version(self, **changes): #Use this instead of update() so the rows also get a new version and updated_at (their ETag and Last-Modified, see versioning.py)
+        return self.update(version=F('version') + 1, updated_at=timezone.now(), **changes)
+
+
 class Book(models.Model): #When adding a book in admin site, these are the four fields you will have to fill, namely isbn, title, author, available copies (a drop down). User (the user id automatically fills)
     isbn = models.CharField(max_length=13, unique=True, blank=True)
     title = models.CharField(max_length=100, null=True, blank=True)
     author = models.CharField(max_length=100, null=True, blank=True)
     available_copies = models.PositiveIntegerField()
     user = models.ForeignKey('User', on_delete=models.CASCADE)
+    version = models.PositiveIntegerField(default=1, editable=False) #Goes up by one on every change to the book
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = BookQuerySet.as_manager()
     
     def __str__(self):
         return self.title #When you submit the book and hit enter, the title of the book will be returned
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        self.version = F('version') + 1 #Done by the database, so two saves at the same time still give two new versions
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def from_db(cls, db, field_names, values): #Remember the author and copies a book was loaded with, so the inventory counters can apply just the difference when it is saved (see inventory.py)
+        instance = super().from_db(db, field_names, values)
+        instance._inventory_snapshot = (instance.__dict__.get('author'), instance.__dict__.get('available_copies'))
+        return instance
         
         
+    class Meta:
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_idx'), #Title ordered listing and keyset pages (?ordering=title)
+            models.Index(fields=['author', 'title'], name='book_author_title_idx'), #Books by an author, in title order
+        ]
+
     def update_available_copies(self, increment=1): # Increment is a positive or negative value to increase or decrease available copies. This means you will have a dropdown menu with numbers from -infinity to positive infinity and the difference between each number is 1 (gaps of 1)     
-        self.available_copies += increment #This will add the new increment value to the available_copies field of that respective book id 
-        self.save() #There will be a save button available 
+        from .inventory import record_copies_changed, snapshot
+        from .versioning import bump_catalogue
+        Book.objects.filter(pk=self.pk).update_with_version(available_copies=F('available_copies') + increment) #The addition is done by the database (UPDATE ... SET available_copies = available_copies + increment) so concurrent updates are not lost
+        record_copies_changed(self.author, increment)
+        bump_catalogue()
+        self.refresh_from_db(fields=['available_copies', 'version', 'updated_at']) #Reload the new values onto this instance
+        snapshot(self)
+
+
+class BookCheckoutQuerySet(models.QuerySet): #The loan lookups below all filter on returned_at IS NULL, which is exactly the condition of the partial indexes in BookCheckout.Meta, so they read only open loans instead of the whole checkout history
+    def open(self):
+        return self.filter(returned_at__isnull=True)
+
+    def held_by(self, user):
+        return self.open().filter(user=user)
+
+    def overdue(self, now=None, loan_days=None):
+        now = now or timezone.now()
+        loan_days = settings.LOAN_PERIOD_DAYS if loan_days is None else loan_days
+        return self.open().filter(checkout_date_time__lt=now - timedelta(days=loan_days))
 
 
 class BookCheckout(models.Model):
     checkout_date_time = models.DateTimeField(auto_now_add=True)
     book = models.ForeignKey('Book', on_delete=models.CASCADE)
     user = models.ForeignKey('User', on_delete=models.CASCADE)
+    returned_at = models.DateTimeField(blank=True, null=True) #Empty while the book is still out. Set by services.return_book
+
+    objects = BookCheckoutQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.name} checked out {self.book.title} on {self.checkout_date_time}"
 
     class Meta:
         ordering = ['-checkout_date_time']
+        indexes = [
+            models.Index(fields=['book', '-checkout_date_time'], name='checkout_book_date_idx'), #Checkout history of a book, newest first
+            models.Index(fields=['user', '-checkout_date_time'], name='checkout_user_date_idx'), #Checkout history of a user, newest first
+            #Partial indexes: they only hold the (few) open loans, not the whole history
+            models.Index(fields=['user', 'book', 'checkout_date_time'], condition=models.Q(returned_at__isnull=True), name='open_checkout_user_book_idx'), #Current loans of a user, and the oldest loan to close on return (already in date order, so the planner prefers it to checkout_user_date_idx)
+            models.Index(fields=['book'], condition=models.Q(returned_at__isnull=True), name='open_checkout_book_idx'), #Who currently holds a book
+            models.Index(fields=['checkout_date_time'], condition=models.Q(returned_at__isnull=True), name='open_checkout_date_idx'), #Overdue loans
+        ]
+
+
+class InventorySummary(models.Model): #A single row holding catalogue wide totals. Kept up to date by every add/update/delete/checkout (see inventory.py) so the inventory endpoint never has to add up the whole Book table
+    total_titles = models.IntegerField(default=0)
+    total_available_copies = models.IntegerField(default=0)
+    copies_checked_out = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.total_titles} titles, {self.total_available_copies} copies available, {self.copies_checked_out} checked out"
+
+
+class AuthorInventory(models.Model): #The same totals per author (books without an author are counted under '')
+    author = models.CharField(max_length=100, unique=True)
+    titles = models.IntegerField(default=0)
+    available_copies = models.IntegerField(default=0)
+    checked_out = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.author
+
+    class Meta:
+        ordering = ['author']
+
+
+class CatalogueVersion(models.Model): #A counter that goes up on every write to any book. read/api/ pages use it as their ETag (see versioning.py)
+    name = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=1)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
 
 
 class CustomUserManager(UserManager): #For our command line user creation. This is not a typical django model. This a customised user manager class defined. #This class extends the UserManager class and customizes the behavior of user creation, specifically for creating regular users and superusers (admin users).This class, named CustomUserManager, is intended to customize the creation of user objects. It is a subclass of Django's built-in UserManager class, which provides default methods for creating and managing user accounts
@@ -84,10 +179,34 @@ class User(AbstractBaseUser, PermissionsMixin): #For our Admin interface user cr
     class Meta: #The Meta class is used in Django models to provide additional information about the model class, such as its human-readable name and plural form. This metadata is used by Django for various purposes, including generating user-friendly display names in the admin interface
         verbose_name = 'User' #verbose_name: This attribute is set to 'User', indicating the singular name or label for a single instance of this model. In this case, it specifies that a single instance of this model should be referred to as 'User
         verbose_name_plural = 'Users' #verbose_name_plural: This attribute is set to 'Users', indicating the plural name or label for multiple instances of this model. It specifies that when referring to multiple instances of this model, they should be called 'Users
+        indexes = [models.Index(fields=['account_type'], name='user_account_type_idx')] #Listing users by role (staff/admin lists in the admin site, provisioning)
 
     def get_full_name(self): #This method is defined within the User model and returns the user's full name. It retrieves the value of the name attribute of the user. This method is intended to provide a convenient way to get the user's full name
         return self.name
     
     def get_short_name(self): #This method is also defined within the model and returns a shorter name or identifier for the user. It first checks if the name attribute has a value. If it does, it returns the name. If name is empty, it takes the first part of the user's email address before the '@' symbol and returns that as the short name
         return self.name or self.email.split('@')[0]
- 
\ No newline at end of file
+ 
+
+class OutgoingEmail(models.Model): #The email outbox. Views queue messages here and return straight away, the `send_queued_emails` management command delivers them in the background (see mail.py)
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        SENT = 'sent'
+        FAILED = 'failed'
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField() #Cleared once the message is sent, password reset links must not stay readable in the database
+    from_email = models.CharField(max_length=254)
+    to = models.TextField() #Comma separated recipient addresses
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now) #Pending messages are picked up once this time has passed. It also works as a lease while a worker is sending
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.to} ({self.status})"
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])] #The worker's "what is due" query
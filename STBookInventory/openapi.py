@@ -0,0 +1,136 @@
+#Precomputed OpenAPI schema (api/schema/ and the Swagger UI at api/schema/docs/). drf-spectacular's SpectacularAPIView builds the
+#schema on every request: it imports and introspects every view and serializer (and prints its warnings about them) each time, and
+#the Swagger UI asks for the schema again on every page load. Here the schema is generated once, by `python manage.py
+#generate_openapi_schema` at build/deploy time, written to OPENAPI_SCHEMA_DIR as schema.yaml and schema.json, and served as a
+#plain file with an ETag and long cache headers.
+#schema.meta.json holds a fingerprint of everything the schema is built from (the URL patterns and the source of the project
+#modules, the drf-spectacular and DRF versions and settings). A worker compares it with the code it is running once, on the first
+#schema request: a missing or stale file (the URLconf or a serializer changed since the last build) is generated again then, so the
+#schema never describes old code.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import django
+import drf_spectacular
+import rest_framework
+from django.conf import settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+
+
+FORMATS = {'yaml': OpenApiYamlRenderer, 'json': OpenApiJsonRenderer} #The two formats SpectacularAPIView offered, YAML is its default
+SOURCE_PACKAGES = ('STLibrary', 'STBookInventory') #Their top level modules (not tests, migrations or management commands) are what the schema describes
+META_FILE = 'schema.meta.json'
+
+
+def _patterns(resolver, prefix=''):
+    #Yields 'route -> module.view' for every URL, in URLconf order
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from _patterns(pattern, prefix + str(pattern.pattern))
+        elif isinstance(pattern, URLPattern):
+            callback = getattr(pattern.callback, 'cls', pattern.callback) #DRF's @api_view and as_view() keep the class on .cls
+            yield f'{prefix}{pattern.pattern} -> {callback.__module__}.{callback.__qualname__}'
+
+
+def fingerprint():
+    digest = hashlib.sha256()
+    for part in (django.__version__, rest_framework.__version__, drf_spectacular.__version__, repr(settings.REST_FRAMEWORK), repr(settings.SPECTACULAR_SETTINGS)):
+        digest.update(part.encode() + b'\0')
+    for line in _patterns(get_resolver()):
+        digest.update(line.encode() + b'\0')
+    for package in SOURCE_PACKAGES:
+        folder = os.path.join(settings.BASE_DIR, package)
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.py') and name != 'tests.py':
+                with open(os.path.join(folder, name), 'rb') as handle:
+                    digest.update(name.encode() + b'\0' + handle.read())
+    return digest.hexdigest()
+
+
+class Schema: #The rendered schema of one build, what api/schema/ serves
+    def __init__(self, bodies, meta):
+        self.bodies = bodies #{'yaml': bytes, 'json': bytes}
+        self.meta = meta #fingerprint, version, generated_at, generation_seconds
+
+    @property
+    def version(self): #Changes whenever the schema content does. Used in the ETag and in the ?v= of the Swagger UI's schema URL
+        return self.meta['version']
+
+
+def generate():
+    started = time.perf_counter()
+    data = SchemaGenerator().get_schema(request=None, public=True) #What SpectacularAPIView does for an anonymous request (SERVE_PUBLIC is on)
+    bodies = {name: renderer().render(data, renderer_context={}) for name, renderer in FORMATS.items()}
+    meta = {
+        'fingerprint': fingerprint(),
+        'version': hashlib.sha256(bodies['yaml']).hexdigest()[:16],
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'generation_seconds': round(time.perf_counter() - started, 4),
+    }
+    return Schema(bodies, meta)
+
+
+def _write(path, content):
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as handle:
+        handle.write(content)
+    os.replace(temporary, path) #Atomic, a worker reading at the same time gets the old file or the new one
+
+
+def write(schema, directory=None):
+    directory = directory or settings.OPENAPI_SCHEMA_DIR
+    os.makedirs(directory, exist_ok=True)
+    for name, body in schema.bodies.items():
+        _write(os.path.join(directory, f'schema.{name}'), body)
+    _write(os.path.join(directory, META_FILE), json.dumps(schema.meta, indent=2).encode()) #Last, so a file with the new fingerprint always has the new bodies beside it
+
+
+def read(directory=None):
+    #The schema on disk, or None when there is none. Does not check whether it is stale
+    directory = directory or settings.OPENAPI_SCHEMA_DIR
+    try:
+        with open(os.path.join(directory, META_FILE)) as handle:
+            meta = json.load(handle)
+        bodies = {}
+        for name in FORMATS:
+            with open(os.path.join(directory, f'schema.{name}'), 'rb') as handle:
+                bodies[name] = handle.read()
+    except (OSError, ValueError):
+        return None
+    return Schema(bodies, meta)
+
+
+def is_current(schema):
+    return schema is not None and schema.meta.get('fingerprint') == fingerprint()
+
+
+_schema = None
+_lock = threading.Lock()
+
+
+def current():
+    #The schema this worker serves: read from disk once, generated (and written back) only when it is missing or stale
+    global _schema
+    if _schema is None:
+        with _lock:
+            if _schema is None:
+                schema = read()
+                if not is_current(schema):
+                    schema = generate()
+                    try:
+                        write(schema)
+                    except OSError: #A read-only deploy, serve it from memory. Running generate_openapi_schema at build time avoids this
+                        pass
+                _schema = schema
+    return _schema
+
+
+def reset(): #Forget the schema loaded by this worker (tests, and after generate_openapi_schema in the same process)
+    global _schema
+    _schema = None
@@ -0,0 +1,107 @@
+#Pagination classes for the REST API views
+
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class BookKeysetPagination(BasePagination): #Cursor (keyset) pagination for the book list. Instead of COUNT(*) + OFFSET, every page is "the next page_size books after the last one you saw" (WHERE id > last_id ORDER BY id LIMIT n), so page 1000 costs the same as page 1 and books added while crawling do not shift rows between pages
+    page_size = 10
+    page_size_query_param = None #Set it (and max_page_size) to let clients pick the page size, like PageNumberPagination
+    max_page_size = None
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    orderings = ('id', 'title') #'title' orders by title and breaks ties on id
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = request.query_params.get(self.ordering_query_param, 'id')
+        if self.ordering not in self.orderings:
+            raise NotFound(f"Unknown ordering, use one of: {', '.join(self.orderings)}")
+
+        page_size = self.get_page_size(request)
+        rows = list(self.page_queryset(queryset, self.decode_cursor(request), page_size))
+        self.has_next = len(rows) > page_size
+        self.page = rows[:page_size]
+        return self.page
+
+    def page_queryset(self, queryset, position, page_size): #The query of one page (also EXPLAINed by query_audit.py). One extra row tells us whether there is a next page, without a COUNT query
+        queryset = self.order(queryset)
+        if position is not None:
+            queryset = queryset.filter(self.after(position))
+        return queryset[:page_size + 1]
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                requested = int(request.query_params[self.page_size_query_param])
+                if requested > 0:
+                    return min(requested, self.max_page_size) if self.max_page_size else requested
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def order(self, queryset):
+        if self.ordering == 'title':
+            return queryset.order_by(F('title').asc(nulls_first=True), 'id') #Books without a title come first so the cursor condition below stays simple
+        return queryset.order_by('id')
+
+    def after(self, position): #The WHERE clause selecting every row that sorts after the cursor position
+        if self.ordering == 'title':
+            title, last_id = position['title'], position['id']
+            if title is None:
+                return Q(title__isnull=True, id__gt=last_id) | Q(title__isnull=False)
+            return Q(title__gt=title) | Q(title=title, id__gt=last_id)
+        return Q(id__gt=position['id'])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        if not isinstance(last, dict): #Pages of model instances or of .values() rows
+            last = {'id': last.id, 'title': last.title}
+        position = {'o': self.ordering, 'id': last['id']}
+        if self.ordering == 'title':
+            position['title'] = last['title']
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position))
+
+    def encode_cursor(self, position): #Cursors are opaque to clients: base64 of a small JSON document
+        return base64.urlsafe_b64encode(json.dumps(position, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            position['id'] = int(position['id'])
+        except (TypeError, ValueError, KeyError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if position.get('o') != self.ordering: #A cursor only makes sense for the ordering it was issued for
+            raise NotFound(self.invalid_cursor_message)
+        if self.ordering == 'title' and not ('title' in position and isinstance(position['title'], (str, type(None)))): #Title cursors carry the last title (None for a book without one). A forged or cut down cursor is a 404, not a 500 in after()
+            raise NotFound(self.invalid_cursor_message)
+        return position
@@ -0,0 +1,25 @@
+#Extra request parsers for the REST API views
+
+import json
+
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser): #Newline delimited JSON (one book object per line). Used by add_book_view so very large catalogue uploads are read line by line instead of being parsed into one big list in memory
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return self._iter_items(stream, encoding) #request.data becomes a lazy iterator of parsed lines
+
+    def _iter_items(self, stream, encoding):
+        if stream is None: #Empty request body
+            return
+        for line in stream:
+            line = line.decode(encoding).strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield line #Handed on as-is, the serializer then reports it as invalid data for that item only
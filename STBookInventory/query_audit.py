@@ -0,0 +1,53 @@
+#The main queryset of each endpoint, for `python manage.py audit_query_plans`. The command runs EXPLAIN on each one and flags
+#full table scans, so a change to a view's query (or a dropped index) shows up before it reaches a big database.
+#The querysets come from the same functions the views and services call, with sample values standing in for the request
+#parameters, so the audit always checks the queries the code really runs.
+
+import re
+
+from django.db import connection
+from rest_framework.authtoken.models import Token
+
+from . import api_views, authentication, export, inventory, search, services, views
+from .pagination import BookKeysetPagination
+from .serializers import book_rows
+
+
+def _keyset_page(ordering, position):
+    paginator = BookKeysetPagination()
+    paginator.ordering = ordering
+    return paginator.page_queryset(book_rows(api_views.book_list_queryset()), position, paginator.page_size)
+
+
+def _queries():
+    #(endpoint, queryset, reason a full scan is acceptable or None)
+    return [
+        ('read/api/ (page)', book_rows(api_views.book_list_queryset())[:10], 'rowid order stopped by LIMIT'),
+        ('read/api/?pagination=cursor', _keyset_page('id', {'id': 100}), None),
+        ('read/api/?pagination=cursor&ordering=title', _keyset_page('title', {'id': 100, 'title': 'M'}), None),
+        ('read/api/<id>/', api_views.book_queryset(1), None),
+        ('search/ (isbn)', search.isbn_prefix_ids('978', search.DEFAULT_LIMIT), None),
+        ('list/ (all books)', views.list_page_books(), 'the page lists every book'),
+        ('export/api/?author=', export.rows_queryset('books', author='Tolkien'), None),
+        ('export/api/?dataset=checkouts&user=', export.rows_queryset('checkouts', user=1), None),
+        ('loans/api/', api_views.loans_queryset(1), None),
+        ('loans/api/?overdue=true', api_views.loans_queryset(None, overdue=True), None),
+        ('return/api/<id>/', services.open_checkouts(1, 1), None),
+        ('inventory/api/ (authors)', inventory.author_rows(), 'one small row per author'),
+        ('token authentication (cache miss)', Token.objects.select_related('user').filter(key='0' * 40), None), #What DRF's TokenAuthentication.authenticate_credentials runs
+        ('token authentication (cached token)', authentication.user_queryset(1), None),
+    ]
+
+
+def full_scans(plan):
+    #Returns the plan lines that read a whole table. SQLite says "SCAN <table>" (without an index), Postgres says "Seq Scan on <table>"
+    if connection.vendor == 'postgresql':
+        return [line.strip() for line in plan.splitlines() if 'Seq Scan' in line]
+    return [line.strip() for line in plan.splitlines() if re.search(r'\bSCAN\b', line) and 'INDEX' not in line and 'SUBQUERY' not in line]
+
+
+def audit():
+    #Yields (endpoint, plan, scan lines, reason a scan is acceptable or None)
+    for endpoint, queryset, allowed in _queries():
+        plan = queryset.explain()
+        yield endpoint, plan, full_scans(plan), allowed
@@ -0,0 +1,38 @@
+#Response cache for the catalogue reads: read/api/, read/api/<id>/ and the book list and book pages. An entry's key holds the
+#endpoint, the query string, the media type the response is rendered as and the version of what it shows. read/api/ pages and the list page use the catalogue version,
+#a single book uses its own version (see versioning.py). Every write bumps those versions, which works as a generation counter:
+#old entries are never looked up again and just expire, so invalidation is a single UPDATE however many pages are cached.
+#A hit costs one small version query (the same one the ETag needs) instead of loading, serializing and rendering books.
+#Hits and misses per endpoint are counted in the /stbookinventory/metrics/ output (stlibrary_response_cache_requests_total).
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import urlencode
+
+from .instrumentation import metrics
+
+
+def _key(endpoint, generation, request, parts):
+    version, updated_at = generation #updated_at too, so a version number reused after a database restore never finds an old entry
+    query = urlencode(sorted(request.GET.lists()), doseq=True) #?page=2&pagination=cursor and ?pagination=cursor&page=2 share an entry
+    media_type = getattr(request, 'accepted_media_type', 'text/html') #As negotiated by DRF, parameters included (application/json; indent=4). The template views only render HTML
+    digest = hashlib.md5(f'{media_type} {request.scheme}://{request.get_host()}?{query}'.encode('utf-8')).hexdigest() #The scheme and host too: pagination links are absolute URLs
+    return f'response:{endpoint}:{":".join(str(part) for part in parts)}:{version}.{updated_at.timestamp()}:{digest}'
+
+
+def get(endpoint, generation, request, *parts):
+    #Returns (key, cached value or None). parts (e.g. the book id) are added to the key, endpoint is also the label of the
+    #hit/miss counters. Pass the key to set() after building the value on a miss
+    if not settings.RESPONSE_CACHE_TIMEOUT:
+        return None, None
+    key = _key(endpoint, generation, request, parts)
+    value = cache.get(key)
+    metrics.count_cache(endpoint, 'miss' if value is None else 'hit')
+    return key, value
+
+
+def set(key, value):
+    if key is not None:
+        cache.set(key, value, timeout=settings.RESPONSE_CACHE_TIMEOUT)
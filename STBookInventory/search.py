@@ -0,0 +1,142 @@
+#Catalogue search. Books are matched on title, author (full text, word prefixes) and ISBN (exact or prefix), best matches first.
+#The text part runs on an index instead of scanning the table with LIKE '%query%':
+#   SQLite   -> an FTS5 virtual table (BOOK_FTS_TABLE) that holds a copy of each book's title/author/isbn, kept in sync from the Book save/delete signals (see signals.py)
+#   Postgres -> a GIN index on a tsvector expression of title/author (BOOK_SEARCH_INDEX), which Postgres keeps in sync by itself
+#Any other database (or a SQLite build without FTS5) falls back to plain icontains filters.
+#Both are created by migration 0003 and can be rebuilt with `python manage.py rebuild_search_index`.
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+
+BOOK_FTS_TABLE = 'STBookInventory_book_fts'
+BOOK_SEARCH_INDEX = 'stbookinventory_book_search_gin'
+
+#The Postgres WHERE clause must use exactly the indexed expression, otherwise the GIN index is not used. Migration 0003 has its own copy of
+#these names and of the expression: changing one here needs a new migration that rebuilds the index
+POSTGRES_SEARCH_VECTOR = (
+    "(setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(author, '')), 'B'))"
+)
+
+DEFAULT_LIMIT = 50
+MAX_ISBN_LENGTH = Book._meta.get_field('isbn').max_length
+_fts_available = {} #connection alias -> whether the FTS5 table exists, looked up once per process
+
+
+def search_books(query, limit=DEFAULT_LIMIT, columns=None):
+    #Returns a list of at most `limit` books (with their user loaded) for the query, best matches first:
+    #exact ISBN match, then ISBN prefix matches, then title/author matches ranked by relevance.
+    #columns (e.g. ['id', 'title'] for ?fields=) loads only those columns of the books, and not their user
+    query = (query or '').strip()
+    if not query:
+        return []
+
+    ranked_ids = []
+    isbn = _as_isbn(query)
+    if isbn:
+        exact = list(Book.objects.filter(isbn=isbn).values_list('id', flat=True))
+        ranked_ids.extend(exact + list(isbn_prefix_ids(isbn, limit)))
+
+    terms = re.findall(r'\w+', query)
+    if terms and len(ranked_ids) < limit:
+        for book_id in _text_search_ids(terms, limit):
+            if book_id not in ranked_ids:
+                ranked_ids.append(book_id)
+
+    ranked_ids = ranked_ids[:limit]
+    books = (Book.objects.select_related('user') if columns is None else Book.objects.only(*columns)).in_bulk(ranked_ids)
+    return [books[book_id] for book_id in ranked_ids if book_id in books]
+
+
+def isbn_prefix_ids(isbn, limit): #Also EXPLAINed by query_audit.py
+    return Book.objects.filter(isbn__gt=isbn, isbn__lt=isbn + '\U0010ffff').order_by('isbn').values_list('id', flat=True)[:limit] #A range on the unique isbn index, unlike LIKE 'q%' on SQLite
+
+
+def _as_isbn(query): #ISBNs are often typed with hyphens or spaces
+    isbn = re.sub(r'[\s-]', '', query)
+    if re.fullmatch(r'\d{1,12}[\dXx]?', isbn) and len(isbn) <= MAX_ISBN_LENGTH:
+        return isbn.upper()
+    return None
+
+
+def _text_search_ids(terms, limit):
+    if connection.vendor == 'sqlite' and fts_available():
+        match = ' '.join('"%s"*' % term for term in terms) #Every word must match, as a word prefix ("harr pott" finds Harry Potter)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM "{BOOK_FTS_TABLE}" WHERE "{BOOK_FTS_TABLE}" MATCH %s '
+                f'ORDER BY bm25("{BOOK_FTS_TABLE}", 10.0, 5.0, 1.0) LIMIT %s', #Title hits weigh more than author hits, which weigh more than isbn hits
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join('%s:*' % term for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT id FROM "{Book._meta.db_table}" '
+                f"WHERE {POSTGRES_SEARCH_VECTOR} @@ to_tsquery('simple', %s) "
+                f"ORDER BY ts_rank({POSTGRES_SEARCH_VECTOR}, to_tsquery('simple', %s)) DESC, id LIMIT %s",
+                [tsquery, tsquery, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    condition = Q()
+    for term in terms:
+        condition &= Q(title__icontains=term) | Q(author__icontains=term)
+    return list(Book.objects.filter(condition).order_by('title', 'id').values_list('id', flat=True)[:limit])
+
+
+def fts_available(): #True when this SQLite database has the FTS5 table (migration 0003 skips it if SQLite was built without FTS5)
+    if connection.vendor != 'sqlite':
+        return False
+    alias = connection.alias
+    if alias not in _fts_available:
+        _fts_available[alias] = BOOK_FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[alias]
+
+
+def index_books(books, replace=True): #Adds or refreshes these books in the FTS5 table. replace=False skips removing old entries (brand new books). Nothing to do on Postgres, its expression index follows the table
+    if not fts_available():
+        return
+    rows = [(book.pk, book.title, book.author, book.isbn) for book in books]
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        if replace:
+            cursor.executemany(f'DELETE FROM "{BOOK_FTS_TABLE}" WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(f'INSERT INTO "{BOOK_FTS_TABLE}" (rowid, title, author, isbn) VALUES (%s, %s, %s, %s)', rows)
+
+
+def unindex_book(book_id):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{BOOK_FTS_TABLE}" WHERE rowid = %s', [book_id])
+
+
+def rebuild_index(batch_size=2000): #Refills the FTS5 table from the Book table (Postgres only needs a REINDEX). Returns the number of books indexed
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'REINDEX INDEX "{BOOK_SEARCH_INDEX}"')
+        return Book.objects.count()
+    if not fts_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{BOOK_FTS_TABLE}"')
+    count = 0
+    batch = []
+    for book in Book.objects.only('id', 'title', 'author', 'isbn').iterator(chunk_size=batch_size):
+        batch.append(book)
+        if len(batch) >= batch_size:
+            index_books(batch, replace=False)
+            count += len(batch)
+            batch = []
+    index_books(batch, replace=False)
+    return count + len(batch)
+
@@ -1,27 +1,63 @@
 #We are going to define a Django REST framework (DRF) serializer classes. Serialization: The serializer takes data and converts it into a format that can be easily rendered into JSONDeserialization: When you receive data, for example, in a POST request, the serializer helps convert that data back into a format that can be used to update or create instances in your Django models.
 
 from rest_framework import serializers #Importing rest_framework from serializers imports the serializers module from the Django REST framework (DRF).The serializers module provides a set of classes and functions that help you serialize and deserialize data in various formats, such as JSON, XML, or other content types, to work with Django models and querysets.
-from .models import Book #This line imports the Book model from the current package (or directory) where the serializers.py file is located. The dot (.) signifies the current directory. The Book model is likely defined in a models.py file in the same app.
+from .instrumentation import TimedSerializerMixin #Every serializer below lists it first, so sampled requests report serializer time on its own (see instrumentation.py)
+from .models import Book, BookCheckout #This line imports the Book model from the current package (or directory) where the serializers.py file is located. The dot (.) signifies the current directory. The Book model is likely defined in a models.py file in the same app.
 
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
-class BookSerializer(serializers.ModelSerializer): #Here, a new Python class BookSerializer is defined by us, which inherits from serializers.ModelSerializer.This class is used to create a serializer for the Book model. Serializers in DRF are responsible for converting complex data types, such as Django model instances, into native Python data types that can be rendered into JSON, XML, or other content types. In this case, BookSerializer is tailored for serializing Book model instances.
+class BookSerializer(TimedSerializerMixin, serializers.ModelSerializer): #Here, a new Python class BookSerializer is defined by us, which inherits from serializers.ModelSerializer.This class is used to create a serializer for the Book model. Serializers in DRF are responsible for converting complex data types, such as Django model instances, into native Python data types that can be rendered into JSON, XML, or other content types. In this case, BookSerializer is tailored for serializing Book model instances.
     class Meta: #Inside the BookSerializer class, a nested Meta class is defined. This inner class is used to provide metadata about the serializer.
         model = Book #In the Meta class, the model attribute is set to Book. This specifies which Django model the serializer is associated with. In this case, it's associated with the Book model, meaning the serializer will be used to serialize and deserialize Book instances.
         fields = ['id','isbn','title','author', 'available_copies','user'] #The fields attribute is a list that specifies which fields from the Book model should be included when serializing an instance of the model. This list is used to determine which attributes of the Book model should be included in the serialized representation. In this example, it includes the id, isbn, title, author, and available_copies fields.
 
+    def __init__(self, *args, fields=None, **kwargs): #fields (from book_fields) keeps only those fields in the output, for ?fields= on the read endpoints
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
-class UserSerializer(serializers.ModelSerializer):
+
+def book_fields(request):
+    #The fields asked for with ?fields=id,title, in BookSerializer's order, or None for all of them. Unknown names are a 400
+    requested = request.query_params.get('fields')
+    if requested is None:
+        return None
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    unknown = sorted(names - set(BookSerializer.Meta.fields))
+    if unknown or not names:
+        raise serializers.ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown) or '(none given)'}. Use some of: {', '.join(BookSerializer.Meta.fields)}"]})
+    return [name for name in BookSerializer.Meta.fields if name in names]
+
+
+def book_rows(queryset, fields=None): #Read-only fast path for book listings. Plain dicts straight from the database (SELECT of just these columns, no model instances, no per-field to_representation calls) with exactly the keys, order and values BookSerializer gives, so the JSON is byte for byte the same. 'user' is the user's id, like the serializer's PrimaryKeyRelatedField
+    return queryset.values(*(fields or BookSerializer.Meta.fields)) #fields: only these columns are selected, like BookSerializer(fields=...) outputs
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta(object):
         model = User
         fields = ['email','password', 'account_type']
 
 
-class ChangePasswordSerializer(serializers.Serializer): #This line creates a new serializer class named ChangePasswordSerializer. This class will be used to handle the serialization and validation of data related to changing a user's password.
+class ChangePasswordSerializer(TimedSerializerMixin, serializers.Serializer): #This line creates a new serializer class named ChangePasswordSerializer. This class will be used to handle the serialization and validation of data related to changing a user's password.
     old_password = serializers.CharField(required=True) #In the body of the ChangePasswordSerializer class, two fields are defined: old_password and new_password. These fields are of type serializers.CharField, which means they are expecting string data. The required=True argument indicates that these fields are mandatory, and the serializer will expect them to be present when validating input data.
     new_password = serializers.CharField(required=True)
 
 
-class ForgotPasswordSerializer(serializers.Serializer):
-    email = serializers.EmailField()
\ No newline at end of file
+class ForgotPasswordSerializer(TimedSerializerMixin, serializers.Serializer):
+    email = serializers.EmailField()
+
+class BookBulkSerializer(TimedSerializerMixin, serializers.ModelSerializer): #Used by the batched ingestion path (services.bulk_add_books). It has the same field rules as BookSerializer except that the two checks which cost a query per book are left out: the isbn uniqueness check is done once for the whole batch with a single isbn__in query, and the user is always the logged in user so it does not need to be looked up.
+    class Meta:
+        model = Book
+        fields = ['id','isbn','title','author', 'available_copies','user']
+        read_only_fields = ['user']
+        extra_kwargs = {'isbn': {'validators': []}}
+
+
+class BookCheckoutSerializer(TimedSerializerMixin, serializers.ModelSerializer): #A loan: who checked out which book, when, and when it came back (returned_at stays empty while the book is still out)
+    class Meta:
+        model = BookCheckout
+        fields = ['id', 'book', 'user', 'checkout_date_time', 'returned_at']
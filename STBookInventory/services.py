@@ -0,0 +1,298 @@
+#Service functions shared by the template views (views.py) and the REST API views (api_views.py).
+#Anything that changes the book inventory lives here so both front-ends go through the same database logic.
+
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Book
+from .models import BookCheckout
+from .serializers import BookBulkSerializer, BookSerializer
+from . import inventory, search, versioning
+
+
+#Possible outcomes of a checkout. The views map these onto their own responses (JSON or HTML page)
+CHECKOUT_OK = 'ok'
+CHECKOUT_NO_COPIES = 'no_copies'
+CHECKOUT_NOT_FOUND = 'not_found'
+
+#Possible outcomes of a return
+RETURN_OK = 'ok'
+RETURN_NOT_CHECKED_OUT = 'not_checked_out'
+RETURN_NOT_FOUND = 'not_found'
+
+#Possible outcomes of one update of a bulk update
+UPDATE_OK = 'ok'
+UPDATE_INVALID = 'invalid'
+UPDATE_NOT_FOUND = 'not_found'
+
+
+def checkout_book(book_id, user):
+    #Returns a (result, checkout) tuple. checkout is the new BookCheckout row when result is CHECKOUT_OK, otherwise None.
+    #The decrement is done by the database itself (UPDATE ... SET available_copies = available_copies - 1 WHERE available_copies > 0)
+    #so two requests checking out the last copy at the same time can never both succeed, and we never read-modify-write in python.
+    with transaction.atomic(): #The stock decrement and the BookCheckout insert either both happen or neither happens
+        updated = (
+            Book.objects
+            .filter(pk=book_id, available_copies__gt=0)
+            .update_with_version(available_copies=F('available_copies') - 1)
+        )
+        if updated:
+            checkout = BookCheckout.objects.create(book_id=book_id, user=user)
+            inventory.record_checkout(book_id)
+    if updated:
+        versioning.bump_catalogue() #After the commit, once the book row is unlocked (see versioning.py)
+        return CHECKOUT_OK, checkout
+
+    #Nothing was updated, so either the book is out of stock or it does not exist. No row lock is needed to tell them apart
+    if Book.objects.filter(pk=book_id).exists():
+        return CHECKOUT_NO_COPIES, None
+    return CHECKOUT_NOT_FOUND, None
+
+
+def open_checkouts(user, book_id): #The user's open loans of the book, oldest first (also EXPLAINed by query_audit.py). A few candidates in case a concurrent return closes the first one
+    return BookCheckout.objects.held_by(user).filter(book_id=book_id).order_by('checkout_date_time')[:5]
+
+
+def return_book(book_id, user):
+    #Closes the user's oldest open checkout of the book and puts the copy back in stock. Returns a (result, checkout) tuple like checkout_book.
+    #The open loan is found through the open_checkout_user_book_idx partial index, and the conditional UPDATE (returned_at IS NULL)
+    #makes sure two simultaneous returns of the same loan only add one copy back.
+    returned = None
+    with transaction.atomic():
+        _lock_books([book_id]) #The book before the loan, like every other write (see _lock_books)
+        for checkout in open_checkouts(user, book_id):
+            closed = BookCheckout.objects.filter(pk=checkout.pk, returned_at__isnull=True).update(returned_at=timezone.now())
+            if closed:
+                Book.objects.filter(pk=book_id).update_with_version(available_copies=F('available_copies') + 1)
+                inventory.record_return(book_id)
+                checkout.refresh_from_db(fields=['returned_at'])
+                returned = checkout
+                break
+    if returned is not None:
+        versioning.bump_catalogue() #After the commit, once the book row is unlocked (see versioning.py)
+        return RETURN_OK, returned
+
+    if Book.objects.filter(pk=book_id).exists():
+        return RETURN_NOT_CHECKED_OUT, None
+    return RETURN_NOT_FOUND, None
+
+
+def _isbn_unique_message():
+    #Same wording the BookSerializer isbn UniqueValidator uses, so clients see identical errors on both paths
+    field = Book._meta.get_field('isbn')
+    return str(field.error_messages['unique'] % {'model_name': Book._meta.verbose_name, 'field_label': field.verbose_name})
+
+
+def _chunks(items, size):
+    #Yields lists of at most `size` items from any iterable (a list or a lazily parsed upload) without materialising the whole thing
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_add_books(items, user, batch_size=None):
+    #Validates and inserts many books at once. Returns one entry per input item, in input order: the serialized book when
+    #it was created, or the validation errors for that item (the same per-item shape add_book_view has always returned).
+    #Each chunk costs one isbn__in query for duplicates and one bulk INSERT, instead of a SELECT and an INSERT per book.
+    batch_size = batch_size or settings.BOOK_BULK_CREATE_BATCH_SIZE
+    duplicate_message = _isbn_unique_message()
+    seen_isbns = set() #ISBNs already accepted earlier in this upload. The first occurrence wins, like it did when books were saved one by one
+    responses = []
+
+    for chunk in _chunks(items, batch_size):
+        results = [None] * len(chunk)
+        valid = [] #(position in chunk, validated data)
+
+        for index, book_data in enumerate(chunk):
+            serializer = BookBulkSerializer(data=book_data)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = serializer.errors
+
+        #One query tells us which of this chunk's ISBNs are already in the database
+        chunk_isbns = {data.get('isbn', '') for _, data in valid}
+        existing = set(Book.objects.filter(isbn__in=chunk_isbns).values_list('isbn', flat=True))
+
+        to_create = []
+        for index, data in valid:
+            isbn = data.get('isbn', '')
+            if isbn in existing or isbn in seen_isbns:
+                results[index] = {'isbn': [duplicate_message]}
+                continue
+            seen_isbns.add(isbn)
+            to_create.append((index, Book(user=user, **data)))
+
+        for index, book in _insert_books(to_create, duplicate_message):
+            results[index] = BookSerializer(book).data if isinstance(book, Book) else book
+
+        responses.extend(results)
+
+    return responses
+
+
+def _insert_books(indexed_books, duplicate_message):
+    #Inserts the books with one bulk_create and returns the (index, book) pairs with primary keys filled in.
+    #If another request inserted one of these ISBNs after our duplicate check (or a row breaks another database constraint),
+    #the bulk insert fails as a whole and we fall back to saving this chunk row by row so only the offending book is reported.
+    if not indexed_books:
+        return []
+    books = [book for _, book in indexed_books]
+    try:
+        with transaction.atomic():
+            Book.objects.bulk_create(books)
+    except IntegrityError:
+        return _insert_books_one_by_one(indexed_books, duplicate_message)
+
+    if not connection.features.can_return_rows_from_bulk_insert: #Postgres hands the new ids back from bulk_create. SQLite does not, so look them up by their unique isbn
+        ids = dict(Book.objects.filter(isbn__in=[book.isbn for book in books]).values_list('isbn', 'id'))
+        for book in books:
+            book.pk = ids[book.isbn]
+    search.index_books(books, replace=False) #bulk_create sends no post_save signals, so add the new books to the search index and the inventory counters here
+    inventory.record_books_added(books)
+    versioning.bump_catalogue()
+    return indexed_books
+
+
+def _insert_books_one_by_one(indexed_books, duplicate_message):
+    results = []
+    for index, book in indexed_books:
+        try:
+            with transaction.atomic():
+                book.save()
+            results.append((index, book))
+        except IntegrityError as error:
+            if Book.objects.filter(isbn=book.isbn).exists():
+                results.append((index, {'isbn': [duplicate_message]}))
+            else: #Some other database constraint (e.g. negative available_copies) rejected the row
+                results.append((index, {'non_field_errors': [str(error)]}))
+    return results
+
+
+def update_book_columns(changes, now=None):
+    #changes is a list of (book, field names). Writes the books' current values of those fields with one executemany per set of
+    #fields, and moves their version on like Book.save does (their ETag changes). Much faster than a save() or a bulk_update
+    #(which builds a CASE WHEN per field and row) per book. No signals are sent: the callers update the search index, the
+    #inventory counters and the catalogue version themselves, once for all the books
+    updated_at = Book._meta.get_field('updated_at').get_db_prep_value(now or timezone.now(), connection)
+    statements = defaultdict(list)
+    for book, fields in changes:
+        fields = tuple(field for field in fields if field != 'id')
+        statements[fields].append([getattr(book, field) for field in fields] + [updated_at, book.pk])
+    with connection.cursor() as cursor:
+        for fields, rows in statements.items():
+            assignments = ''.join(f'"{Book._meta.get_field(field).column}" = %s, ' for field in fields)
+            cursor.executemany(f'UPDATE "{Book._meta.db_table}" SET {assignments}version = version + 1, updated_at = %s WHERE id = %s', rows)
+
+
+def _lock_books(book_ids):
+    #First statement of return_book and the bulk operations. Every write takes its locks in the same order, so two of them can never
+    #wait for each other (a deadlock on PostgreSQL): the Book rows first, in id order, then the BookCheckout rows. The inventory
+    #counters and the catalogue version are only written after the commit, when no lock is held any more (see inventory.py and versioning.py).
+    #checkout_book already starts with its UPDATE of the one book. On PostgreSQL this is a SELECT ... FOR UPDATE. SQLite ignores
+    #FOR UPDATE, but any write takes its database write lock, so there an UPDATE of these books that changes nothing makes sure the
+    #rows read next can not be changed by another connection before this transaction writes them
+    if connection.features.has_select_for_update:
+        list(Book.objects.select_for_update().filter(pk__in=book_ids).order_by('pk').values_list('pk', flat=True))
+    else:
+        Book.objects.filter(pk__in=book_ids).update(version=F('version'))
+
+
+def bulk_checkout(book_ids, user, all_or_nothing=True):
+    #Checks out one copy per entry of book_ids (the same id twice takes two copies) for user. Returns (results, applied): a CHECKOUT_*
+    #result per entry, and whether the CHECKOUT_OK ones were written. With all_or_nothing nothing is written unless every entry can be
+    #checked out. One locking read of the books, one executemany for the stock, one bulk INSERT of the BookCheckout rows
+    with transaction.atomic():
+        _lock_books(set(book_ids))
+        books = {pk: [author, copies] for pk, author, copies in Book.objects.filter(pk__in=set(book_ids)).values_list('id', 'author', 'available_copies')}
+        results = []
+        for book_id in book_ids:
+            if book_id not in books:
+                results.append(CHECKOUT_NOT_FOUND)
+            elif books[book_id][1] < 1:
+                results.append(CHECKOUT_NO_COPIES)
+            else:
+                books[book_id][1] -= 1
+                results.append(CHECKOUT_OK)
+
+        taken = Counter(book_id for book_id, result in zip(book_ids, results) if result == CHECKOUT_OK)
+        if not taken or (all_or_nothing and sum(taken.values()) < len(book_ids)):
+            transaction.set_rollback(True)
+            return results, False
+
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE "{Book._meta.db_table}" SET available_copies = available_copies - %s, version = version + 1, updated_at = %s WHERE id = %s',
+                [(count, Book._meta.get_field('updated_at').get_db_prep_value(now, connection), book_id) for book_id, count in taken.items()],
+            )
+        BookCheckout.objects.bulk_create([BookCheckout(book_id=book_id, user=user) for book_id, result in zip(book_ids, results) if result == CHECKOUT_OK])
+        authors = Counter()
+        for book_id, count in taken.items():
+            authors[books[book_id][0]] += count
+        inventory.record_checkouts(authors)
+    versioning.bump_catalogue()
+    return results, True
+
+
+def bulk_update_books(operations, all_or_nothing=True):
+    #operations is a list of (book_id, data) partial updates, applied in order (the same book twice gets both). Returns (results, applied):
+    #an (UPDATE_* result, serialized book or errors) pair per operation, and whether the UPDATE_OK ones were written. With all_or_nothing
+    #nothing is written unless every operation is valid. The fields are checked like update/api/ does, except that the user
+    #a book was added by can not be changed here. ISBN clashes are found with one isbn__in query for the whole request, an ISBN
+    #is free once an earlier operation moved its book to another one
+    duplicate_message = _isbn_unique_message()
+    with transaction.atomic():
+        _lock_books({book_id for book_id, _ in operations})
+        books = Book.objects.in_bulk({book_id for book_id, _ in operations})
+        requested = {data['isbn'] for _, data in operations if isinstance(data, dict) and isinstance(data.get('isbn'), str)}
+        holders = dict(Book.objects.filter(isbn__in=requested).values_list('isbn', 'id')) #Who has each of the requested ISBNs, kept up to date below
+        results, changed = [], {}
+        for book_id, data in operations:
+            book = books.get(book_id)
+            if book is None:
+                results.append((UPDATE_NOT_FOUND, None))
+                continue
+            serializer = BookBulkSerializer(book, data=data, partial=True)
+            if not serializer.is_valid():
+                results.append((UPDATE_INVALID, serializer.errors))
+                continue
+            values = serializer.validated_data
+            if values.get('available_copies', 0) < 0: #The database CHECK would refuse the whole request, not just this operation
+                results.append((UPDATE_INVALID, {'available_copies': ['Ensure this value is greater than or equal to 0.']}))
+                continue
+            if 'isbn' in values and values['isbn'] != book.isbn:
+                if holders.get(values['isbn'], book.pk) != book.pk:
+                    results.append((UPDATE_INVALID, {'isbn': [duplicate_message]}))
+                    continue
+                holders.pop(book.isbn, None)
+                holders[values['isbn']] = book.pk
+            for field, value in values.items():
+                setattr(book, field, value)
+            changed.setdefault(book.pk, set()).update(values)
+            results.append((UPDATE_OK, BookSerializer(book).data))
+
+        failed = any(result != UPDATE_OK for result, _ in results)
+        if not changed or (all_or_nothing and failed):
+            transaction.set_rollback(True)
+            return results, False
+
+        updated = [books[pk] for pk in changed]
+        moving = [book.pk for book in updated if 'isbn' in changed[book.pk]]
+        if len(moving) > 1: #Books of this request may hand ISBNs on to each other, and the UPDATEs go by book, not in the order of the operations. Parking the books on placeholders first means the unique index never sees one ISBN twice
+            with connection.cursor() as cursor:
+                cursor.executemany(f'UPDATE "{Book._meta.db_table}" SET isbn = %s WHERE id = %s', [(f'~{pk}', pk) for pk in moving])
+        update_book_columns([(book, changed[book.pk]) for book in updated])
+        search.index_books(updated)
+        inventory.record_books_updated(updated)
+    versioning.bump_catalogue()
+    return results, True
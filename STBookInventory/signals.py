@@ -0,0 +1,85 @@
+#Signal handlers, connected in apps.py (StbookinventoryConfig.ready)
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from .models import Book, BookCheckout, User
+from . import inventory, search, versioning
+from .authentication import invalidate_token, invalidate_user_tokens
+
+
+@receiver(post_save, sender=Book) #Every save of a book (forms, API, admin) refreshes its row in the search index
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw: #Skip while loading fixtures, rebuild_search_index covers that
+        search.index_books([instance])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.unindex_book(instance.pk)
+
+
+@receiver(post_save, sender=Book) #Keeps the inventory counters in step with books added or edited one at a time (forms, API, admin)
+def count_saved_book(sender, instance, created=False, raw=False, **kwargs):
+    if not raw: #Skip while loading fixtures, recompute_inventory covers that
+        inventory.record_book_saved(instance, created)
+
+
+@receiver(post_delete, sender=Book)
+def count_deleted_book(sender, instance, **kwargs):
+    inventory.record_book_deleted(instance)
+
+
+@receiver(post_save, sender=Book) #Any change to a book changes the read/api/ pages, so their ETag
+@receiver(post_delete, sender=Book)
+def bump_catalogue_version(sender, instance, raw=False, **kwargs):
+    versioning.bump_catalogue() #Also on raw (fixture) saves: loaded data changes the pages too
+
+
+@receiver(post_save, sender=User) #The book list page shows who added each book (their name, or the start of their email)
+def bump_catalogue_version_for_user(sender, instance, created=False, update_fields=None, **kwargs):
+    if created or (update_fields is not None and not {'name', 'email'} & set(update_fields)): #A new user has no books yet, and the last_login update of every login changes nothing on the page
+        return
+    if Book.objects.filter(user_id=instance.pk).exists(): #Most users only borrow books, saving them leaves the cached pages alone
+        versioning.bump_catalogue()
+
+
+@receiver(post_delete, sender=BookCheckout) #Also sent for the checkouts deleted together with their book
+def count_deleted_checkout(sender, instance, **kwargs):
+    inventory.record_checkout_deleted(instance)
+
+
+@receiver(post_save, sender=User) #Password change/reset, deactivation or a new account_type must not be hidden behind a cached token lookup
+def invalidate_saved_user_tokens(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        invalidate_user_tokens(instance)
+
+
+@receiver(post_delete, sender=Token) #Logout deletes the token
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(connection_created) #Sent once for every new database connection
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite' or not settings.SQLITE_JOURNAL_MODE:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}') #Stored in the database file, so this is a no-op after the first connection
+        if settings.SQLITE_JOURNAL_MODE.upper() == 'WAL':
+            cursor.execute('PRAGMA synchronous=NORMAL') #Safe with WAL (a crash can only lose the last commits, never corrupt the file) and saves an fsync per commit
+
+
+@receiver(request_started) #With CONN_MAX_AGE a connection can outlive a database restart or a pooler dropping it, drop a dead one before the view gets an error from it
+def check_persistent_connections(**kwargs):
+    if not settings.DATABASE_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is not None and connection.settings_dict['CONN_MAX_AGE'] and not connection.in_atomic_block and not connection.is_usable():
+            connection.close() #The next query opens a new connection
@@ -0,0 +1,31 @@
+#The test runner (settings.TEST_RUNNER). Django's own runner already swaps the email backend for an in-memory one while the tests
+#run. This one does the same for the cache: the configured default cache (a cache table, .django_cache, Redis or Memcached) holds the real auth
+#tokens, reset tokens and throttle buckets of a developer's server or a deployment, and the tests write to and clear their cache
+#all the time. They get a private local memory cache instead, with the response cache turned on like it is by default with
+#CACHE_BACKEND=locmem. A test that needs a cache shared between processes overrides CACHES itself with a throwaway directory
+#(see SharedCacheTests).
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'stlibrary-tests',
+        'KEY_PREFIX': 'stlibrary',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_caches = override_settings(CACHES=TEST_CACHES, RESPONSE_CACHE_TIMEOUT=600)
+        self._test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_caches.disable()
+        super().teardown_test_environment(**kwargs)
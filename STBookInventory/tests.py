@@ -1,3 +1,1462 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .mail import claim_due_emails, queue_email, send_queued_emails
+from .models import AuthorInventory, Book, BookCheckout, InventorySummary, OutgoingEmail, User
+from . import inventory, search, services, throttling
 
 # Create your tests here.
+
+
+def make_user(email='staff@example.com', account_type=User.AccountType.STAFF_MEMBER): #Small helper so each test can create the users it needs
+    return User.objects.create_user(email=email, password='pass12345', account_type=account_type)
+
+
+def make_book(user, isbn='9780000000001', copies=1, **extra):
+    return Book.objects.create(isbn=isbn, title=extra.pop('title', 'A Book'), author=extra.pop('author', 'An Author'), available_copies=copies, user=user, **extra)
+
+
+class QueryCountMixin:
+    #assertEndpointQueries fails with the captured SQL when an endpoint runs more (or fewer) queries than expected, so an N+1 creeping back into a view or template breaks the build
+
+    def assertEndpointQueries(self, client, url, expected, status_code=200):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, status_code)
+        executed = [query['sql'] for query in context.captured_queries]
+        self.assertEqual(len(executed), expected, f'{url} ran {len(executed)} queries, expected {expected}:\n' + '\n'.join(executed))
+        return response
+
+
+class CheckoutServiceTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.book = make_book(self.user, copies=1)
+
+    def test_checkout_decrements_and_records(self):
+        result, checkout = services.checkout_book(self.book.id, self.user)
+        self.assertEqual(result, services.CHECKOUT_OK)
+        self.assertEqual(checkout.book_id, self.book.id)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 0)
+
+    def test_checkout_without_copies(self):
+        services.checkout_book(self.book.id, self.user)
+        result, checkout = services.checkout_book(self.book.id, self.user)
+        self.assertEqual(result, services.CHECKOUT_NO_COPIES)
+        self.assertIsNone(checkout)
+        self.assertEqual(BookCheckout.objects.count(), 1)
+
+    def test_checkout_missing_book(self):
+        result, checkout = services.checkout_book(self.book.id + 100, self.user)
+        self.assertEqual(result, services.CHECKOUT_NOT_FOUND)
+
+    def test_checkout_api(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        url = f'/stbookinventory/checkout/api/{self.book.id}/'
+        self.assertEqual(client.patch(url).status_code, 200)
+        self.assertEqual(client.patch(url).status_code, 400)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    #Many threads (each with its own database connection) hammer one hot book. Exactly `copies` checkouts may succeed.
+    threads = 16
+    attempts_per_thread = 5
+    copies = 20
+
+    def test_concurrent_checkouts_never_oversell(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Needs a file based or server database so that threads use separate connections')
+        user = make_user()
+        book = make_book(user, copies=self.copies)
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                for _ in range(self.attempts_per_thread):
+                    result, _checkout = services.checkout_book(book.id, user)
+                    with lock:
+                        results.append(result)
+            finally:
+                connections.close_all() #Every thread opened its own connection, close it before the thread ends
+
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        book.refresh_from_db()
+        self.assertEqual(len(results), self.threads * self.attempts_per_thread)
+        self.assertEqual(results.count(services.CHECKOUT_OK), self.copies)
+        self.assertEqual(book.available_copies, 0)
+        self.assertEqual(BookCheckout.objects.filter(book=book).count(), self.copies)
+
+
+class BulkAddBookTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        make_book(self.user, isbn='1111111111111')
+
+    def test_list_upload_keeps_per_item_shape(self):
+        payload = [
+            {'isbn': '2222222222222', 'title': 'New', 'author': 'A', 'available_copies': 2, 'user': 999},
+            {'isbn': '1111111111111', 'title': 'Already there', 'author': 'B', 'available_copies': 1},
+            {'isbn': '2222222222222', 'title': 'Repeated in payload', 'author': 'C', 'available_copies': 1},
+            {'isbn': '3333333333333', 'title': 'Bad copies', 'author': 'D', 'available_copies': -1},
+        ]
+        response = self.client.post('/stbookinventory/create/api/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        created, existing, repeated, invalid = response.json()
+        self.assertEqual(created['user'], self.user.id)
+        self.assertEqual(created['id'], Book.objects.get(isbn='2222222222222').id)
+        self.assertEqual(existing, {'isbn': ['book with this isbn already exists.']})
+        self.assertEqual(repeated, existing)
+        self.assertIn('non_field_errors', invalid) #Rejected by the database CHECK constraint, the rest of the chunk is still created
+        self.assertEqual(Book.objects.count(), 2)
+
+    def test_bulk_insert_query_count_is_per_chunk(self):
+        def queries_for(start, count):
+            payload = [{'isbn': f'{n:013d}', 'title': f'T{n}', 'author': 'A', 'available_copies': 1} for n in range(start, start + count)]
+            with CaptureQueriesContext(connection) as context:
+                services.bulk_add_books(payload, self.user, batch_size=count)
+            return len(context.captured_queries)
+
+        queries_for(0, 1) #The first book by author 'A' creates its inventory row
+        self.assertEqual(queries_for(100, 10), queries_for(200, 40)) #One chunk costs the same number of queries whatever its size
+        self.assertEqual(Book.objects.count(), 52)
+
+    def test_ndjson_upload(self):
+        body = b'{"isbn": "4444444444444", "title": "Line one", "author": "A", "available_copies": 1}\n' \
+               b'not json\n' \
+               b'{"isbn": "5555555555555", "title": "Line two", "author": "B", "available_copies": 3}\n'
+        response = self.client.post('/stbookinventory/create/api/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        first, broken, second = response.json()
+        self.assertEqual(first['title'], 'Line one')
+        self.assertIn('non_field_errors', broken)
+        self.assertEqual(second['available_copies'], 3)
+
+
+class QueryCountTests(QueryCountMixin, TransactionTestCase): #The catalogue version goes up after commit, which a TestCase never does
+    #Books and checkouts belong to different users, so anything that loads related rows one at a time would show up as extra queries
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email='admin@example.com', password='pass12345', account_type=User.AccountType.ADMIN)
+        for n in range(10):
+            owner = make_user(email=f'user{n}@example.com')
+            book = make_book(owner, isbn=f'{n:013d}', title=f'Title {n}', copies=2)
+            BookCheckout.objects.create(book=book, user=owner)
+        self.client.force_login(self.admin)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.admin).key)
+
+    def test_book_list_page(self):
+        self.assertEndpointQueries(self.client, '/stbookinventory/list/', 2) #catalogue version (response cache key), books JOIN users
+
+    def test_search_page(self):
+        self.assertEndpointQueries(self.client, '/stbookinventory/search/?query=Title', 2) #index lookup, books JOIN users
+
+    def test_read_all_books_api(self):
+        self.assertEndpointQueries(self.api, '/stbookinventory/read/api/', 4) #token JOIN user, catalogue version, count, page of books
+
+    def test_admin_book_changelist(self):
+        self.assertEndpointQueries(self.client, '/admin/STBookInventory/book/', 5)
+
+    def test_admin_bookcheckout_changelist(self):
+        self.assertEndpointQueries(self.client, '/admin/STBookInventory/bookcheckout/', 5)
+
+
+class KeysetPaginationTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.user = make_user()
+        titles = ['b', 'a', None, 'b', 'c', 'a', None, 'd', 'b', 'e', 'a', 'f', 'c']
+        for n, title in enumerate(titles):
+            make_book(self.user, isbn=f'{n:013d}', title=title)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def crawl(self, url):
+        seen = []
+        while url:
+            body = self.api.get(url).json()
+            seen.extend(book['id'] for book in body['results'])
+            url = body['next']
+        return seen
+
+    def test_crawl_by_id(self):
+        seen = self.crawl('/stbookinventory/read/api/?pagination=cursor')
+        self.assertEqual(seen, list(Book.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_crawl_by_title_with_id_tiebreak(self):
+        seen = self.crawl('/stbookinventory/read/api/?pagination=cursor&ordering=title')
+        expected = sorted(Book.objects.values_list('title', 'id'), key=lambda row: (row[0] is not None, row[0] or '', row[1]))
+        self.assertEqual(seen, [book_id for _, book_id in expected])
+
+    def test_cursor_page_skips_count(self):
+        first = self.api.get('/stbookinventory/read/api/?pagination=cursor').json()
+        response = self.assertEndpointQueries(self.api, first['next'], 3) #The user (the token was cached by the first request), catalogue version and one keyset page. No COUNT(*)
+        self.assertIsNone(response.json()['next'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.api.get('/stbookinventory/read/api/?pagination=cursor&cursor=garbage').status_code, 404)
+        from .pagination import BookKeysetPagination
+        encode = BookKeysetPagination().encode_cursor
+        for position in ({'o': 'title', 'id': 1}, {'o': 'title', 'id': 1, 'title': 5}, [1, 2]): #No title, a title that is not text, not an object
+            self.assertEqual(self.api.get('/stbookinventory/read/api/', {'pagination': 'cursor', 'ordering': 'title', 'cursor': encode(position)}).status_code, 404, position)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.potter = make_book(self.user, isbn='9780747532699', title="Harry Potter and the Philosopher's Stone", author='J. K. Rowling')
+        self.hobbit = make_book(self.user, isbn='9780261102217', title='The Hobbit', author='J. R. R. Tolkien')
+        self.about = make_book(self.user, isbn='9780000000099', title='Reading Tolkien', author='Harry Someone')
+
+    def titles(self, query):
+        return [book.title for book in search.search_books(query)]
+
+    def test_title_and_author_prefixes(self):
+        self.assertEqual(self.titles('harr pott'), [self.potter.title])
+        self.assertEqual(self.titles('tolkien')[0], 'Reading Tolkien') #A title match ranks above an author match
+        self.assertEqual(set(self.titles('tolkien')), {'The Hobbit', 'Reading Tolkien'})
+
+    def test_isbn_exact_then_prefix(self):
+        self.assertEqual(self.titles('978-0-261-10221-7'), ['The Hobbit'])
+        self.assertEqual(self.titles('9780'), ['Reading Tolkien', 'The Hobbit', self.potter.title]) #isbn order
+
+    def test_index_follows_save_delete_and_bulk_add(self):
+        self.hobbit.title = 'There and Back Again'
+        self.hobbit.save()
+        self.assertEqual(self.titles('hobbit'), [])
+        self.assertEqual(self.titles('back again'), ['There and Back Again'])
+        self.potter.delete()
+        self.assertEqual(self.titles('potter'), [])
+        services.bulk_add_books([{'isbn': '1234567890123', 'title': 'Bulk Added', 'author': 'X', 'available_copies': 1}], self.user)
+        self.assertEqual(self.titles('bulk'), ['Bulk Added'])
+
+    def test_rebuild_command(self):
+        Book.objects.filter(pk=self.hobbit.pk).update(title='Renamed Quietly') #update() sends no signals
+        self.assertEqual(self.titles('renamed'), [])
+        call_command('rebuild_search_index', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.titles('renamed'), ['Renamed Quietly'])
+
+    def test_search_api(self):
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        response = api.get('/stbookinventory/search/api/', {'query': 'hobbit'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([book['id'] for book in response.json()['results']], [self.hobbit.id])
+
+
+class CachedTokenAuthenticationTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.token = Token.objects.create(user=self.user)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+
+    def test_second_request_skips_token_query(self):
+        self.assertEndpointQueries(self.api, '/stbookinventory/test_token', 1) #Token JOIN User
+        response = self.assertEndpointQueries(self.api, '/stbookinventory/test_token', 1) #The user by primary key, no token lookup
+        self.assertEqual(response.data, 'passed for staff@example.com')
+
+    def test_only_the_user_id_is_cached(self):
+        from .authentication import _cache_key
+        self.api.get('/stbookinventory/test_token')
+        self.assertEqual(cache.get(_cache_key(self.token.key)), self.user.pk) #No user object, so no password hash in the cache
+
+    def test_queryset_deactivation_and_deletion(self):
+        self.api.get('/stbookinventory/test_token')
+        User.objects.filter(pk=self.user.pk).update(is_active=False) #No post_save signal
+        self.assertEqual(self.api.get('/stbookinventory/test_token').status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_active=True)
+        self.api.get('/stbookinventory/test_token')
+        Token.objects.filter(user=self.user).delete()
+        self.assertEqual(self.api.get('/stbookinventory/test_token').status_code, 403)
+
+    def test_logout_invalidates(self):
+        self.api.get('/stbookinventory/test_token')
+        self.api.post('/stbookinventory/logout')
+        self.assertEqual(self.api.get('/stbookinventory/test_token').status_code, 403) #test_token lists SessionAuthentication first, so DRF answers a failed login with 403
+
+    def test_deactivation_invalidates(self):
+        self.api.get('/stbookinventory/test_token')
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.api.get('/stbookinventory/test_token').status_code, 403) #test_token lists SessionAuthentication first, so DRF answers a failed login with 403
+
+    def test_change_password_refreshes_cached_user(self):
+        self.api.get('/stbookinventory/test_token')
+        response = self.api.post('/stbookinventory/change_password/', {'old_password': 'pass12345', 'new_password': 'newpass123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.api.get('/stbookinventory/test_token')
+        self.assertTrue(any('authtoken_token' in query['sql'] for query in context.captured_queries)) #Looked up again after the password change
+
+
+class SharedCacheTests(TestCase):
+    #gunicorn runs several worker processes. A reset token stored by the worker that handled forgot_password must be readable by whichever worker gets the password_reset request
+    def setUp(self):
+        throttling.reset()
+        self.directory = tempfile.mkdtemp() #A file cache of its own: the tests never write to the configured one (see test_runner.py)
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        overridden = override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': self.directory, 'KEY_PREFIX': 'stlibrary'}})
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def test_reset_token_visible_across_processes(self):
+        user = make_user(email='reader@example.com')
+        token = 'crossprocesstoken' + str(os.getpid())
+        worker = (
+            'import django; django.setup()\n'
+            'from django.core.cache import cache\n'
+            f'cache.set("password_reset_token_{token}", "{user.email}", timeout=60)\n'
+        )
+        environment = dict(os.environ, DJANGO_SETTINGS_MODULE='STLibrary.settings', CACHE_BACKEND='file', CACHE_LOCATION=self.directory)
+        subprocess.run([sys.executable, '-c', worker], check=True, env=environment, cwd=settings.BASE_DIR)
+
+        response = self.client.post(f'/stbookinventory/password_reset/{token}/', {'new_password': 'fromanotherworker'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('fromanotherworker'))
+
+
+class TestCacheIsolationTests(TestCase):
+    def test_tests_never_use_the_configured_cache(self):
+        from django.core.cache import caches
+        from .test_runner import TEST_CACHES
+        self.assertEqual(settings.CACHES, TEST_CACHES)
+        self.assertEqual(type(caches['default']).__name__, 'LocMemCache')
+
+
+class FailingEmailBackend(BaseEmailBackend): #Stands in for an unreachable mail server
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('mail server down')
+
+
+class EmailQueueTests(TestCase):
+    def setUp(self):
+        self.user = make_user(email='forgetful@example.com')
+        throttling.reset()
+        cache.clear()
+
+    def test_forgot_password_only_queues(self):
+        response = self.client.post('/stbookinventory/forgot_password/', {'email': self.user.email}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(mail.outbox), 0) #Nothing was sent during the request
+        queued = OutgoingEmail.objects.get()
+        self.assertEqual(queued.to, self.user.email)
+
+        call_command('send_queued_emails', stdout=open(os.devnull, 'w'))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('password_reset', mail.outbox[0].body)
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, OutgoingEmail.Status.SENT)
+        self.assertEqual(queued.body, '')
+
+    def test_batch_uses_one_connection(self):
+        for n in range(3):
+            queue_email('Subject', 'Body', 'library@example.com', [f'reader{n}@example.com'])
+        with mock.patch('STBookInventory.mail.get_connection', wraps=get_connection) as opened:
+            self.assertEqual(send_queued_emails(batch_size=10), (3, 0))
+        self.assertEqual(opened.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(EMAIL_BACKEND='STBookInventory.tests.FailingEmailBackend', EMAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_failures_back_off_then_give_up(self):
+        email = queue_email('Subject', 'Body', 'library@example.com', ['reader@example.com'])
+        self.assertEqual(send_queued_emails(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.Status.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now()) #Not due again until the backoff has passed
+        self.assertEqual(send_queued_emails(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.Status.FAILED, 2))
+        self.assertIn('mail server down', email.last_error)
+
+    @override_settings(EMAIL_QUEUE_MAX_ATTEMPTS=2)
+    def test_crashed_worker_counts_as_an_attempt(self):
+        email = queue_email('Subject', 'Body', 'library@example.com', ['reader@example.com'])
+        for attempt in (1, 2):
+            self.assertEqual([claimed.pk for claimed in claim_due_emails(10)], [email.pk]) #The worker then dies without recording anything
+            email.refresh_from_db()
+            self.assertEqual(email.attempts, attempt)
+            OutgoingEmail.objects.update(next_attempt_at=timezone.now()) #The lease runs out
+        self.assertEqual(claim_due_emails(10), []) #Not leased a third time
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.Status.FAILED, 2))
+
+
+class InventorySummaryTests(QueryCountMixin, TransactionTestCase): #The counters are updated after commit, which a TestCase never does
+    def setUp(self):
+        self.user = make_user(account_type=User.AccountType.ADMIN)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def assertCountersMatchRecompute(self):
+        incremental = inventory.summary()
+        inventory.recompute()
+        self.assertEqual(incremental, inventory.summary())
+        return incremental
+
+    def test_missing_summary_row_is_rebuilt_once_per_commit(self):
+        books = [make_book(self.user, isbn=f'100000000010{n}', author='Ann' if n % 2 else 'Bob', copies=n + 1) for n in range(5)]
+        make_book(self.user, isbn='1000000000200', author='Cy', copies=7)
+        InventorySummary.objects.all().delete() #A database from before the counters, or flushed tables
+        AuthorInventory.objects.all().delete()
+        Book.objects.filter(pk__in=[book.pk for book in books[:3]]).delete() #One statement, three deltas in one commit. The first rebuilds the counters, which already counts the other two
+        totals = self.assertCountersMatchRecompute()
+        self.assertEqual((totals['total_titles'], totals['total_available_copies']), (3, 4 + 5 + 7))
+        Book.objects.filter(pk__in=[book.pk for book in books[3:]]).delete() #The next commit is counted again
+        totals = self.assertCountersMatchRecompute()
+        self.assertEqual((totals['total_titles'], totals['total_available_copies']), (1, 7))
+
+    def test_counters_follow_every_write_path(self):
+        self.api.post('/stbookinventory/create/api/', [
+            {'isbn': '1000000000001', 'title': 'One', 'author': 'Ann', 'available_copies': 3},
+            {'isbn': '1000000000002', 'title': 'Two', 'author': 'Bob', 'available_copies': 2},
+            {'isbn': '1000000000003', 'title': 'Three', 'available_copies': 1},
+        ], format='json')
+        single = make_book(self.user, isbn='1000000000004', author='Ann', copies=4)
+        one = Book.objects.get(isbn='1000000000001')
+        self.api.patch(f'/stbookinventory/checkout/api/{one.id}/')
+        self.api.patch(f'/stbookinventory/checkout/api/{one.id}/')
+        self.api.patch(f'/stbookinventory/update/api/{single.id}/', {'available_copies': 6}, format='json')
+        self.api.patch(f'/stbookinventory/update/api/{one.id}/', {'author': 'Bob'}, format='json')
+        totals = self.assertCountersMatchRecompute()
+        self.assertEqual((totals['total_titles'], totals['total_available_copies'], totals['copies_checked_out']), (4, 10, 2))
+        self.assertEqual(totals['authors'], [
+            {'author': '', 'titles': 1, 'available_copies': 1, 'checked_out': 0},
+            {'author': 'Ann', 'titles': 1, 'available_copies': 6, 'checked_out': 0},
+            {'author': 'Bob', 'titles': 2, 'available_copies': 3, 'checked_out': 2},
+        ])
+
+        self.api.delete(f'/stbookinventory/delete/api/{one.id}/')
+        totals = self.assertCountersMatchRecompute()
+        self.assertEqual((totals['total_titles'], totals['total_available_copies'], totals['copies_checked_out']), (3, 9, 0))
+
+    def test_endpoint_does_not_aggregate_books(self):
+        for n in range(5):
+            make_book(self.user, isbn=f'{n:013d}', author=f'Author {n % 2}', copies=n)
+        self.api.get('/stbookinventory/test_token') #Cache the token first
+        response = self.assertEndpointQueries(self.api, '/stbookinventory/inventory/api/', 3) #the user, summary row, author rows
+        self.assertEqual(response.json()['total_available_copies'], 10)
+
+    def test_counters_are_written_after_commit(self):
+        book = make_book(self.user, copies=2)
+        table = InventorySummary._meta.db_table
+        with CaptureQueriesContext(connection) as context:
+            with transaction.atomic():
+                services.checkout_book(book.id, self.user)
+                in_transaction = len(context.captured_queries)
+        self.assertFalse([query for query in context.captured_queries[:in_transaction] if table in query['sql']]) #No lock on the summary row while the checkout transaction is open
+        self.assertTrue([query for query in context.captured_queries[in_transaction:] if table in query['sql']])
+        self.assertEqual(inventory.summary()['copies_checked_out'], 1)
+
+        with transaction.atomic():
+            services.checkout_book(book.id, self.user)
+            transaction.set_rollback(True)
+        self.assertEqual(inventory.summary()['copies_checked_out'], 1) #A rolled back checkout never reaches the counters
+
+
+class ReturnBookTests(TransactionTestCase): #The counters are updated after commit, which a TestCase never does
+    def setUp(self):
+        self.staff = make_user()
+        self.book = make_book(self.staff, copies=2)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.staff).key)
+
+    def test_return_closes_loan_and_restocks(self):
+        self.api.patch(f'/stbookinventory/checkout/api/{self.book.id}/')
+        response = self.api.patch(f'/stbookinventory/return/api/{self.book.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()['returned_at'])
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+        self.assertEqual(self.api.patch(f'/stbookinventory/return/api/{self.book.id}/').status_code, 400) #Nothing left to return
+        self.assertEqual(inventory.summary()['copies_checked_out'], 0)
+
+    def test_return_for_another_user(self):
+        reader = make_user(email='reader@example.com')
+        services.checkout_book(self.book.id, reader)
+        response = self.api.patch(f'/stbookinventory/return/api/{self.book.id}/', {'user': reader.id}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(BookCheckout.objects.held_by(reader).exists())
+
+    def test_loans_and_overdue(self):
+        services.checkout_book(self.book.id, self.staff)
+        old = BookCheckout.objects.create(book=self.book, user=self.staff)
+        BookCheckout.objects.filter(pk=old.pk).update(checkout_date_time=timezone.now() - timezone.timedelta(days=30))
+        self.assertEqual(self.api.get('/stbookinventory/loans/api/').json()['count'], 2)
+        overdue = self.api.get('/stbookinventory/loans/api/?overdue=true').json()['results']
+        self.assertEqual([loan['id'] for loan in overdue], [old.id])
+
+    def test_open_loan_lookups_use_partial_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Checks the SQLite query plan')
+        self.assertIn('open_checkout_user_book_idx', BookCheckout.objects.held_by(self.staff).filter(book=self.book).order_by('checkout_date_time').explain()) #The query services.return_book runs
+        self.assertIn('open_checkout_date_idx', BookCheckout.objects.overdue().explain())
+
+    def test_html_return(self):
+        self.client.force_login(self.staff)
+        services.checkout_book(self.book.id, self.staff)
+        response = self.client.post(f'/stbookinventory/return/{self.book.id}/')
+        self.assertRedirects(response, f'/stbookinventory/book/{self.book.id}/')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+
+    def test_html_return_and_checkout_need_a_login(self):
+        for url in (f'/stbookinventory/return/{self.book.id}/', f'/stbookinventory/checkout/{self.book.id}/'):
+            response = self.client.post(url)
+            self.assertRedirects(response, f'/api-auth/login/?next={url}')
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+
+
+class QueryPlanAuditTests(TestCase):
+    def test_no_unexpected_full_scans(self):
+        from .query_audit import audit
+        unexpected = {endpoint: scans for endpoint, plan, scans, allowed in audit() if scans and not allowed}
+        self.assertEqual(unexpected, {})
+
+    def test_command_reports_each_endpoint(self):
+        out = StringIO()
+        call_command('audit_query_plans', stdout=out)
+        self.assertIn('token authentication', out.getvalue())
+
+
+class DatabaseProfileTests(TransactionTestCase):
+    def test_sqlite_connection_settings(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Checks the SQLite profile')
+        from .signals import configure_sqlite_connection
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES['default']['OPTIONS']['timeout'] * 1000)
+            cursor.execute('PRAGMA journal_mode')
+            mode = cursor.fetchone()[0]
+            with override_settings(SQLITE_JOURNAL_MODE=''): #The default leaves the file alone
+                configure_sqlite_connection(sender=None, connection=connection)
+                cursor.execute('PRAGMA journal_mode')
+                self.assertEqual(cursor.fetchone()[0], mode)
+            try:
+                with override_settings(SQLITE_JOURNAL_MODE='WAL'):
+                    configure_sqlite_connection(sender=None, connection=connection)
+                    cursor.execute('PRAGMA journal_mode')
+                    self.assertEqual(cursor.fetchone()[0].upper(), 'WAL')
+            finally:
+                cursor.execute(f'PRAGMA journal_mode={mode}')
+
+    def test_dead_persistent_connection_is_closed(self):
+        from .signals import check_persistent_connections
+        connection.ensure_connection()
+        with mock.patch.dict(connection.settings_dict, {'CONN_MAX_AGE': 60}), mock.patch.object(connection, 'is_usable', return_value=False):
+            check_persistent_connections()
+        self.assertIsNone(connection.connection)
+
+    def test_load_test_cleans_up(self):
+        out = StringIO()
+        call_command('load_test_writes', threads=2, seconds=0.5, books=3, stdout=out)
+        self.assertIn('writes/sec', out.getvalue())
+        self.assertFalse(User.objects.filter(email='load-test-writes@example.invalid').exists())
+        self.assertFalse(Book.objects.exists())
+
+
+class BenchmarkSuiteTests(TransactionTestCase): #The catalogue version goes up after commit, which a TestCase never does
+    def test_concurrency_paths(self):
+        from . import benchmarks
+        user = make_user(email='concurrency@example.com')
+        book = make_book(user, isbn='8000000000001', title='Concurrent tale', copies=3)
+        self.assertEqual(benchmarks.concurrency_paths('read_one', [book.id]), [f'/stbookinventory/read/api/{book.id}/'])
+        api = APIClient()
+        api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+        for path in benchmarks.concurrency_paths('read_all', [])[:1] + benchmarks.concurrency_paths('search_api', [])[:3]:
+            self.assertIn(api.get(path).status_code, (200, 404), path) #404: that page or word has no books
+
+    def test_percentile(self):
+        from .benchmarks import percentile
+        samples = list(range(1, 101))
+        self.assertEqual([percentile(samples, f) for f in (0.5, 0.95, 0.99)], [50, 95, 99])
+
+    def test_seed_and_run(self):
+        from . import benchmarks, versioning
+        before = versioning.catalogue_version()[0]
+        benchmarks.seed(users=3, books=100, checkouts=10) #10 pages, read_all cycles through pages 1 to 10
+        self.assertEqual(inventory.summary()['total_titles'], 100)
+        self.assertGreater(versioning.catalogue_version()[0], before) #bulk_create sends no signals, seed bumps the version itself
+        results = benchmarks.run(requests=10, warmup=1, bulk_size=2, scenarios=['read_all', 'create_bulk', 'checkout', 'search_api', 'login'])
+        for scenario, numbers in results['scenarios'].items():
+            self.assertEqual(sum(numbers['statuses'].values()), 10)
+            self.assertTrue(all(code.startswith('2') for code in numbers['statuses']), (scenario, numbers['statuses'])) #11 logins of one account, more than login_account allows
+            self.assertEqual(numbers['failures'], 0)
+            self.assertGreater(numbers['queries_per_request'], 0)
+        with mock.patch.object(benchmarks, 'PASSWORD', 'wrong-password'), self.assertRaisesMessage(ValueError, '"login": {"404": 2}'):
+            benchmarks.run(requests=2, warmup=0, scenarios=['login']) #Every login fails, the run reports it instead of timing 404s
+        self.assertEqual(Book.objects.count(), 100) #The writes were rolled back
+        self.assertEqual(BookCheckout.objects.count(), 10)
+
+
+@override_settings(PERFORMANCE_SAMPLE_RATE=1.0, PERFORMANCE_METRICS_TOKEN='scrape-secret')
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        from . import instrumentation
+        instrumentation.metrics.reset()
+        cache.delete(instrumentation.WORKERS_KEY)
+        self.user = make_user(email='timed@example.com')
+        self.book = make_book(self.user, isbn='1000000000001', copies=2)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def scrape(self):
+        return self.client.get('/stbookinventory/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret').content.decode()
+
+    def test_server_timing_header(self):
+        response = self.api.get('/stbookinventory/read/api/')
+        timings = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'serialize', 'render', 'app', 'total'})
+        self.assertIn('queries"', timings['db'])
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_serializer_time(self):
+        response = self.api.get(f'/stbookinventory/read/api/{self.book.id}/') #BookSerializer turns the book into a dict
+        serialize = [part for part in response['Server-Timing'].split(', ') if part.startswith('serialize;')][0]
+        self.assertGreater(float(serialize.split('dur=')[1]), 0)
+        self.assertIn('stlibrary_request_serialize_seconds_total{view="STBookInventory.api_views.get_book_view"}', self.scrape())
+
+    def test_html_render_time(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/stbookinventory/list/')
+        render = [part for part in response['Server-Timing'].split(', ') if part.startswith('render;')][0]
+        self.assertGreater(float(render.split('dur=')[1]), 0)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_only_counted(self):
+        response = self.api.get('/stbookinventory/read/api/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        text = self.scrape()
+        self.assertIn('stlibrary_requests_total{view="STBookInventory.api_views.get_all_books_view",method="GET",status="200"} 1', text)
+        self.assertNotIn('stlibrary_request_duration_seconds_count{view="STBookInventory.api_views.get_all_books_view"}', text)
+
+    def test_metrics_endpoint(self):
+        self.api.get('/stbookinventory/read/api/')
+        self.api.get('/stbookinventory/read/api/')
+        text = self.scrape()
+        self.assertIn('stlibrary_request_duration_seconds_count{view="STBookInventory.api_views.get_all_books_view"} 2', text)
+        self.assertIn('stlibrary_request_duration_seconds_bucket{view="STBookInventory.api_views.get_all_books_view",le="+Inf"} 2', text)
+        self.assertIn('# TYPE stlibrary_request_db_queries_total counter', text)
+
+    def test_other_workers_are_merged(self):
+        from . import instrumentation
+        self.api.get('/stbookinventory/read/api/')
+        other = instrumentation.metrics.snapshot() #Stands in for a second gunicorn worker with the same numbers
+        cache.set('perf_metrics_other_worker', other)
+        cache.set(instrumentation.WORKERS_KEY, ['perf_metrics_other_worker'])
+        text = instrumentation.metrics_text()
+        self.assertIn('stlibrary_request_duration_seconds_count{view="STBookInventory.api_views.get_all_books_view"} 2', text)
+
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get('/stbookinventory/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/stbookinventory/metrics/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get('/stbookinventory/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    @override_settings(PERFORMANCE_METRICS_TOKEN='')
+    def test_metrics_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/stbookinventory/metrics/').status_code, 403)
+        self.assertEqual(self.client.get('/stbookinventory/metrics/', HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class ConditionalGetTests(QueryCountMixin, TransactionTestCase): #The catalogue version goes up after commit, which a TestCase never does
+    def setUp(self):
+        self.user = make_user(email='kiosk@example.com', account_type=User.AccountType.STAFF_MEMBER)
+        self.book = make_book(self.user, isbn='2000000000001', copies=2)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.api.get('/stbookinventory/read/api/') #Caches the token lookup
+
+    def test_catalogue_version_goes_up_after_commit(self):
+        from . import versioning
+        before = versioning.catalogue_version()[0]
+        bumps = [] #Whether each UPDATE of the catalogue version ran inside a transaction
+        def wrapper(execute, sql, params, many, context):
+            if sql.startswith('UPDATE "STBookInventory_catalogueversion"'):
+                bumps.append(connection.in_atomic_block)
+            return execute(sql, params, many, context)
+        with connection.execute_wrapper(wrapper):
+            with transaction.atomic():
+                services.checkout_book(self.book.id, self.user)
+                make_book(self.user, isbn='2000000000009', copies=1)
+                self.assertEqual(versioning.catalogue_version()[0], before) #Nothing to see before the commit
+        self.assertEqual(versioning.catalogue_version()[0], before + 1) #Once per transaction, however many writes it made
+        self.assertEqual(bumps, [False])
+
+        with transaction.atomic():
+            make_book(self.user, isbn='2000000000010', copies=1)
+            transaction.set_rollback(True)
+        self.assertEqual(versioning.catalogue_version()[0], before + 1) #A rolled back write never bumps it
+        make_book(self.user, isbn='2000000000011', copies=1)
+        self.assertEqual(versioning.catalogue_version()[0], before + 2) #and does not hold back the next one
+
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    make_book(self.user, isbn='2000000000012', copies=1)
+                    raise ValueError
+            except ValueError: #The savepoint with the first write is rolled back, the second write still bumps
+                pass
+            make_book(self.user, isbn='2000000000013', copies=1)
+        self.assertEqual(versioning.catalogue_version()[0], before + 3)
+
+    def test_book_etag_and_304(self):
+        url = f'/stbookinventory/read/api/{self.book.id}/'
+        response = self.api.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with CaptureQueriesContext(connection) as queries:
+            unchanged = self.api.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(len(queries), 2) #Only the user and the version lookup, the book is neither loaded nor serialized
+        self.assertNotIn('"isbn"', queries[1]['sql'])
+
+        services.checkout_book(self.book.id, self.user)
+        changed = self.api.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertEqual(changed.json()['available_copies'], 1)
+
+    def test_if_modified_since(self):
+        url = f'/stbookinventory/read/api/{self.book.id}/'
+        response = self.api.get(url)
+        self.assertEqual(self.api.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_every_write_changes_the_version(self):
+        versions = [self.book.version]
+        self.book.title = 'New title'
+        self.book.save()
+        versions.append(self.book.version)
+        self.book.update_available_copies(3)
+        versions.append(self.book.version)
+        services.checkout_book(self.book.id, self.user)
+        services.return_book(self.book.id, self.user)
+        self.book.refresh_from_db()
+        versions.append(self.book.version)
+        self.assertEqual(versions, [1, 2, 3, 5])
+
+    def test_list_uses_catalogue_version(self):
+        url = '/stbookinventory/read/api/?page=1'
+        etag = self.api.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(len(queries), 2) #The user and the catalogue version
+
+        other = make_book(self.user, isbn='2000000000002') #A write anywhere in the catalogue changes every page
+        self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.api.get(url)['ETag']
+        other.delete()
+        self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.api.get(url)['ETag']
+        services.bulk_add_books([{'isbn': '2000000000003', 'title': 'Bulk', 'available_copies': 1}], self.user)
+        self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ResponseCacheTests(QueryCountMixin, TransactionTestCase): #The catalogue version goes up after commit, which a TestCase never does
+    def setUp(self):
+        from . import instrumentation
+        instrumentation.metrics.reset()
+        cache.delete(instrumentation.WORKERS_KEY)
+        self.staff = make_user(email='cache-staff@example.com', account_type=User.AccountType.STAFF_MEMBER)
+        self.admin = User.objects.create_superuser(email='cache-admin@example.com', password='pass12345', account_type=User.AccountType.ADMIN)
+        self.book = make_book(self.staff, isbn='3000000000001', title='Cached', copies=2)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.staff).key)
+
+    def test_hits_skip_loading_books(self):
+        for url in ('/stbookinventory/read/api/?page=1', f'/stbookinventory/read/api/{self.book.id}/'):
+            first = self.api.get(url)
+            with CaptureQueriesContext(connection) as queries:
+                second = self.api.get(url)
+            self.assertEqual(second.json(), first.json())
+            self.assertEqual(second['ETag'], first['ETag'])
+            self.assertEqual(len(queries), 2, url) #The user and the version lookup only
+        self.client.get('/stbookinventory/list/')
+        self.assertEndpointQueries(self.client, '/stbookinventory/list/', 1)
+
+    def test_query_string_is_part_of_the_key(self):
+        make_book(self.staff, isbn='3000000000002', title='Second')
+        by_id = self.api.get('/stbookinventory/read/api/?pagination=cursor').json()
+        by_title = self.api.get('/stbookinventory/read/api/?pagination=cursor&ordering=title').json()
+        self.assertEqual([book['title'] for book in by_id['results']], ['Cached', 'Second'])
+        self.assertEqual([book['title'] for book in by_title['results']], ['Cached', 'Second'])
+        make_book(self.staff, isbn='3000000000003', title='A first title')
+        by_title = self.api.get('/stbookinventory/read/api/?ordering=title&pagination=cursor').json() #Same parameters in another order
+        self.assertEqual(by_title['results'][0]['title'], 'A first title')
+
+    def test_writes_invalidate(self):
+        url = '/stbookinventory/read/api/?page=1'
+        detail = f'/stbookinventory/read/api/{self.book.id}/'
+        self.api.get(url), self.api.get(detail), self.client.get('/stbookinventory/list/')
+
+        self.api.patch(f'/stbookinventory/update/api/{self.book.id}/', {'title': 'Via API'}, format='json')
+        self.assertEqual(self.api.get(url).json()['results'][0]['title'], 'Via API')
+        self.assertEqual(self.api.get(detail).json()['title'], 'Via API')
+        self.assertContains(self.client.get('/stbookinventory/list/'), 'Via API')
+
+        self.api.patch(f'/stbookinventory/checkout/api/{self.book.id}/')
+        self.assertEqual(self.api.get(detail).json()['available_copies'], 1)
+
+        self.client.force_login(self.admin)
+        self.client.post(f'/admin/STBookInventory/book/{self.book.id}/change/', {'isbn': self.book.isbn, 'title': 'Via admin', 'author': '', 'available_copies': 1, 'user': self.staff.id})
+        self.assertEqual(self.api.get(detail).json()['title'], 'Via admin')
+        self.assertContains(self.client.get(f'/stbookinventory/book/{self.book.id}/'), 'Via admin')
+
+        self.book.delete()
+        self.assertEqual(self.client.get('/stbookinventory/list/').content.count(b'Via admin'), 0)
+
+    def test_renderer_is_part_of_the_key_and_etag(self):
+        from . import instrumentation
+        for url in ('/stbookinventory/read/api/', f'/stbookinventory/read/api/{self.book.id}/'):
+            as_json = self.api.get(url)
+            as_html = self.api.get(url, HTTP_ACCEPT='text/html') #The browsable API
+            self.assertEqual(as_html['Content-Type'], 'text/html; charset=utf-8')
+            self.assertNotEqual(as_html['ETag'], as_json['ETag'])
+            self.assertEqual(self.api.get(url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=as_json['ETag']).status_code, 200) #The JSON copy is not a copy of the page
+            self.assertEqual(self.api.get(url, HTTP_IF_NONE_MATCH=as_json['ETag']).status_code, 304)
+        counts = instrumentation.metrics.snapshot()['cache']
+        self.assertEqual(counts[('read_all_books_api', 'miss')], 2) #One entry per renderer
+        self.assertEqual(counts[('read_book_api', 'miss')], 2)
+
+    def test_user_changes_invalidate_the_list_page(self):
+        self.assertContains(self.client.get('/stbookinventory/list/'), 'cache-staff')
+        self.staff.name = 'Renamed Staff'
+        self.staff.save()
+        self.assertContains(self.client.get('/stbookinventory/list/'), 'Renamed Staff')
+
+        from . import versioning
+        version = versioning.catalogue_version()[0]
+        self.client.login(email='cache-admin@example.com', password='pass12345') #Only last_login changes
+        self.admin.name = 'No books'
+        self.admin.save()
+        self.assertEqual(versioning.catalogue_version()[0], version)
+
+    @override_settings(PERFORMANCE_METRICS_TOKEN='scrape-secret')
+    def test_hit_and_miss_counters(self):
+        self.api.get('/stbookinventory/read/api/')
+        self.api.get('/stbookinventory/read/api/')
+        text = self.client.get('/stbookinventory/metrics/', HTTP_AUTHORIZATION='Bearer scrape-secret').content.decode()
+        self.assertIn('stlibrary_response_cache_requests_total{endpoint="read_all_books_api",result="hit"} 1', text)
+        self.assertIn('stlibrary_response_cache_requests_total{endpoint="read_all_books_api",result="miss"} 1', text)
+
+    @override_settings(RESPONSE_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.api.get('/stbookinventory/read/api/')
+        self.assertEndpointQueries(self.api, '/stbookinventory/read/api/', 4) #the user, catalogue version, count, page of books
+
+
+class FastSerializationTests(TestCase):
+    def setUp(self):
+        self.staff = make_user()
+        make_book(self.staff, isbn='4000000000001', title='Plain')
+        make_book(self.staff, isbn='4000000000002', title=None, author=None, copies=0)
+        make_book(self.staff, isbn='4000000000003', title='Ünïcödé – 書名   line separator', author='"Quoted" \\ author')
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.staff).key)
+
+    def test_same_bytes_as_book_serializer(self):
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+        from .serializers import BookSerializer, book_rows
+        books = Book.objects.order_by('id')
+        expected = JSONRenderer().render(BookSerializer(books, many=True).data)
+        self.assertEqual(FastJSONRenderer().render(list(book_rows(books))), expected)
+        self.assertIn(b'\\u2028', expected)
+
+    def test_page_size(self):
+        for pagination in ('page', 'cursor'):
+            response = self.api.get(f'/stbookinventory/read/api/?pagination={pagination}&page_size=2')
+            self.assertEqual(len(response.json()['results']), 2)
+            self.assertIsNotNone(response.json()['next'])
+            response = self.api.get(response.json()['next'])
+            self.assertEqual([book['isbn'] for book in response.json()['results']], ['4000000000003'])
+
+    @override_settings(BOOK_MAX_PAGE_SIZE=1)
+    def test_max_page_size(self):
+        self.assertEqual(len(self.api.get('/stbookinventory/read/api/?pagination=cursor&page_size=50').json()['results']), 1)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', rows=50, repeat=1, stdout=out)
+        self.assertIn('Identical JSON output', out.getvalue())
+        self.assertEqual(Book.objects.count(), 3) #The benchmark books were rolled back
+
+
+class ExportTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        self.staff = make_user(account_type=User.AccountType.STAFF_MEMBER)
+        self.reader = make_user(email='export-reader@example.com', account_type=User.AccountType.GENERAL_USER)
+        self.first = make_book(self.staff, isbn='5000000000001', title='First, "quoted"', author='Ann')
+        self.second = make_book(self.reader, isbn='5000000000002', title=None, author='Bob')
+        services.checkout_book(self.first.id, self.reader)
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.staff).key)
+
+    def lines(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode().splitlines()
+
+    def test_ndjson_matches_the_serializer(self):
+        from .serializers import BookCheckoutSerializer, BookSerializer
+        books = [json.loads(line) for line in self.lines(self.api.get('/stbookinventory/export/api/'))]
+        self.assertEqual(books, [BookSerializer(book).data for book in Book.objects.order_by('id')])
+        checkouts = [json.loads(line) for line in self.lines(self.api.get('/stbookinventory/export/api/?dataset=checkouts'))]
+        self.assertEqual(checkouts, [BookCheckoutSerializer(checkout).data for checkout in BookCheckout.objects.all()])
+
+    def test_csv_and_filters(self):
+        rows = list(csv.reader(self.lines(self.api.get('/stbookinventory/export/api/?output=csv&author=Ann'))))
+        self.assertEqual(rows, [['id', 'isbn', 'title', 'author', 'available_copies', 'user'], [str(self.first.id), '5000000000001', 'First, "quoted"', 'Ann', '0', str(self.staff.id)]])
+        self.assertEqual(len(self.lines(self.api.get(f'/stbookinventory/export/api/?user={self.reader.id}'))), 1)
+        today = timezone.now().date()
+        self.assertEqual(len(self.lines(self.api.get(f'/stbookinventory/export/api/?dataset=checkouts&until={today}&author=Ann'))), 1)
+        self.assertEqual(self.lines(self.api.get(f'/stbookinventory/export/api/?since={today.replace(year=today.year + 1)}')), [])
+        for bad in ('output=xml', 'dataset=users', 'user=me', 'since=2026-02-30', 'until=yesterday'):
+            self.assertEqual(self.api.get('/stbookinventory/export/api/?' + bad).status_code, 400, bad)
+
+    def test_checkouts_need_staff(self):
+        reader = APIClient()
+        reader.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.reader).key)
+        self.assertEqual(reader.get('/stbookinventory/export/api/?dataset=checkouts').status_code, 403)
+        self.assertEqual(len(self.lines(reader.get('/stbookinventory/export/api/'))), 2)
+
+    @override_settings(EXPORT_CHUNK_SIZE=1)
+    def test_rows_are_fetched_in_chunks(self):
+        from . import export
+        make_book(self.staff, isbn='5000000000003')
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(len(list(export.ndjson_lines(export.rows('books')))), 3)
+        self.assertEqual(len(context.captured_queries), 1) #One SELECT, read with fetchmany() one chunk at a time
+
+
+class ImportBooksTests(TransactionTestCase): #The counters are updated after commit, which a TestCase never does
+    def setUp(self):
+        self.staff = make_user()
+        self.existing = make_book(self.staff, isbn='6000000000001', title='Old title', author='Ann', copies=1)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(text)
+        return path
+
+    def run_import(self, path, *args):
+        out = StringIO()
+        call_command('import_books', path, '--user', self.staff.email, *args, stdout=out)
+        return out.getvalue()
+
+    def test_csv_upsert(self):
+        path = self.write('books.csv', 'id,isbn,title,author,available_copies,user\n'
+                                       '99,6000000000001,New title,Bob,4,99\n'
+                                       ',6000000000002,"Multi\nline, title",,2,\n'
+                                       ',6000000000003,Bad copies,Ann,lots,\n'
+                                       ',6000000000002,Same ISBN again,Cy,3,\n')
+        output = self.run_import(path)
+        self.assertIn('1 created, 2 updated, 0 unchanged, 1 rejected', output)
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.title, self.existing.author, self.existing.available_copies, self.existing.user), ('New title', 'Bob', 4, self.staff))
+        self.assertEqual(self.existing.version, 2)
+        self.assertEqual(Book.objects.get(isbn='6000000000002').title, 'Same ISBN again') #The last row in the file wins
+        with open(path + '.rejects.ndjson') as handle:
+            rejects = [json.loads(line) for line in handle]
+        self.assertEqual([(reject['line'], list(reject['errors'])) for reject in rejects], [(5, ['available_copies'])])
+        self.assertFalse(os.path.exists(path + '.checkpoint.json'))
+
+        totals = inventory.summary()
+        inventory.recompute()
+        self.assertEqual(inventory.summary(), totals)
+        self.assertEqual(search.search_books('Same ISBN')[0].isbn, '6000000000002')
+        self.assertIn('0 created, 2 updated, 1 unchanged, 1 rejected', self.run_import(path)) #6000000000002 goes through both of its rows again
+        self.assertEqual(Book.objects.get(isbn='6000000000002').title, 'Same ISBN again')
+
+    def test_ndjson_rejects(self):
+        path = self.write('books.ndjson', '{"isbn": "6000000000004", "title": "Fine", "available_copies": 1}\n'
+                                          'not json\n\n'
+                                          '{"isbn": "6000000000005", "available_copies": -1}\n'
+                                          '{"title": "No isbn", "available_copies": 1}\n')
+        self.assertIn('1 created, 0 updated, 0 unchanged, 3 rejected', self.run_import(path))
+        with open(path + '.rejects.ndjson') as handle:
+            self.assertEqual([json.loads(line)['line'] for line in handle], [2, 4, 5])
+
+    def test_resume_after_a_crash(self):
+        from . import importer
+        path = self.write('books.ndjson', ''.join(f'{{"isbn": "60000000001{n:02d}", "available_copies": {n}}}\n' for n in range(7)))
+        real_upsert = importer.upsert
+        calls = []
+
+        def crash_on_second_batch(batch, owner):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise RuntimeError('crash')
+            return real_upsert(batch, owner)
+
+        with mock.patch.object(importer, 'upsert', crash_on_second_batch), self.assertRaises(RuntimeError):
+            self.run_import(path, '--batch-size', '3')
+        self.assertEqual(Book.objects.filter(isbn__startswith='60000000001').count(), 3)
+
+        output = self.run_import(path, '--batch-size', '3')
+        self.assertIn('Resumed', output)
+        self.assertIn('7 created', output)
+        self.assertIn('4 rows', output) #Only the rows after the checkpoint were read again
+        self.assertEqual(Book.objects.filter(isbn__startswith='60000000001').count(), 7)
+
+
+class BulkOperationsTests(QueryCountMixin, TransactionTestCase): #The counters are updated after commit, which a TestCase never does
+    def setUp(self):
+        self.staff = make_user()
+        self.reader = make_user(email='bulk-reader@example.com', account_type=User.AccountType.GENERAL_USER)
+        self.books = [make_book(self.staff, isbn=f'700000000000{n}', title=f'Book {n}', author='Ann' if n % 2 else 'Bob', copies=2) for n in range(4)]
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.staff).key)
+
+    def copies(self):
+        return list(Book.objects.order_by('id').values_list('available_copies', flat=True))
+
+    def assertCountersConsistent(self):
+        totals = inventory.summary()
+        inventory.recompute()
+        self.assertEqual(inventory.summary(), totals)
+
+    def test_locks_are_taken_books_first(self):
+        #Every write locks the Book rows before anything else, and leaves the shared InventorySummary/CatalogueVersion rows until after
+        #the commit. Two writes locking the same rows in different orders can deadlock each other on PostgreSQL
+        ids = [book.id for book in self.books]
+        writes = [
+            lambda: services.checkout_book(ids[0], self.reader),
+            lambda: services.return_book(ids[0], self.reader),
+            lambda: services.bulk_checkout([ids[2], ids[1], ids[2]], self.reader),
+            lambda: services.bulk_update_books([(ids[3], {'title': 'Relocked'}), (ids[0], {'available_copies': 5})]),
+        ]
+        for write in writes:
+            statements = []
+            def wrapper(execute, sql, params, many, context):
+                if not sql.startswith(('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT')):
+                    statements.append(sql)
+                return execute(sql, params, many, context)
+            with connection.execute_wrapper(wrapper):
+                with transaction.atomic(): #The after commit work runs when this block commits
+                    write()
+                    inside = list(statements)
+            after = statements[len(inside):]
+            self.assertTrue(inside[0].startswith(('UPDATE "STBookInventory_book"', 'SELECT "STBookInventory_book"."id" FROM "STBookInventory_book"')), inside[0]) #The lock (FOR UPDATE on PostgreSQL)
+            if 'FOR UPDATE' in inside[0]:
+                self.assertIn('ORDER BY "STBookInventory_book"."id"', inside[0])
+            self.assertFalse([sql for sql in inside if 'inventory' in sql or 'catalogueversion' in sql])
+            self.assertTrue([sql for sql in after if sql.startswith('UPDATE "STBookInventory_catalogueversion"')])
+            self.assertTrue([sql for sql in after if sql.startswith('UPDATE "STBookInventory_inventorysummary"')])
+
+    def test_checkout_all_or_nothing(self):
+        ids = [book.id for book in self.books]
+        response = self.api.patch('/stbookinventory/checkout/api/bulk/', {'operations': [{'book_id': ids[0]}, {'book_id': ids[0]}, {'book_id': ids[0]}, {'book_id': 999999}]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.json()['results']], [424, 424, 400, 404])
+        self.assertEqual(self.copies(), [2, 2, 2, 2])
+        self.assertEqual(BookCheckout.objects.count(), 0)
+
+        operations = [{'book_id': book_id} for book_id in ids[:3]] + [{'book_id': ids[0]}]
+        with CaptureQueriesContext(connection) as context:
+            response = self.api.patch('/stbookinventory/checkout/api/bulk/', operations, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['applied'])
+        self.assertEqual(self.copies(), [0, 1, 1, 2])
+        self.assertEqual(BookCheckout.objects.filter(user=self.staff).count(), 4)
+        self.assertLessEqual(len(context.captured_queries), 12) #Not a transaction per book: a fixed number of statements whatever the size of the stack
+        self.assertCountersConsistent()
+
+    def test_checkout_best_effort_for_another_user(self):
+        ids = [book.id for book in self.books]
+        body = {'mode': 'best_effort', 'user': self.reader.id, 'operations': [{'book_id': ids[1]}, {'book_id': ids[1]}, {'book_id': ids[1]}]}
+        response = self.api.patch('/stbookinventory/checkout/api/bulk/', body, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()['results']], [200, 200, 400])
+        self.assertEqual(BookCheckout.objects.filter(user=self.reader, book_id=ids[1]).count(), 2)
+        self.assertCountersConsistent()
+
+    def test_update_modes(self):
+        first, second, third = self.books[:3]
+        operations = [
+            {'book_id': first.id, 'title': 'Renamed', 'author': 'Bob'},
+            {'book_id': second.id, 'available_copies': -1},
+            {'book_id': third.id, 'isbn': first.isbn},
+        ]
+        response = self.api.patch('/stbookinventory/update/api/bulk/', {'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in response.json()['results']], [424, 400, 400])
+        self.assertEqual(Book.objects.get(pk=first.pk).title, 'Book 0')
+
+        response = self.api.patch('/stbookinventory/update/api/bulk/', {'mode': 'best_effort', 'operations': operations}, format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.json()['results'][0]['book']['title'], 'Renamed')
+        first.refresh_from_db()
+        self.assertEqual((first.title, first.author, first.version), ('Renamed', 'Bob', 2))
+        self.assertEqual(search.search_books('Renamed')[0].pk, first.pk)
+        self.assertCountersConsistent()
+
+    def test_update_hands_isbns_on(self):
+        first, second = self.books[:2]
+        operations = [{'book_id': first.id, 'title': 'Written first'}, {'book_id': first.id, 'isbn': 'TEMPORARY'}, {'book_id': second.id, 'isbn': first.isbn}, {'book_id': first.id, 'isbn': second.isbn}]
+        self.assertEqual(self.api.patch('/stbookinventory/update/api/bulk/', operations[:1] + operations[2:], format='json').status_code, 400) #Operations apply in order: the ISBN is still taken
+        self.assertEqual(self.api.patch('/stbookinventory/update/api/bulk/', operations, format='json').status_code, 200)
+        self.assertEqual(Book.objects.get(pk=first.pk).isbn, second.isbn)
+        self.assertEqual(Book.objects.get(pk=second.pk).isbn, first.isbn)
+
+    def test_permissions_and_bad_requests(self):
+        reader = APIClient()
+        reader.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.reader).key)
+        for url in ('/stbookinventory/checkout/api/bulk/', '/stbookinventory/update/api/bulk/'):
+            self.assertEqual(reader.patch(url, [{'book_id': self.books[0].id}], format='json').status_code, 403)
+            for body in ([], [{'book_id': 'one'}], {'mode': 'some', 'operations': [{'book_id': 1}]}):
+                self.assertEqual(self.api.patch(url, body, format='json').status_code, 400, body)
+
+
+class OpenAPISchemaTests(TestCase):
+    def setUp(self):
+        from contextlib import redirect_stderr
+        from . import openapi
+        self.openapi = openapi
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        overridden = override_settings(OPENAPI_SCHEMA_DIR=self.directory)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        openapi.reset()
+        self.addCleanup(openapi.reset)
+        quiet = redirect_stderr(StringIO()) #drf-spectacular prints its warnings about the views on every generation
+        quiet.__enter__()
+        self.addCleanup(quiet.__exit__, None, None, None)
+
+    def test_served_from_the_precomputed_file(self):
+        call_command('generate_openapi_schema', stdout=StringIO())
+        self.assertEqual(sorted(os.listdir(self.directory)), ['schema.json', 'schema.meta.json', 'schema.yaml'])
+        with mock.patch.object(self.openapi, 'generate') as generate:
+            response = self.client.get('/api/schema/')
+            self.client.get('/api/schema/?format=json')
+        generate.assert_not_called()
+        self.assertEqual(response['Content-Type'], 'application/vnd.oai.openapi')
+        self.assertIn(b'/stbookinventory/read/api/', response.content)
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.client.get('/api/schema/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        as_json = self.client.get('/api/schema/', HTTP_ACCEPT='application/vnd.oai.openapi+json')
+        self.assertIn('/stbookinventory/read/api/', as_json.json()['paths'])
+        self.assertNotEqual(as_json['ETag'], response['ETag'])
+
+        version = self.openapi.current().version
+        self.assertIn(f'/api/schema/?v\\u003D{version}', self.client.get('/api/schema/docs/').content.decode())
+        self.assertIn('immutable', self.client.get(f'/api/schema/?v={version}')['Cache-Control'])
+
+    def test_missing_or_stale_schema_is_generated(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_openapi_schema', check=True, stdout=StringIO())
+        self.assertEqual(self.client.get('/api/schema/').status_code, 200) #Generated by the first request and written for the next worker
+        call_command('generate_openapi_schema', check=True, stdout=StringIO())
+
+        with open(os.path.join(self.directory, 'schema.meta.json')) as handle:
+            meta = json.load(handle)
+        meta['fingerprint'] = 'from an older URLconf'
+        with open(os.path.join(self.directory, 'schema.meta.json'), 'w') as handle:
+            json.dump(meta, handle)
+        self.openapi.reset()
+        with self.assertRaises(CommandError):
+            call_command('generate_openapi_schema', check=True, stdout=StringIO())
+        self.client.get('/api/schema/')
+        self.assertTrue(self.openapi.is_current(self.openapi.read()))
+
+    def test_fingerprint_follows_the_urlconf(self):
+        before = self.openapi.fingerprint()
+        with mock.patch.object(self.openapi, '_patterns', return_value=iter(['new/route/ -> STBookInventory.api_views.new_view'])):
+            self.assertNotEqual(self.openapi.fingerprint(), before)
+        self.assertEqual(self.openapi.fingerprint(), before)
+
+    def test_startup_timings(self):
+        out = StringIO()
+        call_command('startup_timings', max_import_seconds=60, stdout=out)
+        self.assertIn('schema generation', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('startup_timings', max_schema_seconds=0, stdout=StringIO())
+
+
+THROTTLE_TEST_RATES = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={'login_ip': '5/minute', 'login_account': '3/minute', 'forgot_password_ip': '10/hour', 'forgot_password_account': '2/hour', 'password_reset_ip': '2/hour'})
+
+
+@override_settings(REST_FRAMEWORK=THROTTLE_TEST_RATES)
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        throttling.reset()
+        cache.clear()
+        self.user = make_user(email='reader@example.com')
+
+    def tearDown(self):
+        throttling.reset()
+        cache.clear()
+
+    def login(self, email='reader@example.com', password='wrong', address='10.0.0.1'):
+        return self.client.post('/stbookinventory/login', {'email': email, 'password': password}, content_type='application/json', REMOTE_ADDR=address)
+
+    def test_account_bucket_rejects_before_any_work(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 404) #Wrong password
+        with mock.patch.object(User, 'check_password') as check_password, CaptureQueriesContext(connection) as queries:
+            response = self.login(password='pass12345')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        check_password.assert_not_called() #No password hash
+        self.assertEqual(len(queries), 0) #and not a single query
+        self.assertEqual(self.login(email='READER@example.com ', address='10.0.0.2').status_code, 429) #Another address, same account
+        self.assertEqual(self.login(email='other@example.com', address='10.0.0.2').status_code, 404) #Other accounts are not affected
+
+    def test_ip_bucket_and_refill(self):
+        now = [1000.0]
+        with mock.patch.object(throttling.TokenBucketThrottle, 'timer', lambda self: now[0]):
+            for n in range(5):
+                self.assertEqual(self.login(email=f'nobody{n}@example.com').status_code, 404)
+            self.assertEqual(self.login(email='nobody9@example.com').status_code, 429) #One address trying many accounts
+            now[0] += 12 #'5/minute' gives one token back every 12 seconds
+            self.assertEqual(self.login(email='nobody10@example.com').status_code, 404)
+            self.assertEqual(self.login(email='nobody11@example.com').status_code, 429)
+
+    @override_settings(REST_FRAMEWORK=dict(THROTTLE_TEST_RATES, NUM_PROXIES=1))
+    def test_forwarded_for_behind_a_proxy(self):
+        def login(spoofed):
+            return self.client.post('/stbookinventory/login', {'email': f'{spoofed}@example.com', 'password': 'x'}, content_type='application/json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'{spoofed}, 203.0.113.7') #The proxy adds the real address last
+        statuses = [login(f'198.51.100.{n}').status_code for n in range(6)]
+        self.assertEqual(statuses, [404] * 5 + [429]) #Made up entries in front do not give a new bucket
+        self.assertEqual(self.client.post('/stbookinventory/login', {'email': 'a@example.com', 'password': 'x'}, content_type='application/json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.8').status_code, 404) #Another client behind the same proxy
+
+    def test_forwarded_for_ignored_by_default(self):
+        self.assertEqual(settings.REST_FRAMEWORK['NUM_PROXIES'], 0)
+        def login(spoofed):
+            return self.client.post('/stbookinventory/login', {'email': f'{spoofed}@example.com', 'password': 'x'}, content_type='application/json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=spoofed) #No proxy in front, the client writes the header itself
+        statuses = [login(f'198.51.100.{n}').status_code for n in range(6)]
+        self.assertEqual(statuses, [404] * 5 + [429]) #A new made up address per request still lands in the bucket of 10.0.0.1
+
+    @override_settings(THROTTLE_STORE='memory')
+    def test_empty_marks_cleared_by_another_thread(self):
+        class ClearedAfterRead(dict): #Another thread runs the 10000 entry clean up (or reset()) right after this thread read its mark
+            def get(self, key, default=None):
+                value = super().get(key, default)
+                self.clear()
+                return value
+        self.assertEqual(throttling.take('throttle_test', 1, 0.5, 1000.0), 0)
+        self.assertEqual(throttling.take('throttle_test', 1, 0.5, 1000.0), 2.0) #Empty, marked until 1002
+        with mock.patch.object(throttling, '_empty_until', ClearedAfterRead(throttling._empty_until)):
+            self.assertEqual(throttling.take('throttle_test', 1, 0.5, 1001.0), 1.0) #No KeyError
+
+    def test_forgot_password_and_reset(self):
+        for _ in range(2):
+            self.assertEqual(self.client.post('/stbookinventory/forgot_password/', {'email': self.user.email}, content_type='application/json').status_code, 200)
+        self.assertEqual(self.client.post('/stbookinventory/forgot_password/', {'email': self.user.email}, content_type='application/json').status_code, 429)
+        self.assertEqual(OutgoingEmail.objects.count(), 2) #No third email queued
+        for expected in (400, 400, 429):
+            self.assertEqual(self.client.post('/stbookinventory/password_reset/guessed/', {'new_password': 'x'}, content_type='application/json').status_code, expected)
+
+    def test_cache_failure_falls_back_to_memory(self):
+        with mock.patch.object(throttling.cache, 'get', side_effect=ConnectionError), mock.patch.object(throttling.cache, 'set', side_effect=ConnectionError):
+            statuses = [self.login().status_code for _ in range(4)]
+        self.assertEqual(statuses, [404, 404, 404, 429])
+
+    def test_rejection_costs_microseconds(self):
+        from rest_framework.test import APIRequestFactory
+        from rest_framework.request import Request
+        from rest_framework.parsers import JSONParser
+        view = mock.Mock(kwargs={})
+        throttles = [throttle() for throttle in throttling.throttles_for('login')]
+        def attempt():
+            request = Request(APIRequestFactory().post('/stbookinventory/login', {'email': 'reader@example.com', 'password': 'x'}, format='json'), parsers=[JSONParser()])
+            return [throttle.allow_request(request, view) for throttle in throttles]
+        for _ in range(3):
+            attempt()
+        self.assertEqual(attempt(), [True, False])
+        rounds = 1000
+        started = time.perf_counter()
+        for _ in range(rounds):
+            attempt()
+        per_request = (time.perf_counter() - started) / rounds
+        self.assertLess(per_request, 0.001, f'A rejected request took {per_request * 1e6:.0f}us in the throttles') #Building the request and parsing its JSON included. A password hash alone is tens of milliseconds
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={}))
+class AccountCreationTests(TestCase):
+    def test_signup_is_one_transaction_of_two_inserts(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/stbookinventory/signup', {'email': 'new@example.com', 'password': 'pass12345'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in queries if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(writes), 2, writes) #The user and its token, no UPDATE
+        self.assertTrue(writes[0].startswith('INSERT INTO "STBookInventory_user"'))
+        self.assertNotIn('pass12345', ' '.join(str(query) for query in queries)) #The plain password never reaches the database
+        user = User.objects.get(email='new@example.com')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(Token.objects.get(user=user).key, response.json()['token'])
+        self.assertEqual(self.client.post('/stbookinventory/signup', {'email': 'new@example.com', 'password': 'x'}, content_type='application/json').status_code, 400)
+
+    def test_hash_cost_is_configurable_and_old_hashes_upgrade(self):
+        user = make_user(email='old@example.com')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            response = self.client.post('/stbookinventory/login', {'email': 'old@example.com', 'password': 'pass12345'}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$')) #Rehashed with the new cost at login
+
+    def test_import_users(self):
+        from django.contrib.auth.models import Group
+        Group.objects.create(name='Readers')
+        make_user(email='taken@example.com')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as handle:
+            handle.write('email,password,name,account_type,groups\n'
+                         'ada@example.com,secret123,Ada,Staff Member,Readers;Volunteers\n'
+                         'bob@example.com,,Bob,,Readers\n'
+                         'taken@example.com,x,,,\n'
+                         'not an email,x,,,\n'
+                         'eve@example.com,x,,Wizard,\n')
+        self.addCleanup(os.remove, handle.name)
+
+        out = StringIO()
+        call_command('import_users', handle.name, stdout=out)
+        self.assertIn('1 users created, 4 rows rejected', out.getvalue())
+        self.assertIn('line 2: unknown group(s) Volunteers', out.getvalue())
+
+        out = StringIO()
+        call_command('import_users', handle.name, create_groups=True, processes=2, batch_size=1, stdout=out)
+        self.assertIn('1 users created, 4 rows rejected', out.getvalue()) #Bob was created by the first run
+        ada, bob = User.objects.get(email='ada@example.com'), User.objects.get(email='bob@example.com')
+        self.assertTrue(ada.check_password('secret123'))
+        self.assertEqual((ada.name, ada.account_type), ('Ada', User.AccountType.STAFF_MEMBER))
+        self.assertEqual(sorted(ada.groups.values_list('name', flat=True)), ['Readers', 'Volunteers'])
+        self.assertFalse(bob.has_usable_password())
+        self.assertEqual(bob.account_type, User.AccountType.GENERAL_USER)
+        self.assertEqual(Token.objects.filter(user__in=[ada, bob]).count(), 2)
+
+    def test_hash_passwords_in_processes(self):
+        from django.contrib.auth.hashers import check_password
+        from . import accounts
+        hashed = accounts.hash_passwords(['one', '', 'two', 'three'], processes=2)
+        self.assertEqual([check_password(password, encoded) for password, encoded in zip(['one', 'two', 'three'], hashed[:1] + hashed[2:])], [True, True, True])
+        self.assertTrue(hashed[1].startswith('!')) #Unusable
+
+
+class SparseFieldsTests(QueryCountMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(email='mobile@example.com')
+        self.books = [make_book(self.user, isbn=f'70000000000{n:02d}', title=f'Sparse {n}') for n in range(3)]
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_list_selects_and_returns_only_the_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.api.get('/stbookinventory/read/api/?fields=title,id')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0], {'id': self.books[0].id, 'title': 'Sparse 0'}) #In BookSerializer's order
+        select = [query['sql'] for query in queries if '"STBookInventory_book"."title"' in query['sql']][-1]
+        self.assertNotIn('"isbn"', select)
+        self.assertNotIn('"available_copies"', select)
+
+    def test_cursor_pages_without_the_cursor_columns(self):
+        response = self.api.get('/stbookinventory/read/api/?pagination=cursor&page_size=2&fields=isbn')
+        self.assertEqual(response.json()['results'], [{'isbn': book.isbn} for book in self.books[:2]])
+        response = self.api.get(response.json()['next'])
+        self.assertEqual(response.json()['results'], [{'isbn': self.books[2].isbn}])
+
+    def test_book_and_search(self):
+        book = self.books[1]
+        response = self.api.get(f'/stbookinventory/read/api/{book.id}/?fields=id,available_copies')
+        self.assertEqual(response.json(), {'id': book.id, 'available_copies': 1})
+        self.assertEqual(self.api.get(f'/stbookinventory/read/api/{book.id}/?fields=id,available_copies', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.api.get(f'/stbookinventory/read/api/{book.id}/').json()['title'], 'Sparse 1') #Not the cached sparse copy
+        response = self.api.get('/stbookinventory/search/api/?query=Sparse&fields=title')
+        self.assertEqual(sorted(result['title'] for result in response.json()['results']), ['Sparse 0', 'Sparse 1', 'Sparse 2'])
+        self.assertEqual(set(response.json()['results'][0]), {'title'})
+
+    def test_unknown_field_is_a_400(self):
+        for url in ('/stbookinventory/read/api/?fields=id,password', f'/stbookinventory/read/api/{self.books[0].id}/?fields=', '/stbookinventory/search/api/?query=x&fields=nope'):
+            response = self.api.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('fields', response.json())
+
+
+@override_settings(COMPRESSION_MIN_SIZE=500)
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(email='gzip@example.com')
+        Book.objects.bulk_create([Book(isbn=f'71000000000{n:02d}', title=f'Compressed book {n}', author='Someone', available_copies=1, user=self.user) for n in range(30)])
+        self.api = APIClient()
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=self.user).key)
+        self.url = '/stbookinventory/read/api/?page_size=30'
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_negotiation(self):
+        from . import compression
+        plain = self.api.get(self.url)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        zipped = self.api.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(zipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.content), plain.content)
+        self.assertEqual(zipped['ETag'], 'W/' + plain['ETag'])
+        self.assertEqual(self.api.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=zipped['ETag']).status_code, 304)
+
+        self.assertEqual(compression.choose_encoding('gzip;q=0, identity'), None)
+        self.assertEqual(compression.choose_encoding('*;q=0.5, gzip;q=0.1'), 'br' if compression.brotli else 'gzip')
+        if compression.brotli is not None:
+            brotli = self.api.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(brotli['Content-Encoding'], 'br')
+            self.assertEqual(compression.brotli.decompress(brotli.content), plain.content)
+            self.assertEqual(self.api.get(self.url, HTTP_ACCEPT_ENCODING='br;q=0.5, gzip')['Content-Encoding'], 'gzip')
+
+    def test_threshold_and_streaming(self):
+        small = self.api.get('/stbookinventory/read/api/?page_size=1', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(small.has_header('Content-Encoding'))
+        admin = make_user(email='export-gzip@example.com', account_type=User.AccountType.ADMIN)
+        self.api.credentials(HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=admin).key)
+        response = self.api.get('/stbookinventory/export/api/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        self.assertEqual(len(lines), 30)
@@ -0,0 +1,139 @@
+#Token bucket throttling for the unauthenticated account endpoints (login, signup, forgot_password, password_reset). Each of them
+#is expensive: login hashes the password (PBKDF2, tens of milliseconds of CPU on purpose), forgot_password looks the user up and
+#queues an email. A credential stuffing burst would keep every worker busy hashing. The throttles run in DRF's check_throttles,
+#before the view, so a rejected request costs no hashing and no database query.
+#Every endpoint has two buckets: one per client IP and one per account (the email in the body, or the reset token in the URL),
+#so one address cannot try many accounts and many addresses cannot hammer one account. A bucket holds `capacity` tokens and
+#refills at capacity per period, a request takes one token. The rates are REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], e.g.
+#'login_ip': '30/minute' is a burst of 30 and one more every 2 seconds.
+#The buckets live in the configured cache so all workers share them. When the cache fails (a Redis restart) each worker falls back
+#to buckets in its own memory. A worker also remembers which buckets it has seen empty and until when, so a client that keeps
+#going after its first 429 is turned away from a dict lookup, without touching the cache.
+
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400} #Same rate format as DRF's own throttles: 'number/second|minute|hour|day'
+
+
+def parse_rate(rate):
+    #'30/minute' -> (capacity 30, 0.5 tokens per second)
+    number, period = rate.split('/')
+    capacity = int(number)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+class LocalStore: #The in-memory fallback, private to the worker process. Same get/set calls as the cache
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, key, value, timeout):
+        with self.lock:
+            if len(self.entries) > 10000: #Drop the expired buckets once in a while so the dict cannot grow without bound
+                now = time.monotonic()
+                self.entries = {key: entry for key, entry in self.entries.items() if entry[1] >= now}
+            self.entries[key] = (value, time.monotonic() + timeout)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local = LocalStore()
+_empty_until = {} #bucket key -> time until which this worker knows the bucket has no token. Read by every thread of the worker
+_empty_lock = threading.Lock() #Held while _empty_until is changed. Reads take one .get() and never see a key vanish half way
+
+
+def reset(): #Forgets this worker's buckets and empty marks (tests). The shared buckets are in the cache
+    _local.clear()
+    with _empty_lock:
+        _empty_until.clear()
+
+
+def take(key, capacity, refill, now):
+    #Takes a token from the bucket. Returns 0 when there was one, otherwise the seconds until the next token
+    until = _empty_until.get(key, 0) #One lookup: another thread may clear the dict between two
+    if until > now:
+        return until - now
+    store = cache if settings.THROTTLE_STORE == 'cache' else _local
+    try:
+        state = store.get(key)
+    except Exception: #The cache is down. Keep throttling with this worker's own buckets rather than letting everything through
+        store, state = _local, _local.get(key)
+    tokens, stamp = state if state is not None else (capacity, now)
+    tokens = min(capacity, tokens + (now - stamp) * refill)
+    if tokens < 1:
+        wait = (1 - tokens) / refill
+        with _empty_lock:
+            if len(_empty_until) > 10000:
+                _empty_until.clear()
+            _empty_until[key] = now + wait
+        return wait
+    #Read then write, not atomic: two workers that read the same state both take the same token. Under a burst a bucket lets a few
+    #more requests through than its capacity (at most one per worker at a time), it never turns away a client that still has tokens
+    try:
+        store.set(key, (tokens - 1, now), timeout=int(capacity / refill) + 1) #Expires once it would have refilled completely anyway
+    except Exception:
+        _local.set(key, (tokens - 1, now), timeout=int(capacity / refill) + 1)
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None #Set by throttles_for(), e.g. 'login_ip'
+    timer = time.time
+
+    def get_key(self, request, view): #None skips the bucket (e.g. no email in the body, the view then answers 400 anyway)
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if not rate or getattr(request, '_throttled', False): #DRF asks every throttle even after one said no. The request is refused already, it should not use up the account's tokens too
+            return True
+        key = self.get_key(request, view)
+        if key is None:
+            return True
+        capacity, refill = parse_rate(rate)
+        self.wait_seconds = take(f'throttle_{self.scope}_{key}', capacity, refill, self.timer())
+        request._throttled = self.wait_seconds > 0
+        return not request._throttled
+
+    def wait(self): #DRF puts this in the Retry-After header of the 429
+        return self.wait_seconds
+
+
+class IPThrottle(TokenBucketThrottle):
+    def get_key(self, request, view):
+        return self.get_ident(request) #REMOTE_ADDR, or X-Forwarded-For behind REST_FRAMEWORK['NUM_PROXIES'] proxies
+
+
+class AccountThrottle(TokenBucketThrottle):
+    def get_key(self, request, view):
+        account = view.kwargs.get('token') #password_reset/<token>/. Its body is read by the view itself, so it is not parsed here
+        if account is None:
+            data = request.data
+            account = data.get('email') if isinstance(data, dict) else None
+        if not isinstance(account, str) or not account:
+            return None
+        return hashlib.sha256(account.strip().lower().encode('utf-8')).hexdigest() #Emails and reset tokens are not put in cache keys as they are
+
+
+def throttles_for(endpoint):
+    #The throttle classes for an endpoint, for @throttle_classes: its '<endpoint>_ip' and '<endpoint>_account' buckets
+    return [
+        type(f'{endpoint.title()}{base.__name__}', (base,), {'scope': f'{endpoint}_{suffix}'})
+        for base, suffix in ((IPThrottle, 'ip'), (AccountThrottle, 'account'))
+    ]
@@ -16,8 +16,16 @@ urlpatterns = [
     path('create/api/',api_views.add_book_view, name='create_book_api'), #This is an API POST request
     path('read/api/<int:book_id>/',api_views.get_book_view, name='read_book_api'), #This is an API GET request
     path('read/api/',api_views.get_all_books_view, name='read_all_books_api'), #This is an API GET request
+    path('search/api/',api_views.search_books_view, name='search_books_api'), #This is an API GET request (?query=...)
+    path('inventory/api/',api_views.inventory_summary_view, name='inventory_summary_api'), #This is an API GET request
     path('update/api/<int:book_id>/',api_views.update_book_view, name='update_book_api'), #This is an API UPDATE request
     path('checkout/api/<int:book_id>/',api_views.checkout_book_view, name='update_book_api'),
+    path('checkout/api/bulk/',api_views.bulk_checkout_view, name='bulk_checkout_api'), #This is an API PATCH request (a list of books)
+    path('update/api/bulk/',api_views.bulk_update_view, name='bulk_update_api'), #This is an API PATCH request (a list of updates)
+    path('return/api/<int:book_id>/',api_views.return_book_view, name='return_book_api'), #This is an API PATCH request
+    path('loans/api/',api_views.loans_view, name='loans_api'), #This is an API GET request
+    path('export/api/',api_views.export_view, name='export_api'), #This is an API GET request (streams NDJSON or CSV)
+    path('metrics/', views.metrics, name='metrics'), #Prometheus text format, see instrumentation.py
     path('delete/api/<int:book_id>/',api_views.delete_book_view, name='delete_book_api'), #This is an API DELETE request
     re_path('login',api_views.login),
     re_path('logout',api_views.logout),
@@ -0,0 +1,90 @@
+#Conditional GET (ETag / Last-Modified) support for the book read endpoints. Every Book row carries a version that goes up with
+#every change to it (Book.save and BookQuerySet.update_with_version), and the CatalogueVersion row 'books' goes up with every
+#write to any book. A client that sends back the ETag it got (If-None-Match) or the Last-Modified date (If-Modified-Since) is
+#answered 304 Not Modified after reading just that version, without loading or serializing any book.
+#The catalogue version goes up once the write's transaction has committed (transaction.on_commit), never inside it: a reader
+#that sees the new version also sees the new books, so it can not cache a page of old books under the new version (see
+#response_cache.py). It also keeps the one CatalogueVersion row out of the write transactions, where its row lock would make
+#every write to any book wait for the one before it.
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .models import Book, CatalogueVersion
+
+
+CATALOGUE = 'books'
+
+
+class _PendingBump: #Shared by the bump_catalogue calls of one transaction, kept on its connection
+    def __init__(self):
+        self.open = True #Closed by the first of its callbacks to run after the commit, the others then have nothing left to do
+
+
+def bump_catalogue():
+    #Called by every write to the Book table (signals.py, the bulk add and import paths and the checkout/return services).
+    #The bump runs after the current transaction commits (straight away outside one), once however many writes the transaction made.
+    #Every call queues a callback, so a savepoint rolled back with some of them still leaves the others. One left open by a rolled
+    #back transaction is reused by the next one, none of its callbacks ever ran
+    connection = transaction.get_connection()
+    pending = getattr(connection, '_catalogue_bump', None)
+    if pending is None or not pending.open:
+        pending = connection._catalogue_bump = _PendingBump()
+    transaction.on_commit(lambda: _bump(pending))
+
+
+def _bump(pending):
+    if not pending.open:
+        return
+    pending.open = False
+    updated = CatalogueVersion.objects.filter(name=CATALOGUE).update(version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        CatalogueVersion.objects.get_or_create(name=CATALOGUE)
+
+
+def catalogue_version():
+    #Returns (version, updated_at) of the whole catalogue
+    try:
+        return CatalogueVersion.objects.values_list('version', 'updated_at').get(name=CATALOGUE)
+    except CatalogueVersion.DoesNotExist: #Nothing was written since the database was created
+        row = CatalogueVersion.objects.get_or_create(name=CATALOGUE)[0]
+        return row.version, row.updated_at
+
+
+def book_version(book_id):
+    #Returns (version, updated_at) of one book, or None when it does not exist
+    return Book.objects.filter(pk=book_id).values_list('version', 'updated_at').first()
+
+
+def representation(request):
+    #The format DRF's content negotiation picked for the response (json, or api for the browsable API). The same version
+    #rendered as JSON and as an HTML page are two different responses, so each gets its own ETag and response cache entry
+    renderer = getattr(request, 'accepted_renderer', None)
+    return renderer.format if renderer is not None else 'html' #The template views (views.py) only render HTML
+
+
+def book_etag(book_id, version, request):
+    return quote_etag(f'book-{book_id}-v{version}-{representation(request)}')
+
+
+def catalogue_etag(version, request):
+    return quote_etag(f'books-v{version}-{representation(request)}') #The same for every page: pages only change when the catalogue does
+
+
+def is_conditional(request):
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def not_modified(request, etag, updated_at):
+    #Returns a 304 response when the client's copy is still current, None when the view has to build the response.
+    #If-None-Match wins when both headers are sent: Last-Modified only has whole seconds, so it misses a second write within the same second
+    return get_conditional_response(request, etag=etag, last_modified=int(updated_at.timestamp()))
+
+
+def set_validators(response, etag, updated_at):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(updated_at.timestamp())
+    return response
@@ -3,8 +3,12 @@
 
 # Create your views here.
 
-from django.shortcuts import render, redirect
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
 from .models import Book
+from . import response_cache, versioning
 
 # Create a form for adding books
 from .forms import BookForm  
@@ -53,14 +57,30 @@ def update_book(request, book_id):
 
 #Create a view to get a single book
 def get_book(request, book_id):
+    current = versioning.book_version(book_id) #The page is cached per version of the book (see response_cache.py)
+    key, html = response_cache.get('list_book', current, request, book_id) if current else (None, None)
+    if html is not None:
+        return HttpResponse(html)
     book = Book.objects.get(pk=book_id)
-    return render(request, 'STBookInventory/book_detail.html', {'book': book})
+    response = render(request, 'STBookInventory/book_detail.html', {'book': book})
+    if current and book.version == current[0]: #Not changed since the version was read
+        response_cache.set(key, response.content)
+    return response
+
+
+def list_page_books(): #The books of the list page (also EXPLAINed by query_audit.py). The template shows who added each book, select_related fetches those users in the same query (a JOIN) instead of one extra query per book
+    return Book.objects.select_related('user')
 
 
 #Create a view to list all books
 def get_books(request):
-    books = Book.objects.all()
-    return render(request, 'STBookInventory/book_list.html', {'books': books})
+    key, html = response_cache.get('list_books', versioning.catalogue_version(), request) #The page is the same for everyone, so the rendered HTML is cached until the next write to any book
+    if html is not None:
+        return HttpResponse(html)
+    books = list_page_books()
+    response = render(request, 'STBookInventory/book_list.html', {'books': books})
+    response_cache.set(key, response.content)
+    return response
 
 
 #Create a view to delete a book
@@ -73,31 +93,22 @@ def delete_book(request, book_id):
 
 
 
-from .models import BookCheckout
+from . import services
+from . import search
+from django.contrib.auth.decorators import login_required
+
+
+@login_required(login_url='rest_framework:login') #The checkout and return are recorded for request.user, so an anonymous visitor is sent to the login page (the browsable API one, api-auth/login/) and comes back here afterwards
 def checkout_book(request, book_id):
-#it goes into the BookCheckout model to pick up the respective book_id the viewer inputted
-    book = Book.objects.get(pk=book_id)
-#The method needs to be a post request specified in the html file also
-    if book.available_copies > 0:
-        # Assuming you have a BookCheckout model to track checkouts, create a new checkout instance.
-        # You'll need to pass the user who is checking out the book (e.g., request.user).
-        # This code assumes you're using Django's built-in authentication system.
-        
-        # from .models import BookCheckout  # Import the BookCheckout model
-       
-        # Create a new checkout instance
-        checkout = BookCheckout(book=book, user=request.user)  # Pass the book and user
-        #form = BookForm(request.POST, instance=book)
-        # Save the checkout instance to the database
-        checkout.save()
-        
-        # Decrease available copies when a book is checked out 
-        #out at the same time? I will get back to this later
-        book.update_available_copies(increment=-1)
-        
+#The checkout service decrements available_copies inside the database (never below zero) and records
+#the BookCheckout row in the same transaction, so two people grabbing the last copy at once can not both get it.
+    result, checkout = services.checkout_book(book_id, request.user)  # Pass the book id and the user checking it out
+
+    if result == services.CHECKOUT_OK:
         # Redirect to a success or confirmation page
-        #return redirect('STBookInventory/checkout_success.html')
         return render(request, 'STBookInventory/checkout_success.html')
+    elif result == services.CHECKOUT_NOT_FOUND:
+        raise Http404("Book does not exist")
     else:
         # Handle the case where no copies are available
         # You can return an error or a message to the user
@@ -105,29 +116,19 @@ def checkout_book(request, book_id):
 
 
 
-#The return view likewise, uses the Book Model
-#We are goint to use the Book Model to Update the Total number of books now that a certain book is returned
-#we define a function called return_book which takes two parameters
+#The return view closes the user's open checkout of this book and puts the copy back in stock (see services.return_book).
+#A GET shows a confirmation page, the POST from that page does the return.
+@login_required(login_url='rest_framework:login')
 def return_book(request, book_id):
-    book = Book.objects.get(pk=book_id)    
+    book = get_object_or_404(Book, pk=book_id)
 
-#This conditional statement checks if the HTTP request method is a POST request. 
-#In Django, POST requests are typically used when submitting form data to the server.    
     if request.method == 'POST':
-#When the request is a POST request, it means the user is submitting data to update the book. 
-#To handle this, a BookForm instance is created using the data from the POST request (request.POST) and
-#the existing book object (instance=book). This allows the form to be pre-populated with the current book's data.        
-        
-        form = BookForm(request.POST, instance=book)
-        if form.is_valid():
-            form.save()
-            return redirect('list_books')
-#    If the request is not a POST request (i.e., it's a GET request), the view creates a new BookForm instance 
-# using the book's data as an initial instance. This means that when a user accesses the update page, the form
-#  will be pre-filled with the existing book's data, allowing them to make modifications.        
-    else:
-        form = BookForm(instance=book)
-    return render(request, 'STBookInventory/update_book.html', {'form': form})
+        result, checkout = services.return_book(book_id, request.user)
+        if result == services.RETURN_OK:
+            return redirect('list_book', book_id=book_id)
+        return render(request, 'STBookInventory/return_book.html', {'book': book, 'error': "You don't have this book checked out."})
+
+    return render(request, 'STBookInventory/return_book.html', {'book': book})
 
 
 
@@ -136,6 +137,38 @@ def search_results(request): #This line defines a view function named search_res
     books = None #Initializes the variable books to None. This variable will later be used to store the search results.
 
     if query: #Checks if a search query was provided. If query is not None or an empty string, the code inside the if block will be executed.
-        books = Book.objects.filter(title__icontains=query) #If a search query is provided, this line performs a case-insensitive search (icontains) on the 'title' field of the Book model. It retrieves all books whose titles contain the provided search query.
-
-    return render(request, 'search_results.html', {'books': books, 'query': query}) #Finally, the view returns a rendered HTML page using the render function. The template used is 'search_results.html', and it is passed a context dictionary containing the search results (books) and the original search query (query). The context dictionary allows you to pass data from the view to the template, making it accessible for rendering in the HTML page.
\ No newline at end of file
+        books = search.search_books(query) #If a search query is provided, this looks the query up in the search index (title and author words, exact or leading digits of an ISBN) and returns the best matches first. See search.py
+
+    return render(request, 'search_results.html', {'books': books, 'query': query}) #Finally, the view returns a rendered HTML page using the render function. The template used is 'search_results.html', and it is passed a context dictionary containing the search results (books) and the original search query (query). The context dictionary allows you to pass data from the view to the template, making it accessible for rendering in the HTML page.
+
+
+def metrics(request): #Prometheus scrape target. Per view request counts and timings collected by instrumentation.PerformanceMiddleware
+    from .instrumentation import metrics_text
+    token = settings.PERFORMANCE_METRICS_TOKEN
+    if not token or not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'): #Closed until PERFORMANCE_METRICS_TOKEN is set, then Prometheus has to send the same bearer token
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def openapi_schema(request): #api/schema/. Serves the precomputed schema (see openapi.py), YAML unless ?format=json or an Accept header asks for JSON
+    from django.utils.cache import get_conditional_response
+    from . import openapi
+    schema = openapi.current()
+    name = 'json' if request.GET.get('format') == 'json' or 'json' in request.META.get('HTTP_ACCEPT', '') else 'yaml'
+    etag = f'"{schema.version}-{name}"'
+    unchanged = get_conditional_response(request, etag=etag) #The client already has this schema: 304 with no body
+    response = unchanged or HttpResponse(schema.bodies[name], content_type=openapi.FORMATS[name].media_type)
+    response['ETag'] = etag
+    if request.GET.get('v') == schema.version: #A versioned URL (the Swagger UI uses one) never changes content, browsers may keep it without asking again
+        response['Cache-Control'] = f'public, max-age={settings.OPENAPI_SCHEMA_MAX_AGE}, immutable'
+    else: #The plain URL changes with every deploy, so clients keep it but check the ETag each time (a 304 when nothing changed)
+        response['Cache-Control'] = 'public, no-cache'
+    return response
+
+
+from drf_spectacular.views import SpectacularSwaggerView
+class SchemaSwaggerView(SpectacularSwaggerView): #api/schema/docs/. The Swagger UI page, pointed at the versioned schema URL so a page load does not fetch the schema again
+    def _get_schema_url(self, request):
+        from drf_spectacular.plumbing import set_query_parameters
+        from . import openapi
+        return set_query_parameters(super()._get_schema_url(request), v=openapi.current().version)
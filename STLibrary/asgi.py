@@ -5,6 +5,20 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Run profiles (pip install uvicorn):
+
+    uvicorn STLibrary.asgi:application --workers 4 --no-access-log
+    gunicorn STLibrary.asgi:application --workers 4 --worker-class uvicorn.workers.UvicornWorker   (the uvicorn-worker package on newer uvicorn releases)
+
+Every view of this project is sync: Django 3.2 has no async ORM, so an async view could only hand its queries to a thread pool,
+which measured slower than the sync views. Django 3.2 runs every sync view of an ASGI worker on one shared thread, so the
+WSGI profile is the one to deploy. Async views that query the database need the async ORM of Django 4.1+ (aget, afirst), which
+this project does not run on:
+
+    gunicorn STLibrary.wsgi:application --workers 4 --threads 8
+
+Compare the two with `python manage.py benchmark_concurrency` against a running server.
 """
 
 import os
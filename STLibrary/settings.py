@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'STBookInventory.instrumentation.PerformanceMiddleware', #First, so its timings include all the other middleware
+    'STBookInventory.compression.CompressionMiddleware', #br/gzip for clients that accept it (see STBookInventory/compression.py)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -59,7 +61,7 @@ ROOT_URLCONF = 'STLibrary.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'STBookInventory.instrumentation.TimedDjangoTemplates', #django's own template backend, plus render timing for PerformanceMiddleware
         'DIRS': [BASE_DIR, 'templates/',],   #is used to specify a list of directories where Django should look for template files. BASE_DIR: This is a variable that typically represents the base directory of your Django project. It's defined in your project's settings.py and is set to the directory containing the settings.py. This is a relative path indicating that Django should also look for templates in a directory named "templates" located within your project's base directory (BASE_DIR).
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,12 +81,81 @@ WSGI_APPLICATION = 'STLibrary.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_ENGINE=sqlite (the default) is for development. SQLite lets one connection write at a time, so every checkout and
+# book insert of every gunicorn worker waits in line. DATABASE_ENGINE=postgres is the production profile.
+# `python manage.py load_test_writes` measures write throughput on whichever one is configured.
+
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='sqlite')
+DATABASE_POOLER = config('DATABASE_POOLER', default='') #'pgbouncer' when DATABASE_HOST/PORT point at a PgBouncer running in transaction pooling mode
+DATABASE_HEALTH_CHECKS = config('DATABASE_HEALTH_CHECKS', default=True, cast=bool) #Check a persistent connection still works before a request uses it (see signals.py). Django 4.1+ has CONN_HEALTH_CHECKS for this, 3.2 does not
+
+if DATABASE_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DATABASE_NAME', default='stlibrary'),
+            'USER': config('DATABASE_USER', default='stlibrary'),
+            'PASSWORD': config('DATABASE_PASSWORD', default=''),
+            'HOST': config('DATABASE_HOST', default='127.0.0.1'),
+            'PORT': config('DATABASE_PORT', default='5432'), #PgBouncer usually listens on 6432
+            'CONN_MAX_AGE': config('DATABASE_CONN_MAX_AGE', default=60, cast=int), #Seconds a worker keeps its connection open between requests instead of reconnecting every time (0 closes it after each request)
+            'DISABLE_SERVER_SIDE_CURSORS': DATABASE_POOLER == 'pgbouncer', #A named cursor (used by .iterator()) does not survive PgBouncer handing the server connection to another client between transactions
+            'OPTIONS': {'connect_timeout': config('DATABASE_CONNECT_TIMEOUT', default=5, cast=int)},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {'timeout': config('SQLITE_BUSY_TIMEOUT', default=20, cast=int)}, #Seconds a write waits for the lock held by another connection before failing with "database is locked" (the default is 5)
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'}, #A file (not in-memory) test database so the threaded checkout tests get real locking between connections
+        }
+    }
+SQLITE_JOURNAL_MODE = config('SQLITE_JOURNAL_MODE', default='') #Set on every new SQLite connection when not empty (see signals.py). WAL: readers no longer block the writer, or the writer the readers. The mode is written into the database file, so it is opt-in: empty leaves the file's own mode (the tracked dev db.sqlite3 uses the default rollback journal)
+
+
+# Cache
+# The password reset tokens, the cached token authentication, the throttle buckets and the response caches all use the default cache.
+# The default is locmem, the memory of the process: the fastest there is and it needs no extra service, but it is per process,
+# so it only fits a single worker (runserver, or gunicorn with --workers 1 and threads). Several worker processes have to share
+# the cache: CACHE_BACKEND=db uses a database table (run `python manage.py createcachetable` once) and also works across several
+# servers, CACHE_BACKEND=redis needs the django-redis package, CACHE_BACKEND=memcached needs pymemcache.
+# CACHE_BACKEND=file keeps the entries in .django_cache. Every set of a file cache lists the whole directory to cull it, so keep
+# its CACHE_MAX_ENTRIES small; at thousands of entries a set takes milliseconds, more than the queries the cache saves.
+
+CACHE_BACKENDS = {
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / '.django_cache')),
+    'db': ('django.core.cache.backends.db.DatabaseCache', 'stlibrary_cache'),
+    'redis': ('django_redis.cache.RedisCache', 'redis://127.0.0.1:6379/1'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'stlibrary'),
+}
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_BACKENDS[CACHE_BACKEND][1]), #A directory, table name or server address depending on the backend
+        'KEY_PREFIX': 'stlibrary',
+        'TIMEOUT': 300,
     }
 }
+if CACHE_BACKEND in ('file', 'db', 'locmem'): #Django's own backends cull old entries past MAX_ENTRIES (default 300, too small for the db and locmem caches once auth tokens and responses are cached)
+    CACHES['default']['OPTIONS'] = {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=300 if CACHE_BACKEND == 'file' else 10000, cast=int)}
+
+TEST_RUNNER = 'STBookInventory.test_runner.TestRunner' #`manage.py test` runs against a private local memory cache, never the one configured above
+
+
+PASSWORD_HASHERS = [
+    'STBookInventory.hashers.ConfigurablePBKDF2PasswordHasher', #New hashes: PBKDF2-SHA256 with PASSWORD_HASH_ITERATIONS iterations
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+PASSWORD_HASH_ITERATIONS = config('PASSWORD_HASH_ITERATIONS', default=260000, cast=int) #Cost of one password hash (Django 3.2's default). Measure with `python manage.py benchmark_password_hashing` before changing it
+PASSWORD_HASH_PROCESSES = config('PASSWORD_HASH_PROCESSES', default=0, cast=int) #Processes import_users hashes passwords in. 0 means one per CPU
 
 
 # Password validation
@@ -134,16 +205,53 @@ AUTH_USER_MODEL = 'STBookInventory.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'STBookInventory.authentication.CachedTokenAuthentication', #DRF TokenAuthentication with the token -> user id mapping cached for AUTH_TOKEN_CACHE_TIMEOUT seconds
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS' : 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_THROTTLE_RATES': { #Token buckets of the account endpoints, 'burst size/period' (see STBookInventory/throttling.py). Per client IP and per account (email, or reset token)
+        'login_ip': config('THROTTLE_LOGIN_IP', default='30/minute'),
+        'login_account': config('THROTTLE_LOGIN_ACCOUNT', default='5/minute'),
+        'signup_ip': config('THROTTLE_SIGNUP_IP', default='10/hour'),
+        'signup_account': config('THROTTLE_SIGNUP_ACCOUNT', default='3/hour'),
+        'forgot_password_ip': config('THROTTLE_FORGOT_PASSWORD_IP', default='10/hour'),
+        'forgot_password_account': config('THROTTLE_FORGOT_PASSWORD_ACCOUNT', default='3/hour'),
+        'password_reset_ip': config('THROTTLE_PASSWORD_RESET_IP', default='20/hour'),
+        'password_reset_account': config('THROTTLE_PASSWORD_RESET_ACCOUNT', default='5/hour'),
+    },
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int), #Reverse proxies (nginx, a load balancer) in front of the app. 0 (the default) ignores X-Forwarded-For, which a client can fill with anything, and the IP throttles use REMOTE_ADDR. A deployment behind N proxies sets NUM_PROXIES=N so the client address is taken N entries from the end of the header
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 3  # Default page size you want to set
 }
 
 SPECTACULAR_SETTINGS = {'TITLE': 'Django DRF STLibrary'}
 
+THROTTLE_STORE = config('THROTTLE_STORE', default='cache') #'cache': the throttle buckets are shared by all workers through the cache. 'memory': each worker keeps its own (also the automatic fallback when the cache is down)
+
+AUTH_TOKEN_CACHE_TIMEOUT = config('AUTH_TOKEN_CACHE_TIMEOUT', default=60, cast=int) #Seconds a token -> user id mapping stays cached. Logout clears it straight away and the user is read on every request, only a token deleted with raw SQL keeps working this long
+
+LOAN_PERIOD_DAYS = config('LOAN_PERIOD_DAYS', default=14, cast=int) #A checkout that has not been returned after this many days counts as overdue
+
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=600 if CACHE_BACKEND in ('locmem', 'redis', 'memcached') else 0, cast=int) #Seconds a cached catalogue page/book response is kept (see STBookInventory/response_cache.py). Writes make entries obsolete straight away, this only bounds how long unused ones take space. 0 turns the cache off, which is the default on the file and db cache backends: a hit there reads a file or a row, which saves little over building the response
+
+PERFORMANCE_SAMPLE_RATE = config('PERFORMANCE_SAMPLE_RATE', default=0.1, cast=float) #Share of requests (0 to 1) timed by PerformanceMiddleware. Every request is still counted, 0 turns timing off
+PERFORMANCE_SERVER_TIMING = config('PERFORMANCE_SERVER_TIMING', default=True, cast=bool) #Add a Server-Timing header (db, serialize, render, app, total) to the timed responses
+PERFORMANCE_METRICS_FLUSH_INTERVAL = config('PERFORMANCE_METRICS_FLUSH_INTERVAL', default=10, cast=int) #Seconds between copies of a worker's totals to the shared cache, i.e. how stale the other workers' numbers can be
+PERFORMANCE_METRICS_PATH = '/stbookinventory/metrics/'
+PERFORMANCE_METRICS_TOKEN = config('PERFORMANCE_METRICS_TOKEN', default='') #The metrics endpoint requires "Authorization: Bearer <token>". Left empty, it answers 403 to everyone
+
+BOOK_MAX_PAGE_SIZE = config('BOOK_MAX_PAGE_SIZE', default=1000, cast=int) #Largest ?page_size= read/api/ accepts
+COMPRESSION_MIN_SIZE = config('COMPRESSION_MIN_SIZE', default=1024, cast=int) #Responses smaller than this many bytes are sent uncompressed
+COMPRESSION_GZIP_LEVEL = config('COMPRESSION_GZIP_LEVEL', default=6, cast=int) #1 (fastest) to 9 (smallest)
+COMPRESSION_BROTLI_QUALITY = config('COMPRESSION_BROTLI_QUALITY', default=4, cast=int) #0 to 11. Above about 5 brotli gets much slower for little gain on JSON, 11 is meant for static files
+EXPORT_CHUNK_SIZE = config('EXPORT_CHUNK_SIZE', default=2000, cast=int) #Rows fetched from the database at a time by export/api/. Memory use of an export depends on this, not on the size of the table
+OPENAPI_SCHEMA_DIR = config('OPENAPI_SCHEMA_DIR', default=str(BASE_DIR / 'openapi')) #Where generate_openapi_schema writes schema.yaml/schema.json for api/schema/ (see STBookInventory/openapi.py)
+OPENAPI_SCHEMA_MAX_AGE = config('OPENAPI_SCHEMA_MAX_AGE', default=31536000, cast=int) #Seconds browsers keep the versioned schema URL (api/schema/?v=...) the Swagger UI loads
+
+BOOK_BULK_CREATE_BATCH_SIZE = config('BOOK_BULK_CREATE_BATCH_SIZE', default=500, cast=int) #Number of books validated and inserted per bulk_create when books are posted to create/api/
+IMPORT_BATCH_SIZE = config('IMPORT_BATCH_SIZE', default=2000, cast=int) #Rows per transaction (and per checkpoint) of the import_books command
+BULK_OPERATIONS_MAX = config('BULK_OPERATIONS_MAX', default=200, cast=int) #Most operations one request to checkout/api/bulk/ or update/api/bulk/ may carry (they all run in one transaction)
+
 
 
 
@@ -154,4 +262,10 @@ EMAIL_PORT = 587  # Replace with your email port
 EMAIL_USE_TLS = True  # Set to False if your email server doesn't use TLS
 EMAIL_HOST = 'smtp.gmail.com'  # Replace with your email host for gmail -> 'smtp.gmail.com'
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')  # Replace with your email username
-EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')  # Replace with your email password
\ No newline at end of file
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')  # Replace with your email password
+
+# Queued email delivery (see STBookInventory/mail.py). Views queue messages, `python manage.py send_queued_emails --loop` sends them
+EMAIL_QUEUE_MAX_ATTEMPTS = config('EMAIL_QUEUE_MAX_ATTEMPTS', default=5, cast=int) #A message is marked failed after this many attempts
+EMAIL_QUEUE_RETRY_BACKOFF = config('EMAIL_QUEUE_RETRY_BACKOFF', default=30, cast=int) #Seconds before the first retry, doubled after every further failure
+EMAIL_QUEUE_MAX_BACKOFF = config('EMAIL_QUEUE_MAX_BACKOFF', default=3600, cast=int)
+EMAIL_QUEUE_LEASE = config('EMAIL_QUEUE_LEASE', default=300, cast=int) #Seconds a worker holds a claimed message before another worker may retry it